@@ -0,0 +1,165 @@
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize_query(text):
+    """归一化查询文本：全角转半角、小写、去掉标点和空白"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    return _NON_WORD.sub('', text)
+
+
+def char_ngram_vector(normalized_text, n=2):
+    """字符n-gram向量（L2归一化的稀疏字典），中文问句不需要分词也能比较相似度"""
+    if len(normalized_text) < n:
+        grams = Counter([normalized_text]) if normalized_text else Counter()
+    else:
+        grams = Counter(normalized_text[i:i + n] for i in range(len(normalized_text) - n + 1))
+    norm = math.sqrt(sum(v * v for v in grams.values())) or 1.0
+    return {gram: count / norm for gram, count in grams.items()}
+
+
+class SemanticAnswerCache:
+    """
+    问答结果缓存：先按归一化文本精确匹配，再按向量相似度查找近似重复的问题
+
+    支持LRU容量淘汰、TTL过期，以及问答库重建后整体失效。
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=3600, similarity_threshold=0.9, vectorize=char_ngram_vector):
+        """
+        :param max_entries: 最大缓存条目数，超过后淘汰最久未使用的
+        :param ttl_seconds: 条目有效期（秒），None表示不过期
+        :param similarity_threshold: 近似匹配的最低余弦相似度
+        :param vectorize: 把归一化文本转换为L2归一化稀疏向量（字典）的函数
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.vectorize = vectorize
+
+        self._entries = OrderedDict()  # 归一化文本 -> (值, 向量, 写入时间)
+        self._postings = {}  # 向量维度 -> 包含该维度的条目
+        self._version = None
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def check_version(self, version):
+        """问答库版本（如文件指纹）变化时清空缓存"""
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self.invalidations += 1
+                self._clear()
+                self._version = version
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._entries.clear()
+        self._postings.clear()
+
+    def _remove(self, key):
+        _, vector, _ = self._entries.pop(key)
+        for dim in vector:
+            keys = self._postings.get(dim)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[dim]
+
+    def _expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, query):
+        """
+        查找缓存
+        :return: (值, 匹配方式)，匹配方式为 exact / near；未命中返回 (None, None)
+        """
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry[2], now):
+                    self._remove(key)
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    return entry[0], 'exact'
+
+            best_key, best_score = self._nearest(self.vectorize(key), now)
+            if best_key is not None and best_score >= self.similarity_threshold:
+                self._entries.move_to_end(best_key)
+                self.near_hits += 1
+                return self._entries[best_key][0], 'near'
+
+            self.misses += 1
+            return None, None
+
+    def _nearest(self, vector, now):
+        """通过倒排表只比较共享维度的条目"""
+        candidates = set()
+        for dim in vector:
+            candidates.update(self._postings.get(dim, ()))
+
+        best_key, best_score = None, 0.0
+        for key in candidates:
+            value, cached_vector, created_at = self._entries[key]
+            if self._expired(created_at, now):
+                continue
+            score = sum(weight * cached_vector.get(dim, 0.0) for dim, weight in vector.items())
+            if score > best_score:
+                best_key, best_score = key, score
+        return best_key, best_score
+
+    def put(self, query, value):
+        """写入缓存"""
+        key = normalize_query(query)
+        if not key:
+            return
+        vector = self.vectorize(key)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, vector, time.time())
+            for dim in vector:
+                self._postings.setdefault(dim, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'lookups': lookups,
+            'exact_hits': self.exact_hits,
+            'near_hits': self.near_hits,
+            'misses': self.misses,
+            'hit_rate': (self.exact_hits + self.near_hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+    def report(self):
+        stats = self.stats()
+        print("=== 问答缓存统计 ===")
+        print(f"查询: {stats['lookups']}  精确命中: {stats['exact_hits']}  近似命中: {stats['near_hits']}  命中率: {stats['hit_rate']:.1%}")
+        print(f"条目: {stats['entries']}  淘汰: {stats['evictions']}  过期: {stats['expirations']}  失效: {stats['invalidations']}")
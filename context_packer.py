@@ -0,0 +1,101 @@
+"""
+检索结果的重排序与上下文打包：先从向量库取较多的候选文本块，按向量检索排名与BM25词匹配排名融合重排，
+去掉相邻文本块之间重叠的文字，再按token预算依次放入上下文
+
+    vectordb.as_retriever(search_kwargs={"k": 3})                               # 固定3个，可能漏掉也可能重复
+    RerankRetriever(base_retriever=vectordb.as_retriever(search_kwargs={"k": 20}))  # 20个候选重排后按预算打包
+"""
+import os
+import sys
+from typing import List, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'llm'))
+from bm25_retriever import BM25Retriever, tokenize
+from token_counter import count_tokens
+
+# 参与重排的候选数与上下文的token预算
+CANDIDATE_K = 20
+CONTEXT_TOKEN_BUDGET = 1500
+# 倒数排名融合的常数，与 vector/hybrid_retriever.py 一致
+RRF_K = 60
+# 少于这么多字的首尾重合不算重叠（避免误删常见的短词）
+MIN_OVERLAP_CHARS = 20
+# 检查的最长重叠，切分时相邻文本块最多重叠 chunk_overlap（qa_system.py 中为200）个字
+MAX_OVERLAP_CHARS = 400
+
+
+def rerank_documents(query: str, docs: List[Document], rrf_k: int = RRF_K) -> List[Tuple[Document, float]]:
+    """
+    按向量检索排名和BM25排名的倒数排名融合重排候选（BM25只在这批候选内计算idf）
+    :param docs: 按向量相似度排序的候选
+    :return: [(文本块, 融合分数)]，按分数从高到低排序
+    """
+    if not docs:
+        return []
+    scores = [1.0 / (rrf_k + rank) for rank in range(1, len(docs) + 1)]
+    bm25 = BM25Retriever([{'question': doc.page_content} for doc in docs])
+    for rank, (i, _) in enumerate(bm25.search(query, top_k=len(docs)), 1):
+        scores[i] += 1.0 / (rrf_k + rank)
+    order = sorted(range(len(docs)), key=lambda i: -scores[i])
+    return [(docs[i], scores[i]) for i in order]
+
+
+def strip_overlap(text: str, previous: str, min_overlap: int = MIN_OVERLAP_CHARS,
+                  max_overlap: int = MAX_OVERLAP_CHARS) -> str:
+    """去掉text与previous首尾重合的部分（切分时相邻文本块的重叠），text完全包含在previous中时返回空串"""
+    if text in previous:
+        return ""
+    longest = min(len(text), len(previous), max_overlap)
+    for size in range(longest, min_overlap - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:]
+    for size in range(longest, min_overlap - 1, -1):
+        if previous.startswith(text[-size:]):
+            return text[:-size]
+    return text
+
+
+def pack_context(ranked: List[Tuple[Document, float]], token_budget: int = CONTEXT_TOKEN_BUDGET) -> List[Document]:
+    """
+    按重排顺序把文本块放入上下文，去掉与已选同一来源文本块的重叠部分，放不下的跳过、继续尝试后面较短的
+    第一个文本块即使超过预算也会放入，保证上下文不为空
+    :return: 去掉重叠后的文本块副本，metadata中带有 rerank_score 和 tokens
+    """
+    packed = []
+    used_tokens = 0
+    for doc, score in ranked:
+        source = doc.metadata.get('source')
+        text = doc.page_content
+        for selected in packed:
+            if selected.metadata.get('source') == source:
+                text = strip_overlap(text, selected.page_content)
+                if not text:
+                    break
+        text = text.strip()
+        if not text:
+            continue
+        tokens = count_tokens(text)
+        if packed and used_tokens + tokens > token_budget:
+            continue
+        packed.append(Document(page_content=text, metadata={**doc.metadata, 'rerank_score': score, 'tokens': tokens}))
+        used_tokens += tokens
+    return packed
+
+
+class RerankRetriever(BaseRetriever):
+    """包装向量库检索器：取较多候选，重排后按token预算打包，可直接用于 RetrievalQA"""
+
+    base_retriever: BaseRetriever
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+
+    def warm_up(self):
+        """预先加载分词词典，避免第一个查询承担加载耗时"""
+        tokenize("预热")
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        candidates = self.base_retriever.get_relevant_documents(query, callbacks=run_manager.get_child())
+        return pack_context(rerank_documents(query, candidates), self.token_budget)
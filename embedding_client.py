@@ -0,0 +1,159 @@
+"""
+远程向量化接口的批量并发调用：按token预算打包文本块，多个批次同时请求并限流，
+向量按（模型, 文本）的哈希缓存在本地SQLite中，重复入库或重建向量库时不再请求接口
+
+可以直接作为LangChain的Embeddings使用（例如传给Chroma的embedding_function）。
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from openai import OpenAI
+
+from rate_limiter import RateLimiter, call_with_retries
+from sqlite_cache import EmbeddingCache
+from token_counter import count_tokens
+
+# 默认缓存位置
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), ".embedding_cache.sqlite3")
+# 单个请求的token预算和文本条数上限（OpenAI兼容接口单次最多2048条）
+DEFAULT_BATCH_TOKENS = 8000
+DEFAULT_BATCH_SIZE = 256
+
+
+def pack_batches(token_counts: List[int], max_tokens: int = DEFAULT_BATCH_TOKENS,
+                 max_size: int = DEFAULT_BATCH_SIZE) -> List[List[int]]:
+    """按顺序把文本打包成批次，每批的token总数不超过预算（单条超过预算的文本单独成批）"""
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for i, tokens in enumerate(token_counts):
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_size):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class BatchedEmbeddings(Embeddings):
+    """批量并发请求 /embeddings 接口，并统计吞吐"""
+
+    def __init__(
+        self,
+        client: OpenAI,
+        model: str,
+        cache: Optional[EmbeddingCache] = None,
+        limiter: Optional[RateLimiter] = None,
+        max_in_flight: int = 4,
+        batch_tokens: int = DEFAULT_BATCH_TOKENS,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_retries: int = 5,
+        request_timeout: float = 60.0,
+    ):
+        """
+        :param client: OpenAI客户端实例
+        :param model: 向量化模型名，也是缓存键的一部分
+        :param cache: 向量缓存，None表示不缓存
+        :param limiter: 共享的限流器，None表示不限流
+        :param max_in_flight: 同时进行中的最大请求数
+        :param batch_tokens: 每个请求的token预算
+        :param batch_size: 每个请求的最大文本条数
+        """
+        # 重试由我们自己控制，关闭客户端内置的重试
+        self.client = client.with_options(max_retries=0, timeout=request_timeout)
+        self.model = model
+        self.cache = cache
+        self.limiter = limiter or RateLimiter()
+        self.max_in_flight = max_in_flight
+        self.batch_tokens = batch_tokens
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.texts_embedded = 0
+        self.requests = 0
+        self.request_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _request(self, texts: List[str], tokens: int) -> List[List[float]]:
+        def attempt():
+            # 每次尝试（包括重试）都要经过限流
+            self.limiter.acquire(tokens)
+            return self.client.embeddings.create(model=self.model, input=texts)
+
+        start = time.perf_counter()
+        response = call_with_retries(attempt, max_retries=self.max_retries)
+        with self._lock:
+            self.requests += 1
+            self.texts_embedded += len(texts)
+            self.request_seconds += time.perf_counter() - start
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """向量化一批文本，结果与texts一一对应；某个批次最终失败时抛出异常"""
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        keys = [EmbeddingCache.make_key(self.model, text) for text in texts]
+        if self.cache is not None:
+            cached = self.cache.get_many(keys)
+            for i, key in enumerate(keys):
+                if key in cached:
+                    vectors[i] = cached[key].tolist()
+
+        # 同一批中重复的文本只请求一次
+        pending_texts: Dict[str, List[int]] = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                pending_texts.setdefault(texts[i], []).append(i)
+        if self.cache is not None:
+            pending_count = sum(len(positions) for positions in pending_texts.values())
+            with self._lock:
+                self.cache.hits += len(texts) - pending_count
+                self.cache.misses += pending_count
+
+        unique_texts = list(pending_texts)
+        token_counts = [count_tokens(text) for text in unique_texts]
+        batches = pack_batches(token_counts, self.batch_tokens, self.batch_size)
+        first_error = None
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            futures = {
+                executor.submit(self._request, [unique_texts[j] for j in batch], sum(token_counts[j] for j in batch)): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    embedded = future.result()
+                except Exception as e:
+                    # 等其他批次都完成并写入缓存后再抛出，已付费的结果不会丢失
+                    first_error = first_error or e
+                    continue
+                # 每个批次完成后立即写入缓存
+                if self.cache is not None:
+                    self.cache.put_many({
+                        EmbeddingCache.make_key(self.model, unique_texts[j]): vector
+                        for j, vector in zip(batch, embedded)
+                    })
+                for j, vector in zip(batch, embedded):
+                    for i in pending_texts[unique_texts[j]]:
+                        vectors[i] = vector
+        if first_error is not None:
+            raise first_error
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def report(self):
+        """打印本次运行的请求与缓存统计"""
+        print("=== 向量化统计 ===")
+        print(f"请求: {self.requests} 次  向量化文本块: {self.texts_embedded}  "
+              f"平均每次请求 {self.request_seconds / max(self.requests, 1):.2f} 秒")
+        if self.cache is not None:
+            lookups = self.cache.hits + self.cache.misses
+            print(f"缓存命中: {self.cache.hits}/{lookups}")
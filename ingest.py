@@ -0,0 +1,263 @@
+"""
+无图形界面的批量入库流水线：PDF提取 → 语义拆分 → QA生成 → 向量索引
+
+用法：
+    python ingest.py docs/ "manuals/**/*.pdf" --workers 4 --output-dir ingest_output
+
+每个文件每完成一个阶段都会写检查点，中途崩溃后重新运行同一命令会从停下的阶段继续；
+源文件变化（大小或修改时间不同）时该文件从头处理。
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, 'split_pdf'))
+sys.path.append(os.path.join(ROOT, 'vector'))
+from jsonl_store import load_full_text, load_qa_data
+from pdf_extractor import extract_pdf_text_streaming
+from qa_cache import QACache
+from qa_dedup import DEFAULT_THRESHOLD
+from rate_limiter import RateLimiter
+from semantic_split import generate_qa_for_chunks, save_qa_results, split_text_semantically
+from faiss_vector_store import store_fingerprint
+from incremental_store import IncrementalQAStore
+from jieba_tokenizer import JiebaTokenizer
+
+STAGES = ('extract', 'split', 'qa', 'index')
+# 中间结果格式变化时递增，旧检查点对应的文件从头处理
+CHECKPOINT_FORMAT = 2
+
+
+class StageStats:
+    """按阶段统计处理量和耗时（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {stage: {'files': 0, 'items': 0, 'failed': 0, 'seconds': 0.0} for stage in STAGES}
+
+    def record(self, stage, items, seconds, failed=0):
+        """:param failed: 其中失败的数量（如重试用尽的文本块）"""
+        with self._lock:
+            self._stats[stage]['files'] += 1
+            self._stats[stage]['items'] += items
+            self._stats[stage]['failed'] += failed
+            self._stats[stage]['seconds'] += seconds
+
+    def report(self):
+        units = {'extract': '页', 'split': '块', 'qa': '块', 'index': '问答对'}
+        print("=== 各阶段吞吐 ===")
+        for stage in STAGES:
+            stats = self._stats[stage]
+            rate = stats['items'] / stats['seconds'] if stats['seconds'] else 0.0
+            print(f"{stage:8s} 文件: {stats['files']:5d}  {units[stage]}: {stats['items']:8d}  "
+                  f"失败: {stats['failed']:6d}  耗时: {stats['seconds']:8.1f} 秒  {rate:8.1f} {units[stage]}/秒")
+
+
+class Checkpoint:
+    """单个文件的处理进度"""
+
+    def __init__(self, output_dir, source_path):
+        self.source_path = os.path.abspath(source_path)
+        stem = os.path.splitext(os.path.basename(source_path))[0]
+        # 不同目录下可能有同名文件，用路径哈希区分
+        digest = hashlib.sha1(self.source_path.encode('utf-8')).hexdigest()[:8]
+        self.work_name = f"{stem}-{digest}"
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, f"{self.work_name}.checkpoint.json")
+
+        stat = os.stat(self.source_path)
+        self.data = {'source': self.source_path, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                     'format': CHECKPOINT_FORMAT, 'completed': {}}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if (saved.get('size') == stat.st_size and saved.get('mtime') == stat.st_mtime
+                    and saved.get('format') == CHECKPOINT_FORMAT):
+                self.data = saved
+
+    def artifact(self, suffix):
+        return os.path.join(self.output_dir, f"{self.work_name}{suffix}")
+
+    def is_done(self, stage):
+        return stage in self.data['completed']
+
+    def mark_done(self, stage, **info):
+        self.data['completed'][stage] = info
+        # 先写临时文件再替换，崩溃时不会留下半个检查点
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def collect_inputs(patterns):
+    """展开目录和通配符，返回去重排序后的PDF文件列表"""
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.update(glob.glob(os.path.join(pattern, '**', '*.pdf'), recursive=True))
+        else:
+            files.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(os.path.abspath(path) for path in files)
+
+
+class IngestPipeline:
+    """批量入库流水线"""
+
+    def __init__(self, args):
+        self.args = args
+        self.stats = StageStats()
+        self.cache = QACache()
+        # 所有文件共用一个限流器，并发处理多个文件时也不会超出配额
+        self.limiter = RateLimiter(args.rpm, args.tpm)
+        self.store = None
+        self._index_lock = threading.Lock()
+        # 已加入索引但还未保存的文件
+        self._indexed = []
+
+    def process_file(self, pdf_path):
+        """依次执行各阶段，已完成的阶段直接跳过"""
+        checkpoint = Checkpoint(self.args.output_dir, pdf_path)
+        name = os.path.basename(pdf_path)
+
+        if not checkpoint.is_done('extract'):
+            start = time.perf_counter()
+            pages_path, total_pages = extract_pdf_text_streaming(
+                pdf_path, checkpoint.work_name + '.pdf', output_dir=self.args.output_dir,
+                workers=self.args.extract_workers, compress=self.args.compress,
+            )
+            self.stats.record('extract', total_pages, time.perf_counter() - start)
+            checkpoint.mark_done('extract', pages_path=pages_path, total_pages=total_pages)
+
+        chunks_path = checkpoint.artifact('_chunks.json')
+        if not checkpoint.is_done('split'):
+            start = time.perf_counter()
+            full_text = load_full_text(checkpoint.data['completed']['extract']['pages_path'])
+            chunks = split_text_semantically(full_text)
+            with open(chunks_path, 'w', encoding='utf-8') as f:
+                json.dump(chunks, f, ensure_ascii=False)
+            self.stats.record('split', len(chunks), time.perf_counter() - start)
+            checkpoint.mark_done('split', chunks=len(chunks))
+
+        qa_path = checkpoint.artifact('_qa.jsonl.zst' if self.args.compress else '_qa.jsonl')
+        if not checkpoint.is_done('qa'):
+            with open(chunks_path, 'r', encoding='utf-8') as f:
+                chunks = json.load(f)
+            start = time.perf_counter()
+            # 崩溃前已经生成的文本块会命中QA缓存，不会重复请求
+            failed_chunks = []
+            qa_pairs = generate_qa_for_chunks(
+                chunks, max_in_flight=self.args.max_in_flight, cache=self.cache, limiter=self.limiter,
+                dedup_threshold=self.args.dedup_threshold or None, dedup_report_path=checkpoint.artifact('_dedup.jsonl'),
+                failed_chunks=failed_chunks,
+            )
+            self.stats.record('qa', len(chunks), time.perf_counter() - start, failed=len(failed_chunks))
+            if failed_chunks:
+                # 不标记完成：重新运行时成功的文本块命中缓存，只重试失败的文本块
+                raise RuntimeError(f"{len(failed_chunks)}/{len(chunks)} 个文本块生成QA失败，重新运行会重试这些文本块")
+            if chunks and not qa_pairs:
+                raise RuntimeError("未生成任何QA对")
+            save_qa_results(qa_pairs, qa_path)
+            checkpoint.mark_done('qa', qa_pairs=len(qa_pairs))
+
+        if not self.args.skip_index and not checkpoint.is_done('index'):
+            qa_pairs = load_qa_data(qa_path)['qa_pairs']
+            start = time.perf_counter()
+            self._add_to_index(checkpoint.work_name, qa_pairs)
+            self.stats.record('index', len(qa_pairs), time.perf_counter() - start)
+            with self._index_lock:
+                self._indexed.append((checkpoint, len(qa_pairs)))
+
+        print(f"✅ {name} 处理完成")
+
+    def _add_to_index(self, source, qa_pairs):
+        """把一个文件的问答对写入索引；该文件之前入库的问答对先删除，重复执行结果不变"""
+        qa_pairs = [dict(qa, source=source) for qa in qa_pairs]
+        with self._index_lock:
+            if self.store is None:
+                if store_fingerprint(self.args.store_dir):
+                    self.store = IncrementalQAStore.load(self.args.store_dir, background_refit=False)
+                else:
+                    os.makedirs(self.args.store_dir, exist_ok=True)
+                    self.store = IncrementalQAStore.create(
+                        qa_pairs, self.args.store_dir, tokenizer=JiebaTokenizer(), background_refit=False
+                    )
+                    return
+            stale = [doc_id for doc_id, record in self.store.metadata['records'].items() if record.get('source') == source]
+            self.store.delete(stale)
+            self.store.add(qa_pairs)
+
+    def save_index(self):
+        """保存索引后再标记索引阶段完成"""
+        if self.store is None:
+            return
+        self.store.save()
+        for checkpoint, count in self._indexed:
+            checkpoint.mark_done('index', qa_pairs=count)
+        self._indexed = []
+
+    def run(self, files):
+        failures = []
+        with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            futures = {executor.submit(self.process_file, path): path for path in files}
+            for done, future in enumerate(as_completed(futures), 1):
+                path = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    # 单个文件失败不影响其他文件，下次运行会从失败的阶段重试
+                    failures.append((path, str(e)))
+                    print(f"❌ {os.path.basename(path)} 处理失败: {e}")
+                print(f"进度: {done}/{len(files)}")
+
+        self.save_index()
+        return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量入库：PDF提取 → 语义拆分 → QA生成 → 向量索引")
+    parser.add_argument('inputs', nargs='+', help="PDF文件、目录或通配符（如 'docs/**/*.pdf'）")
+    parser.add_argument('--output-dir', default='ingest_output', help="中间结果和检查点目录")
+    parser.add_argument('--store-dir', default=os.path.join(ROOT, 'vector', 'faiss_data'), help="向量存储目录")
+    parser.add_argument('--workers', type=int, default=4, help="同时处理的文件数")
+    parser.add_argument('--extract-workers', type=int, default=max(1, (os.cpu_count() or 1) // 2), help="每个文件提取PDF的进程数")
+    parser.add_argument('--max-in-flight', type=int, default=4, help="每个文件同时进行的LLM请求数")
+    parser.add_argument('--rpm', type=int, default=None, help="所有文件合计的每分钟请求数上限")
+    parser.add_argument('--tpm', type=int, default=None, help="所有文件合计的每分钟token数上限")
+    parser.add_argument('--dedup-threshold', type=float, default=DEFAULT_THRESHOLD, help="近似重复问题的相似度阈值，0表示只去除完全相同的问题")
+    parser.add_argument('--skip-index', action='store_true', help="只生成QA，不写入向量索引")
+    parser.add_argument('--compress', action='store_true', help="分页文本和QA结果使用zstd压缩（需要安装zstandard）")
+    args = parser.parse_args()
+
+    files = collect_inputs(args.inputs)
+    if not files:
+        print("❌ 没有找到任何PDF文件")
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"=== 批量入库：共 {len(files)} 个文件 ===")
+
+    pipeline = IngestPipeline(args)
+    start = time.perf_counter()
+    try:
+        failures = pipeline.run(files)
+    finally:
+        pipeline.cache.report()
+        pipeline.cache.close()
+
+    pipeline.stats.report()
+    print(f"总耗时 {time.perf_counter() - start:.1f} 秒，成功 {len(files) - len(failures)}，失败 {len(failures)}")
+    for path, error in failures:
+        print(f"  {path}: {error}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+流式JSONL存储格式
+
+    第一行是文件头（格式、类型和少量元信息），之后每行一条记录。
+    旁边的 .idx 文件保存每条记录的字节偏移，读取时可以逐条迭代，也可以按序号直接定位。
+    以 .zst 结尾时使用zstd压缩：每 frame_records 条记录压缩成一个独立的帧，
+    .idx 中保存每个帧的偏移，定位时只需解压一个帧。
+"""
+import io
+import json
+import os
+from array import array
+
+FORMAT_NAME = "zheshiyige-jsonl"
+FORMAT_VERSION = 1
+DEFAULT_FRAME_RECORDS = 256
+
+
+def _zstd():
+    # 只有读写压缩文件时才需要zstandard
+    import zstandard
+    return zstandard
+
+
+def is_compressed(path):
+    return path.endswith('.zst')
+
+
+class JsonlWriter:
+    """流式写入记录，关闭时写出偏移索引"""
+
+    def __init__(self, path, kind, meta=None, frame_records=DEFAULT_FRAME_RECORDS):
+        """
+        :param kind: 记录类型，如 pages / qa_pairs
+        :param meta: 写入文件头的额外信息
+        :param frame_records: 压缩时每个帧包含的记录数
+        """
+        self.path = path
+        self.compressed = is_compressed(path)
+        self.frame_records = frame_records if self.compressed else 0
+        self.count = 0
+        self._offsets = array('Q')
+        self._compressor = _zstd().ZstdCompressor(level=3) if self.compressed else None
+        self._frame = []
+        self._file = open(path, 'wb')
+
+        header = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "kind": kind}
+        header.update(meta or {})
+        # 文件头单独一行（压缩时单独一个帧）
+        self._write_block([header])
+
+    def _write_block(self, records):
+        data = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records).encode('utf-8')
+        if self.compressed:
+            data = self._compressor.compress(data)
+        self._file.write(data)
+
+    def write(self, record):
+        if self.compressed:
+            if not self._frame:
+                self._offsets.append(self._file.tell())
+            self._frame.append(record)
+            if len(self._frame) >= self.frame_records:
+                self._write_block(self._frame)
+                self._frame = []
+        else:
+            self._offsets.append(self._file.tell())
+            self._write_block([record])
+        self.count += 1
+
+    def close(self):
+        if self._frame:
+            self._write_block(self._frame)
+            self._frame = []
+        self._file.close()
+        # 索引文件：记录数、每帧记录数（未压缩为0），然后是偏移数组
+        with open(self.path + '.idx', 'wb') as f:
+            array('Q', [self.count, self.frame_records]).tofile(f)
+            self._offsets.tofile(f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonlReader:
+    """读取JSONL文件：迭代时流式读取，按序号访问时通过偏移索引定位"""
+
+    def __init__(self, path):
+        self.path = path
+        self.compressed = is_compressed(path)
+        self._file = open(path, 'rb')
+        self._count = None
+        self._frame_records = 0
+        self._offsets = None
+        self._cached_frame = (None, None)
+
+        index_path = path + '.idx'
+        if os.path.exists(index_path):
+            offsets = array('Q')
+            with open(index_path, 'rb') as f:
+                offsets.frombytes(f.read())
+            self._count, self._frame_records = offsets[0], offsets[1]
+            self._offsets = offsets[2:]
+
+        self.header = json.loads(next(self._iter_lines(0)))
+        if self.header.get("format") != FORMAT_NAME:
+            raise ValueError(f"不是支持的JSONL文件: {path}")
+
+    def _iter_lines(self, offset):
+        """从字节偏移处开始逐行读取"""
+        self._file.seek(offset)
+        if self.compressed:
+            reader = _zstd().ZstdDecompressor().stream_reader(self._file, read_across_frames=True, closefd=False)
+            stream = io.TextIOWrapper(reader, encoding='utf-8', newline='\n')
+        else:
+            stream = io.TextIOWrapper(self._file, encoding='utf-8', newline='\n')
+        try:
+            for line in stream:
+                yield line
+        finally:
+            # 不关闭底层文件
+            stream.detach()
+
+    def __iter__(self):
+        lines = self._iter_lines(0)
+        next(lines)  # 跳过文件头
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+    def __len__(self):
+        if self._count is None:
+            self._count = sum(1 for _ in self)
+        return self._count
+
+    def __getitem__(self, i):
+        if self._offsets is None:
+            raise ValueError(f"缺少偏移索引，无法随机访问: {self.path}.idx")
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        if not self.compressed:
+            self._file.seek(self._offsets[i])
+            return json.loads(self._file.readline())
+
+        frame_no, position = divmod(i, self._frame_records)
+        if self._cached_frame[0] != frame_no:
+            start = self._offsets[frame_no]
+            end = self._offsets[frame_no + 1] if frame_no + 1 < len(self._offsets) else os.path.getsize(self.path)
+            self._file.seek(start)
+            data = _zstd().ZstdDecompressor().decompress(self._file.read(end - start))
+            # 字符串中的换行已被JSON转义，按 \n 切分即可
+            self._cached_frame = (frame_no, data.decode('utf-8').split('\n'))
+        return json.loads(self._cached_frame[1][position])
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_full_text(pages_path):
+    """按页产出文字，用于按需拼出完整文本（不再单独保存 _full_text.json）"""
+    with JsonlReader(pages_path) as reader:
+        for page in reader:
+            yield page.get("text", "")
+
+
+def load_full_text(pages_path):
+    """从分页文件得到完整文本，与旧版 _full_text.json 中的 full_text 相同"""
+    return ''.join(iter_full_text(pages_path)).strip()
+
+
+def write_qa_pairs(path, qa_pairs, meta=None):
+    """把问答对写成JSONL"""
+    with JsonlWriter(path, "qa_pairs", meta) as writer:
+        for qa in qa_pairs:
+            writer.write(qa)
+        return writer.count
+
+
+def load_qa_data(path):
+    """读取问答对文件（JSONL或旧版JSON），统一返回 {"total_qa_pairs", "qa_pairs"}"""
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    with JsonlReader(path) as reader:
+        qa_pairs = list(reader)
+    return {"total_qa_pairs": len(qa_pairs), "qa_pairs": qa_pairs}
+
+
+def find_data_file(directory, stem):
+    """按 .jsonl.zst → .jsonl → .json 的顺序查找数据文件，都不存在时返回 .json 路径"""
+    for extension in ('.jsonl.zst', '.jsonl', '.json'):
+        path = os.path.join(directory, stem + extension)
+        if os.path.exists(path):
+            return path
+    return os.path.join(directory, stem + '.json')
@@ -0,0 +1,171 @@
+import functools
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# 与向量存储共用jieba分词器和分词缓存，与其他模块共用token计数
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'vector'))
+from jieba_tokenizer import JiebaTokenizer, TokenCache, tokenize_corpus
+from token_counter import count_tokens
+
+
+@functools.lru_cache(maxsize=None)
+def default_tokenizer():
+    """
+    默认分词器，用户词典和停用词通过环境变量 JIEBA_USER_DICT / JIEBA_STOPWORDS 指定
+    （与 faiss_vector_store.py 的 --user-dict / --stopwords 使用同样的文件时，两边分词一致）
+    """
+    return JiebaTokenizer(user_dict=os.environ.get("JIEBA_USER_DICT"),
+                          stopwords_path=os.environ.get("JIEBA_STOPWORDS"))
+
+
+def tokenize(text):
+    """用默认分词器分词，去掉空白、纯标点和停用词"""
+    return default_tokenizer().tokenize(text)
+
+
+class BM25Retriever:
+    """基于jieba分词的内存BM25索引，为每个问题挑选最相关的候选问答对"""
+
+    def __init__(self, qa_pairs, k1=1.5, b=0.75, include_answers=False, token_cache_path=None, tokenizer=None,
+                 index_path=None, fingerprint=None, workers=None):
+        """
+        :param qa_pairs: 问答对列表
+        :param include_answers: 是否把答案也加入索引（默认只索引问题，建索引更快、匹配更准）
+        :param token_cache_path: 分词缓存（SQLite，见 jieba_tokenizer.TokenCache），问答库未变化的文本不再分词
+        :param tokenizer: JiebaTokenizer实例，默认为 default_tokenizer()
+        :param index_path: 建好的索引的保存位置（npz），问答库指纹不变时直接加载，不再分词
+        :param fingerprint: 问答库文件的指纹（如修改时间和大小），与index_path一起使用
+        :param workers: 分词进程数，None或1时在当前进程中分词
+        """
+        self.qa_pairs = qa_pairs
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer or default_tokenizer()
+
+        start = time.perf_counter()
+        index_key = None
+        if index_path and fingerprint is not None:
+            index_key = self._index_key(fingerprint, len(qa_pairs), include_answers)
+        self.loaded_from_index = index_key is not None and self._load_index(index_path, index_key)
+        if not self.loaded_from_index:
+            texts = []
+            for qa in qa_pairs:
+                text = qa.get('question', '')
+                if include_answers:
+                    text = f"{text} {qa.get('answer', '')}"
+                texts.append(text)
+            self._build(self._tokenize_all(texts, token_cache_path, workers))
+            if index_key is not None:
+                self._save_index(index_path, index_key)
+        self.build_seconds = time.perf_counter() - start
+
+    def _build(self, tokenized):
+        """
+        建倒排表，按词连续存放：第i个词的文档序号和预先算好的词频权重为
+        doc_ids[offsets[i]:offsets[i + 1]] 和 weights[同一区间]，查询时只需乘以idf
+        """
+        k1, b = self.k1, self.b
+        self.n_docs = n_docs = len(tokenized)
+        self.term_ids = term_ids = {}
+        # 每个词出现一次记一个 (词序号, 文档序号)，按 词序号 * 文档数 + 文档序号 排序计数即为各词的倒排表和词频
+        token_terms = np.fromiter((term_ids.setdefault(token, len(term_ids)) for tokens in tokenized for token in tokens),
+                                  dtype=np.int64)
+        doc_lengths = np.fromiter((len(tokens) for tokens in tokenized), dtype=np.int64, count=n_docs)
+        token_docs = np.repeat(np.arange(n_docs, dtype=np.int64), doc_lengths)
+        pairs, tf = np.unique(token_terms * n_docs + token_docs, return_counts=True)
+        terms, docs = np.divmod(pairs, n_docs) if n_docs else (pairs, pairs)
+
+        doc_freq = np.bincount(terms, minlength=len(term_ids))
+        self.offsets = np.concatenate(([0], np.cumsum(doc_freq)))
+        self.doc_ids = docs.astype(np.int32)
+        avg_length = doc_lengths.mean() if n_docs else 0.0
+        norm = k1 * (1 - b + b * doc_lengths[docs] / avg_length) if avg_length else np.full(len(docs), k1)
+        self.weights = (tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+        self.idf = np.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+
+    def _index_key(self, fingerprint, n_pairs, include_answers):
+        """索引文件的键：问答库指纹、分词配置和BM25参数，任何一个变化都需要重建"""
+        payload = json.dumps([fingerprint, n_pairs, include_answers, self.k1, self.b, self.tokenizer.signature()])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _load_index(self, index_path, index_key):
+        """键一致时加载保存的索引，返回是否加载成功"""
+        if not os.path.exists(index_path):
+            return False
+        try:
+            with np.load(index_path, allow_pickle=False) as data:
+                if str(data['key']) != index_key:
+                    return False
+                terms = data['terms'].tolist()
+                self.n_docs = int(data['n_docs'])
+                self.offsets = data['offsets']
+                self.doc_ids = data['doc_ids']
+                self.weights = data['weights']
+                self.idf = data['idf']
+        except Exception as e:
+            print(f"读取BM25索引失败，将重新建索引: {e}")
+            return False
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        return True
+
+    def _save_index(self, index_path, index_key):
+        """先写临时文件再替换（同 mmap_store.replace_file，不导入它是为了启动时不加载sklearn）"""
+        tmp_path = index_path + '.tmp'
+        try:
+            # 传入文件对象，np.savez 不会给文件名加 .npz 后缀
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, key=np.array(index_key), terms=np.array(list(self.term_ids), dtype=str),
+                         n_docs=np.array(self.n_docs), offsets=self.offsets, doc_ids=self.doc_ids,
+                         weights=self.weights, idf=self.idf)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"保存BM25索引失败: {e}")
+
+    def _tokenize_all(self, texts, token_cache_path, workers=None):
+        """分词，命中缓存的文本直接复用"""
+        cache = TokenCache(token_cache_path) if token_cache_path else None
+        try:
+            return tokenize_corpus(texts, self.tokenizer, workers=workers, cache=cache)
+        finally:
+            if cache is not None:
+                cache.close()
+
+    def search(self, question, top_k=20):
+        """返回 [(问答对序号, BM25分数)]，按分数从高到低排序"""
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term in set(self.tokenizer.tokenize(question)):
+            i = self.term_ids.get(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            # 同一个词的倒排表中文档序号不重复，可以直接按下标累加
+            scores[self.doc_ids[start:end]] += self.idf[i] * self.weights[start:end]
+        matched = np.flatnonzero(scores)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in matched]
+
+    def select_candidates(self, question, top_k=20, token_budget=2000):
+        """
+        挑选放入prompt的候选问答对
+        :param top_k: 最多候选数
+        :param token_budget: 候选问答对的token总数上限
+        :return: 候选问答对列表（按相关度排序）
+        """
+        candidates = []
+        used_tokens = 0
+        for doc_id, _ in self.search(question, top_k):
+            qa = self.qa_pairs[doc_id]
+            tokens = count_tokens(f"{qa.get('question', '')}\n{qa.get('answer', '')}")
+            if candidates and used_tokens + tokens > token_budget:
+                break
+            candidates.append(qa)
+            used_tokens += tokens
+        return candidates
@@ -1,21 +1,38 @@
-import json
 import os
 import sys
 
 # 添加上级目录到路径，以便导入llm_connector
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from llm_connector import create_client, chat_with_llm
+from answer_cache import SemanticAnswerCache
+from bm25_retriever import BM25Retriever
+from jieba_tokenizer import default_workers
+from jsonl_store import find_data_file, load_qa_data
+
+# 每个问题放入prompt的候选问答对数量和token上限
+CANDIDATE_TOP_K = 20
+CANDIDATE_TOKEN_BUDGET = 2000
+
+# 当前文件所在目录的上级目录中的split_pdf文件夹（优先使用JSONL格式）
+QA_JSON_PATH = find_data_file(os.path.join(os.path.dirname(__file__), '..', 'split_pdf'), 'qa_output_2_web_engineer')
+# BM25的分词缓存和建好的索引（不放在问答库旁边，避免混入源码目录）
+BM25_TOKEN_CACHE_PATH = os.path.join(os.path.dirname(__file__), '.bm25_token_cache.sqlite3')
+BM25_INDEX_PATH = os.path.join(os.path.dirname(__file__), '.bm25_index.npz')
+
+def qa_file_fingerprint(json_file_path=QA_JSON_PATH):
+    """问答库文件的修改时间和大小，文件变化时缓存失效"""
+    try:
+        stat = os.stat(json_file_path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
 
 def read_qa_json_file():
-    """直接读取QA JSON文件"""
-    # 获取当前文件所在目录的上级目录中的split_pdf文件夹
-    current_dir = os.path.dirname(__file__)
-    split_pdf_dir = os.path.join(current_dir, '..', 'split_pdf')
-    json_file_path = os.path.join(split_pdf_dir, 'qa_output_2_web_engineer.json')
+    """直接读取QA文件（JSONL或旧版JSON）"""
+    json_file_path = QA_JSON_PATH
     
     try:
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = load_qa_data(json_file_path)
         
         print(f"成功读取QA文件: {os.path.basename(json_file_path)}")
         print(f"总共有 {data.get('total_qa_pairs', 0)} 个问答对")
@@ -28,8 +45,16 @@ def read_qa_json_file():
         print(f"读取JSON文件时出错: {e}")
         return None
 
+def build_retriever(qa_data):
+    """在启动时为问答库建立BM25索引"""
+    retriever = BM25Retriever(qa_data['qa_pairs'], token_cache_path=BM25_TOKEN_CACHE_PATH, index_path=BM25_INDEX_PATH,
+                              fingerprint=qa_file_fingerprint(), workers=default_workers())
+    source = "从已保存的索引加载" if retriever.loaded_from_index else "重新分词构建"
+    print(f"BM25索引就绪（{source}）：{len(qa_data['qa_pairs'])} 个问答对，build_seconds={retriever.build_seconds:.2f}")
+    return retriever
+
 def create_similarity_prompt(user_question, qa_pairs):
-    """创建相似度匹配的prompt"""
+    """创建相似度匹配的prompt（qa_pairs为检索出的候选问答对）"""
     prompt = f"""你是一个前端高级工程师，拥有丰富的技术经验和专业知识。
 
 现在需要你进行问题相似度匹配：
@@ -41,8 +66,8 @@ def create_similarity_prompt(user_question, qa_pairs):
 问答库：
 """
     
-    # 添加前20个问答对作为示例（避免token过多）
-    for i, qa in enumerate(qa_pairs[:20], 1):
+    # 添加检索出的候选问答对
+    for i, qa in enumerate(qa_pairs, 1):
         prompt += f"{i}. 问题：{qa.get('question', '')}\n   答案：{qa.get('answer', '')}\n\n"
     
     prompt += """请严格按照以下格式回答：
@@ -53,12 +78,16 @@ def create_similarity_prompt(user_question, qa_pairs):
     
     return prompt
 
-def ask_llm_for_similarity(client, user_question, qa_data):
-    """使用大模型进行相似度匹配"""
-    if not qa_data or 'qa_pairs' not in qa_data:
+def ask_llm_for_similarity(client, user_question, retriever):
+    """先用BM25挑选候选问答对，再使用大模型进行相似度匹配"""
+    if retriever is None:
         return None, None
     
-    qa_pairs = qa_data['qa_pairs']
+    qa_pairs = retriever.select_candidates(user_question, top_k=CANDIDATE_TOP_K, token_budget=CANDIDATE_TOKEN_BUDGET)
+    if not qa_pairs:
+        # 没有任何词与问答库重合，不需要调用大模型
+        return "NOT_SIMILAR", None
+    
     prompt = create_similarity_prompt(user_question, qa_pairs)
     
     messages = [
@@ -95,12 +124,19 @@ def main():
         print("❌ 无法读取问答库，程序退出")
         return
     
+    retriever = build_retriever(qa_data)
+    
     # 创建LLM客户端
     client = create_client()
     if not client:
         print("❌ 无法创建LLM客户端，程序退出")
         return
     
+    # 问答缓存：重复或改写过的问题直接返回之前的判定结果
+    answer_cache = SemanticAnswerCache()
+    answer_cache_version = qa_file_fingerprint()
+    answer_cache.check_version(answer_cache_version)
+    
     print("✅ 系统初始化完成！")
     print("输入 'quit' 或 'exit' 退出对话")
     print("-" * 50)
@@ -113,12 +149,30 @@ def main():
                 continue
                 
             if user_input.lower() in ['quit', 'exit', '退出']:
+                answer_cache.report()
                 print("👋 再见！")
                 break
             
-            # 使用大模型进行相似度匹配
-            print("🤖 正在分析问题相似度...")
-            similarity_result, answer = ask_llm_for_similarity(client, user_input, qa_data)
+            # 问答库文件被重新生成时清空缓存并重新读取
+            fingerprint = qa_file_fingerprint()
+            if fingerprint != answer_cache_version:
+                answer_cache.check_version(fingerprint)
+                answer_cache_version = fingerprint
+                new_qa_data = read_qa_json_file()
+                if new_qa_data:
+                    retriever = build_retriever(new_qa_data)
+            
+            # 先查问答缓存
+            cached, match = answer_cache.get(user_input)
+            if cached is not None:
+                similarity_result, answer = cached
+                print(f"💾 命中缓存（{'精确' if match == 'exact' else '近似'}匹配）")
+            else:
+                # 使用大模型进行相似度匹配
+                print("🤖 正在分析问题相似度...")
+                similarity_result, answer = ask_llm_for_similarity(client, user_input, retriever)
+                if similarity_result is not None:
+                    answer_cache.put(user_input, (similarity_result, answer))
             
             if similarity_result == "SIMILAR" and answer:
                 print(f"✅ 找到相似问题")
@@ -129,6 +183,7 @@ def main():
                 print("AI: 不好意思，我不知道")
                     
         except KeyboardInterrupt:
+            answer_cache.report()
             print("\n👋 再见！")
             break
         except Exception as e:
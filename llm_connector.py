@@ -6,6 +6,9 @@ from openai import OpenAI
 # 加载环境变量 - 指定langchain文件夹下的.env文件
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
+# 默认使用火山方舟，可通过 ARK_BASE_URL 指向本地兼容OpenAI的服务（例如 stub_llm_server.py）
+DEFAULT_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+
 def check_api_key():
     """检查API密钥是否设置"""
     api_key = os.environ.get("ARK_API_KEY")
@@ -18,7 +21,7 @@ def create_client():
     try:
         api_key = check_api_key()
         client = OpenAI(
-            base_url="https://ark.cn-beijing.volces.com/api/v3",
+            base_url=os.environ.get("ARK_BASE_URL", DEFAULT_BASE_URL),
             api_key=api_key,
         )
         return client
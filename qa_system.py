@@ -1,5 +1,14 @@
+import asyncio
+import glob
+import hashlib
+import itertools
+import json
 import os
-from openai import OpenAI
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAI
 from langchain_community.document_loaders import (
     TextLoader,
     CSVLoader,
@@ -10,130 +19,483 @@ from langchain_community.document_loaders import (
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import Chroma
 from langchain.chains import RetrievalQA
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_openai import ChatOpenAI
 from langchain.schema import Document
-from typing import List, Optional
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
+from context_packer import CANDIDATE_K, CONTEXT_TOKEN_BUDGET, RerankRetriever
+from embedding_client import DEFAULT_CACHE_PATH, BatchedEmbeddings, EmbeddingCache
+from rate_limiter import RateLimiter
+from token_counter import count_tokens
 
 # 加载环境变量
 load_dotenv()
 
+# 默认使用火山方舟，可通过 ARK_BASE_URL 指向本地兼容OpenAI的服务（例如 stub_llm_server.py）
+DEFAULT_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+# 向量化模型（也是向量缓存键的一部分，更换模型后缓存自然失效）
+EMBEDDING_MODEL = os.environ.get("ARK_EMBEDDING_MODEL", "text-embedding-ada-002")
+# 回答使用的模型与提示词
+CHAT_MODEL = "doubao-pro-32k-241215"
+ANSWER_SYSTEM_PROMPT = "你是一个专业的技术问答助手，请基于提供的文档内容回答问题。"
+ANSWER_PROMPT_TEMPLATE = """基于以下文档内容回答问题：
+
+文档内容：
+{context}
+
+问题：{question}
+
+请用中文回答，要求准确、详细。"""
+# 异步客户端连接池：空闲连接的保留秒数（超过后下一次请求前重新预热）和最大连接数
+KEEPALIVE_EXPIRY = 30.0
+MAX_CONNECTIONS = 100
+# 流式回答中执行检索的线程数（检索主要在等待向量化接口，线程数可以远多于CPU核数）
+RETRIEVAL_THREADS = 32
+
+# 记录已入库文件的指纹，未变化的文件启动时不再加载、切分和向量化
+MANIFEST_FILENAME = "ingest_manifest.json"
+# 每次写入向量库的文本块数（Chroma单次写入的数量有上限）
+ADD_BATCH_SIZE = 1000
+# 支持的文档格式
+LOADERS = {
+    '.txt': TextLoader,
+    '.csv': CSVLoader,
+    '.pdf': UnstructuredPDFLoader,
+    '.docx': Docx2txtLoader,
+    '.xlsx': UnstructuredExcelLoader,
+}
+
+def collect_files(patterns: Iterable[str]) -> List[str]:
+    """展开目录（递归查找支持的格式）和通配符，返回去重排序后的绝对路径"""
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for extension in LOADERS:
+                files.update(glob.glob(os.path.join(pattern, '**', '*' + extension), recursive=True))
+        else:
+            files.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(os.path.abspath(path) for path in files)
+
+def load_file(file_path: str) -> List[Document]:
+    """按扩展名选择加载器加载一个文档（模块级函数，可以在子进程中执行）"""
+    loader_class = LOADERS.get(os.path.splitext(file_path)[1].lower())
+    if loader_class is None:
+        raise ValueError(f"不支持的文档格式: {file_path}")
+    docs = loader_class(file_path).load()
+    # 统一用绝对路径作为来源，便于按文件替换
+    for doc in docs:
+        doc.metadata['source'] = file_path
+    return docs
+
+def iter_loaded_files(file_paths: List[str], workers: Optional[int] = None) -> Iterator[Tuple[str, Optional[List[Document]], Optional[Exception]]]:
+    """
+    多进程加载文档，按完成顺序逐个产出 (路径, 文档列表, 错误)，加载失败时文档列表为None
+    同时提交的文件数有上限，已加载但还没被消费的文档也就有了上限，内存占用不随文件数增长
+    :param workers: 进程数，默认为CPU核数
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(file_paths) <= 1:
+        for path in file_paths:
+            try:
+                yield path, load_file(path), None
+            except Exception as e:
+                yield path, None, e
+        return
+
+    max_pending = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        next_file = 0
+        running = {}
+        while next_file < len(file_paths) or running:
+            while next_file < len(file_paths) and len(running) < max_pending:
+                path = file_paths[next_file]
+                running[executor.submit(load_file, path)] = path
+                next_file += 1
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = running.pop(future)
+                try:
+                    yield path, future.result(), None
+                except Exception as e:
+                    yield path, None, e
+
+def file_sha256(file_path: str) -> str:
+    """分块计算文件内容的哈希"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(source: str, text: str) -> str:
+    """文本块ID：来源文件 + 内容的哈希，内容不变时ID不变"""
+    return hashlib.sha256(f"{source}\n{text}".encode('utf-8')).hexdigest()
+
+class IngestManifest:
+    """已入库文件的清单：{文件路径: {sha256, size, mtime_ns, chunks}}"""
+
+    def __init__(self, persist_dir: str):
+        self.path = os.path.join(persist_dir, MANIFEST_FILENAME)
+        self.files: Dict[str, dict] = {}
+        # 内容没变、只更新了修改时间的条目数，大于0时需要保存
+        self.refreshed = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.files = json.load(f)
+
+    def is_unchanged(self, file_path: str) -> bool:
+        """大小和修改时间都没变时直接认为未变化，否则再比较内容哈希"""
+        entry = self.files.get(file_path)
+        if entry is None:
+            return False
+        stat = os.stat(file_path)
+        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        if entry['sha256'] == file_sha256(file_path):
+            # 内容没变（如文件被touch过），更新修改时间，下次不再计算哈希
+            entry['mtime_ns'] = stat.st_mtime_ns
+            self.refreshed += 1
+            return True
+        return False
+
+    def record(self, file_path: str, chunks: int):
+        stat = os.stat(file_path)
+        self.files[file_path] = {
+            'sha256': file_sha256(file_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'chunks': chunks,
+        }
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.files, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.refreshed = 0
+
 class QASystemBuilder:
     def __init__(self):
         # 初始化OpenAI客户端
+        self.base_url = os.environ.get("ARK_BASE_URL", DEFAULT_BASE_URL)
         self.client = OpenAI(
-            base_url="https://ark.cn-beijing.volces.com/api/v3",
+            base_url=self.base_url,
             api_key=os.environ.get("ARK_API_KEY"),
         )
         
-        # 初始化LangChain组件
-        self.embeddings = OpenAIEmbeddings(
-            openai_api_key=os.environ.get("ARK_API_KEY"),
-            openai_api_base="https://ark.cn-beijing.volces.com/api/v3"
+        # 向量化：按token预算打包、多个批次并发请求并限流，向量缓存在本地（并发与限流参数可通过环境变量调整）
+        self.embeddings = BatchedEmbeddings(
+            self.client,
+            EMBEDDING_MODEL,
+            cache=EmbeddingCache(DEFAULT_CACHE_PATH),
+            limiter=RateLimiter(
+                requests_per_minute=int(os.environ.get("EMBED_RPM", "0")) or None,
+                tokens_per_minute=int(os.environ.get("EMBED_TPM", "0")) or None,
+            ),
+            max_in_flight=int(os.environ.get("EMBED_MAX_IN_FLIGHT", "4")),
         )
         
+        # 流式回答的异步客户端，连接池绑定在创建它的事件循环上，按事件循环懒创建
+        self._async_client: Optional[AsyncOpenAI] = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_request = 0.0
+        # 同步接口复用同一个事件循环，连接在多次提问之间保持
+        self._sync_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix='qa-retrieval')
+        # 最近若干次流式回答的首个token耗时（毫秒）
+        self.ttft_history = deque(maxlen=1000)
+        
     def load_documents(self, file_path: str) -> List[Document]:
         """加载本地文档"""
-        if file_path.endswith('.txt'):
-            loader = TextLoader(file_path)
-        elif file_path.endswith('.csv'):
-            loader = CSVLoader(file_path)
-        elif file_path.endswith('.pdf'):
-            loader = UnstructuredPDFLoader(file_path)
-        elif file_path.endswith('.docx'):
-            loader = Docx2txtLoader(file_path)
-        elif file_path.endswith('.xlsx'):
-            loader = UnstructuredExcelLoader(file_path)
-        else:
-            raise ValueError(f"不支持的文档格式: {file_path}")
-        
-        return loader.load()
+        return load_file(os.path.abspath(file_path))
     
-    def process_documents(self, docs: List[Document], persist_dir: str = "./chroma_db") -> Chroma:
-        """处理文档并创建向量数据库"""
-        # 文档分割
+    def open_vectordb(self, persist_dir: str = "./chroma_db") -> Chroma:
+        """打开已持久化的向量库（不存在时创建空库），不调用向量化接口"""
+        return Chroma(persist_directory=persist_dir, embedding_function=self.embeddings)
+    
+    def split_documents(self, docs: List[Document]) -> List[Document]:
+        """文档分割，每个文本块带上内容哈希ID（同一文件中重复的文本块只保留一个）"""
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200
         )
-        splits = text_splitter.split_documents(docs)
+        splits = []
+        seen = set()
+        for split in text_splitter.split_documents(docs):
+            split_id = chunk_id(split.metadata.get('source', ''), split.page_content)
+            if split_id in seen:
+                continue
+            seen.add(split_id)
+            split.metadata['chunk_id'] = split_id
+            splits.append(split)
+        return splits
+    
+    def process_documents(self, docs: Iterable[Document], persist_dir: str = "./chroma_db",
+                          vectordb: Optional[Chroma] = None) -> Chroma:
+        """
+        增量写入向量数据库：已存在的文本块跳过，文档中消失的文本块删除，只对新文本块调用向量化接口
+        按文档的 source 对齐，一个文档变化时只替换它自己的文本块
+        :param docs: 文档列表或生成器，同一来源的文档需要相邻，逐个来源切分写入，不必一次全部加载
+        """
+        if vectordb is None:
+            vectordb = self.open_vectordb(persist_dir)
+        for source, source_docs in itertools.groupby(docs, key=lambda doc: doc.metadata.get('source', '')):
+            self._write_splits(vectordb, self.split_documents(list(source_docs)), sources=[source])
+        return vectordb
+    
+    def _write_splits(self, vectordb: Chroma, splits: List[Document], sources: Iterable[str] = ()) -> int:
+        """
+        按来源对齐写入已切分的文本块，返回新增的数量
+        各来源的新文本块合在一起写入，向量化请求可以跨文件打包
+        :param sources: 本次重新切分的来源，其中没有任何文本块的（如文件被清空）删除其全部旧文本块
+        """
+        splits_by_source: Dict[str, List[Document]] = {source: [] for source in sources}
+        for split in splits:
+            splits_by_source.setdefault(split.metadata.get('source', ''), []).append(split)
         
-        # 创建向量存储
-        vectordb = Chroma.from_documents(
-            documents=splits,
-            embedding=self.embeddings,
-            persist_directory=persist_dir
-        )
-        vectordb.persist()
+        pending = []
+        removed = 0
+        write_start = time.perf_counter()
+        for source, source_splits in splits_by_source.items():
+            existing = set(vectordb.get(where={"source": source}, include=[])["ids"])
+            new_ids = [split.metadata['chunk_id'] for split in source_splits]
+            stale = existing - set(new_ids)
+            if stale:
+                vectordb.delete(ids=list(stale))
+            removed += len(stale)
+            pending.extend((split_id, split) for split_id, split in zip(new_ids, source_splits) if split_id not in existing)
+        for start in range(0, len(pending), ADD_BATCH_SIZE):
+            batch = pending[start:start + ADD_BATCH_SIZE]
+            vectordb.add_documents([split for _, split in batch], ids=[split_id for split_id, _ in batch])
+        added = len(pending)
+        skipped = len(splits) - added
+        
+        elapsed = time.perf_counter() - write_start
+        print(f"文本块：新增 {added}，删除 {removed}，已存在跳过 {skipped}")
+        if added:
+            print(f"入库耗时 {elapsed:.2f} 秒（{added / max(elapsed, 1e-9):.1f} 块/秒）")
+        if added or removed:
+            vectordb.persist()
+        return added
+    
+    def remove_source(self, vectordb: Chroma, source: str) -> int:
+        """删除某个文件的全部文本块，返回删除的数量"""
+        ids = vectordb.get(where={"source": source}, include=[])["ids"]
+        if ids:
+            vectordb.delete(ids=ids)
+        return len(ids)
+    
+    def sync_files(self, patterns: List[str], persist_dir: str = "./chroma_db", prune: bool = False,
+                   workers: Optional[int] = None) -> Chroma:
+        """
+        按文件同步向量库：未变化的文件不加载、不切分、不向量化
+        变化的文件在进程池中并发加载，加载完就切分，多个文件的文本块攒够一轮并发向量化请求的token预算后一起写入，
+        写入后再记录到清单；加载失败的文件记录下来，不影响其他文件
+        :param patterns: 文件路径、目录或通配符
+        :param prune: 是否删除清单中有、但本次没有匹配到的文件的文本块
+        :param workers: 加载文档的进程数，默认为CPU核数
+        """
+        vectordb = self.open_vectordb(persist_dir)
+        manifest = IngestManifest(persist_dir)
+        paths = collect_files(patterns)
+        changed = [path for path in paths if not manifest.is_unchanged(path)]
+        if manifest.refreshed:
+            # 保存更新过的修改时间，下次启动不必再计算这些文件的哈希
+            manifest.save()
+        print(f"匹配到 {len(paths)} 个文件，{len(paths) - len(changed)} 个未变化跳过，{len(changed)} 个需要入库")
+        
+        added = 0
+        failures = []
+        # 已切分但还没写入的文本块，及其所属的文件和文本块数
+        buffered_splits: List[Document] = []
+        buffered_files: List[Tuple[str, int]] = []
+        buffered_tokens = 0
+        flush_tokens = self.embeddings.batch_tokens * self.embeddings.max_in_flight
+        
+        def flush():
+            nonlocal added, buffered_splits, buffered_files, buffered_tokens
+            if not buffered_files:
+                return
+            added += self._write_splits(vectordb, buffered_splits,
+                                        sources=[buffered_path for buffered_path, _ in buffered_files])
+            # 文本块写入后才记录到清单，中断后重新运行只处理剩下的文件
+            for buffered_path, chunks in buffered_files:
+                manifest.record(buffered_path, chunks)
+            manifest.save()
+            buffered_splits, buffered_files, buffered_tokens = [], [], 0
+        
+        sync_start = time.perf_counter()
+        for done, (path, docs, error) in enumerate(iter_loaded_files(changed, workers), 1):
+            if error is not None:
+                # 不写入清单，下次运行会重试
+                print(f"❌ [{done}/{len(changed)}] 加载失败: {path}（{type(error).__name__}: {error}）")
+                failures.append((path, error))
+                continue
+            print(f"[{done}/{len(changed)}] 正在切分: {path}")
+            splits = self.split_documents(docs)
+            buffered_splits.extend(splits)
+            buffered_files.append((path, len(splits)))
+            buffered_tokens += sum(count_tokens(split.page_content) for split in splits)
+            if buffered_tokens >= flush_tokens or len(buffered_splits) >= ADD_BATCH_SIZE:
+                flush()
+        flush()
+        
+        if prune:
+            matched = set(paths)
+            for path in [p for p in manifest.files if p not in matched]:
+                print(f"文件已移除，删除其文本块: {path}（{self.remove_source(vectordb, path)} 个）")
+                del manifest.files[path]
+            manifest.save()
+        
+        print(f"文件：{len(changed) - len(failures)} 个已入库，{len(paths) - len(changed)} 个未变化跳过，{len(failures)} 个失败")
+        for path, error in failures:
+            print(f"  ❌ {path}: {error}")
+        if added:
+            elapsed = time.perf_counter() - sync_start
+            print(f"共新增 {added} 个文本块，总耗时 {elapsed:.2f} 秒（{added / elapsed:.1f} 块/秒，含加载和切分）")
+            self.embeddings.report()
         return vectordb
     
-    def create_qa_chain(self, vectordb: Chroma, model_name: str = "doubao-pro-32k-241215") -> RetrievalQA:
+    def create_qa_chain(self, vectordb: Chroma, model_name: str = CHAT_MODEL) -> RetrievalQA:
         """创建问答链"""
         llm = ChatOpenAI(
             model_name=model_name,
             temperature=0,
             openai_api_key=os.environ.get("ARK_API_KEY"),
-            openai_api_base="https://ark.cn-beijing.volces.com/api/v3"
+            openai_api_base=self.base_url
         )
         
+        # 先取较多候选，重排后去掉重叠文字并按token预算打包（CONTEXT_TOKEN_BUDGET可通过环境变量调整）
+        retriever = RerankRetriever(
+            base_retriever=vectordb.as_retriever(search_kwargs={"k": CANDIDATE_K}),
+            token_budget=int(os.environ.get("CONTEXT_TOKEN_BUDGET", str(CONTEXT_TOKEN_BUDGET))),
+        )
+        retriever.warm_up()
+        
         return RetrievalQA.from_chain_type(
             llm=llm,
             chain_type="stuff",
-            retriever=vectordb.as_retriever(search_kwargs={"k": 3}),
+            retriever=retriever,
             return_source_documents=True
         )
     
+    def get_async_client(self) -> AsyncOpenAI:
+        """当前事件循环的异步客户端，多个并发会话共享同一个连接池"""
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=os.environ.get("ARK_API_KEY"),
+                http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                )),
+            )
+            self._async_loop = loop
+            self._last_request = 0.0
+        return self._async_client
+    
+    async def _warm_connection(self, client: AsyncOpenAI):
+        """连接池中可能没有可用连接时，先发一个轻量请求建立连接（TCP + TLS），失败也不影响回答"""
+        if time.monotonic() - self._last_request < KEEPALIVE_EXPIRY:
+            return
+        # 同时开始的其他会话不再重复预热
+        self._last_request = time.monotonic()
+        try:
+            await client.with_options(max_retries=0, timeout=5.0).models.list()
+        except Exception:
+            pass
+    
+    async def astream_answer(self, retriever, question: str, result: Optional[dict] = None) -> AsyncIterator[str]:
+        """
+        异步流式回答：检索的同时建立到大模型服务的连接，逐个产出回答片段，不打印
+        :param retriever: LangChain检索器（如 qa_chain.retriever）
+        :param result: 传入dict时写入 source_documents、result（完整回答）、context_tokens（上下文token数）和 timings_ms
+                       （retrieval_ms 检索耗时，ttft_ms 首个token耗时，total_ms 总耗时）
+        """
+        start = time.perf_counter()
+        client = self.get_async_client()
+        
+        async def retrieve():
+            # 检索会调用同步的向量化接口，放到线程池中执行，不阻塞其他会话
+            loop = asyncio.get_running_loop()
+            docs = await loop.run_in_executor(self._retrieval_pool, retriever.get_relevant_documents, question)
+            return docs, (time.perf_counter() - start) * 1000
+        
+        (docs, retrieval_ms), _ = await asyncio.gather(retrieve(), self._warm_connection(client))
+        context = "\n\n".join([doc.page_content for doc in docs])
+        
+        stream = await client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=[
+                {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+                {"role": "user", "content": ANSWER_PROMPT_TEMPLATE.format(context=context, question=question)}
+            ],
+            stream=True
+        )
+        
+        parts = []
+        ttft_ms = None
+        try:
+            async for chunk in stream:
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                    self.ttft_history.append(ttft_ms)
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+        finally:
+            await stream.close()
+            self._last_request = time.monotonic()
+            if result is not None:
+                result["source_documents"] = docs
+                result["result"] = "".join(parts)
+                result["context_tokens"] = sum(doc.metadata.get('tokens', 0) for doc in docs)
+                result["timings_ms"] = {
+                    "retrieval_ms": retrieval_ms,
+                    "ttft_ms": ttft_ms,
+                    "total_ms": (time.perf_counter() - start) * 1000,
+                }
+    
+    def _run(self, coroutine):
+        """在同步代码中执行协程（复用同一个事件循环，保留连接池）"""
+        if self._sync_loop is None:
+            self._sync_loop = asyncio.new_event_loop()
+        return self._sync_loop.run_until_complete(coroutine)
+    
+    def report_latency(self):
+        """打印流式回答首个token耗时的p50/p95"""
+        values = sorted(self.ttft_history)
+        if values:
+            print(f"首个token耗时 p50 {values[len(values) // 2]:.0f}ms  "
+                  f"p95 {values[min(len(values) - 1, int(len(values) * 0.95))]:.0f}ms（{len(values)} 次）")
+    
     def query(self, qa_chain: RetrievalQA, question: str, stream: bool = False) -> None:
         """查询问答系统"""
         if stream:
-            # 流式响应 - 使用真正的流式输出
+            # 流式响应：逐个打印异步生成的回答片段
             print("🤖 AI回答: ", end="", flush=True)
+            result = {}
+            
+            async def print_stream():
+                async for content in self.astream_answer(qa_chain.retriever, question, result):
+                    print(content, end="", flush=True)
             
             try:
-                # 获取相关文档
-                retriever = qa_chain.retriever
-                docs = retriever.get_relevant_documents(question)
-                
-                # 构建上下文
-                context = "\n\n".join([doc.page_content for doc in docs])
-                
-                # 构建提示词
-                prompt = f"""基于以下文档内容回答问题：
-
-文档内容：
-{context}
-
-问题：{question}
-
-请用中文回答，要求准确、详细。"""
-                
-                # 使用OpenAI客户端进行流式调用
-                response = self.client.chat.completions.create(
-                    model="doubao-pro-32k-241215",
-                    messages=[
-                        {"role": "system", "content": "你是一个专业的技术问答助手，请基于提供的文档内容回答问题。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    stream=True
-                )
-                
-                # 逐字显示响应
-                full_response = ""
-                for chunk in response:
-                    if chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        print(content, end="", flush=True)
-                        full_response += content
-                
-                print()  # 换行
-                print("✅ 流式回答完成")
-                
-                # 保存结果用于显示来源文档
-                result = {"result": full_response, "source_documents": docs}
-                
+                self._run(print_stream())
             except Exception as e:
                 print(f"\n❌ 流式回答出错: {e}")
                 return
+            
+            print()  # 换行
+            timings = result["timings_ms"]
+            ttft = f"{timings['ttft_ms']:.0f}ms" if timings['ttft_ms'] is not None else "无"
+            print(f"✅ 流式回答完成（检索 {timings['retrieval_ms']:.0f}ms，首个token {ttft}，总耗时 {timings['total_ms']:.0f}ms，"
+                  f"上下文 {len(result['source_documents'])} 个文本块 {result['context_tokens']} tokens）")
                 
         else:
             # 标准响应
@@ -160,19 +522,21 @@ def main():
     # 初始化系统构建器
     builder = QASystemBuilder()
     
-    # 1. 加载本地话术库
-    file_path = input("请输入话术库文件路径: ")
+    # 1. 加载本地话术库（未变化的文件直接跳过；直接回车则只打开已有的向量库）
+    persist_dir = "./chroma_db"
+    file_input = input("请输入话术库文件、目录或通配符（多个用逗号分隔，直接回车使用已有向量库）: ").strip()
+    patterns = [pattern.strip() for pattern in file_input.split(',') if pattern.strip()]
+    
+    # 2. 增量写入向量数据库（LOAD_WORKERS设置加载文档的进程数）
     try:
-        docs = builder.load_documents(file_path)
-        print(f"成功加载文档: {len(docs)}个段落")
+        if patterns:
+            vectordb = builder.sync_files(patterns, persist_dir, workers=int(os.environ.get("LOAD_WORKERS", "0")) or None)
+        else:
+            vectordb = builder.open_vectordb(persist_dir)
     except Exception as e:
         print(f"加载文档失败: {e}")
         return
-    
-    # 2. 处理文档并创建向量数据库
-    persist_dir = "./chroma_db"
-    vectordb = builder.process_documents(docs, persist_dir)
-    print(f"向量数据库已创建并保存到: {persist_dir}")
+    print(f"向量数据库已就绪: {persist_dir}（{vectordb._collection.count()} 个文本块）")
     
     # 3. 创建问答链
     qa_chain = builder.create_qa_chain(vectordb)
@@ -182,6 +546,7 @@ def main():
     while True:
         question = input("\n请输入问题(输入'退出'结束): ")
         if question.lower() in ['退出', 'exit', 'quit']:
+            builder.report_latency()
             break
         
         stream = input("是否使用流式响应?(y/n): ").lower() == 'y'
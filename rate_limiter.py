@@ -0,0 +1,106 @@
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+
+# 可以重试的错误：限流(429)、超时、连接失败、服务端5xx
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class RateLimiter:
+    """按分钟限制请求数和token数的滑动窗口限流器（线程安全）"""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, window=60.0):
+        """
+        :param requests_per_minute: 每分钟最大请求数，None表示不限制
+        :param tokens_per_minute: 每分钟最大token数，None表示不限制
+        :param window: 窗口长度（秒）
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._events = deque()  # (时间戳, token数)
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        """移除窗口外的记录"""
+        while self._events and now - self._events[0][0] >= self.window:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def _wait_time(self, now, tokens):
+        """计算还需要等待多久才能发出请求"""
+        wait = 0.0
+        if self.requests_per_minute and len(self._events) >= self.requests_per_minute:
+            wait = self._events[0][0] + self.window - now
+
+        if self.tokens_per_minute and self._tokens_in_window + tokens > self.tokens_per_minute:
+            # 找到足够多的token离开窗口的时间点
+            needed = self._tokens_in_window + tokens - self.tokens_per_minute
+            freed = 0
+            for timestamp, used in self._events:
+                freed += used
+                if freed >= needed:
+                    wait = max(wait, timestamp + self.window - now)
+                    break
+        return wait
+
+    def acquire(self, tokens=0):
+        """阻塞直到可以发出一个消耗tokens个token的请求"""
+        if self.tokens_per_minute:
+            # 单个超过限额的请求也必须能发出，否则会永远等待
+            tokens = min(tokens, self.tokens_per_minute)
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._prune(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+            time.sleep(min(wait, 1.0))
+
+
+def _retry_after_seconds(error):
+    """读取429响应中的Retry-After头"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retries(func, *args, max_retries=5, base_delay=1.0, max_delay=30.0, **kwargs):
+    """
+    调用func，遇到限流、超时等可重试错误时按指数退避重试
+    :param max_retries: 最大重试次数（不含第一次调用）
+    :param base_delay: 第一次重试前的基础等待秒数
+    :param max_delay: 单次等待的上限
+    """
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt >= max_retries:
+                raise
+            delay = _retry_after_seconds(e)
+            if delay is None:
+                # 指数退避 + 随机抖动，避免所有线程同时重试
+                delay = min(max_delay, base_delay * (2 ** attempt))
+                delay *= 0.5 + random.random() / 2
+            attempt += 1
+            print(f"请求失败({type(e).__name__})，{delay:.1f}秒后第{attempt}次重试...")
+            time.sleep(delay)
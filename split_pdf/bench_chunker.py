@@ -0,0 +1,90 @@
+"""
+文本拆分性能测试：对约10MB的文本运行 split_text_semantically，输出块/秒
+
+用法：
+    python bench_chunker.py                       # 使用生成的约10MB中文文本
+    python bench_chunker.py web_eight_pages.jsonl # 使用已提取的文本（分页JSONL或含full_text的JSON）
+"""
+import argparse
+import random
+import time
+
+from semantic_split import read_full_text, split_text_semantically
+from token_counter import get_encoder
+
+SAMPLE_SENTENCES = [
+    "浏览器解析HTML时会构建DOM树。",
+    "CSS选择器的优先级由内联样式、ID、类和元素的数量决定！",
+    "为什么要避免在循环中频繁读取布局属性？",
+    "事件循环会先执行同步代码，再依次处理微任务和宏任务。",
+    "Vue的响应式系统在读取属性时收集依赖，在修改属性时通知更新。",
+    "使用防抖和节流可以减少高频事件触发的回调次数。",
+]
+
+
+def generate_text(target_bytes, seed=0):
+    """生成指定大小的测试文本，段落长短不一，其中少数段落远超单块上限"""
+    rng = random.Random(seed)
+    paragraphs = []
+    size = 0
+    while size < target_bytes:
+        # 约2%的段落特别长，用来覆盖按句切分的路径
+        count = rng.randint(200, 600) if rng.random() < 0.02 else rng.randint(1, 12)
+        para = "".join(rng.choice(SAMPLE_SENTENCES) for _ in range(count))
+        paragraphs.append(para)
+        size += len(para.encode("utf-8")) + 1
+    return "\n".join(paragraphs)
+
+
+def legacy_split(text, max_tokens=2000):
+    """旧实现（逐段编码，超长段落不切分），作为对比基线"""
+    paragraphs = [p.strip() for p in text.split("\n") if p.strip()]
+    chunks = []
+    current_chunk = []
+    current_tokens = 0
+    for para in paragraphs:
+        para_tokens = len(get_encoder().encode(para))
+        if current_tokens + para_tokens > max_tokens and current_chunk:
+            chunks.append("\n".join(current_chunk))
+            current_chunk = []
+            current_tokens = 0
+        current_chunk.append(para)
+        current_tokens += para_tokens
+    if current_chunk:
+        chunks.append("\n".join(current_chunk))
+    return chunks
+
+
+def run(name, split, text, max_tokens):
+    start = time.perf_counter()
+    chunks = split(text)
+    elapsed = time.perf_counter() - start
+    largest = max(len(tokens) for tokens in get_encoder().encode_ordinary_batch(chunks)) if chunks else 0
+    megabytes = len(text.encode("utf-8")) / 1024 / 1024
+    print(f"{name:8s} 块数: {len(chunks):6d}  耗时: {elapsed:7.2f} 秒  "
+          f"{len(chunks) / max(elapsed, 1e-9):8.1f} 块/秒  {megabytes / max(elapsed, 1e-9):6.2f} MB/秒  "
+          f"最大块: {largest} tokens{'（超出上限）' if largest > max_tokens else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本拆分性能测试")
+    parser.add_argument('input', nargs='?', help="分页JSONL文件或含full_text的JSON文件，不指定时生成测试文本")
+    parser.add_argument('--size-mb', type=float, default=10.0, help="生成测试文本的大小")
+    parser.add_argument('--max-tokens', type=int, default=2000)
+    parser.add_argument('--overlap', type=int, default=200, help="重叠token数")
+    parser.add_argument('--skip-legacy', action='store_true', help="不运行旧实现")
+    args = parser.parse_args()
+
+    text = read_full_text(args.input) if args.input else generate_text(int(args.size_mb * 1024 * 1024))
+    if not text:
+        return
+    print(f"文本大小: {len(text.encode('utf-8')) / 1024 / 1024:.2f} MB")
+
+    if not args.skip_legacy:
+        run("旧实现", lambda t: legacy_split(t, args.max_tokens), text, args.max_tokens)
+    run("新实现", lambda t: split_text_semantically(t, args.max_tokens), text, args.max_tokens)
+    run(f"重叠{args.overlap}", lambda t: split_text_semantically(t, args.max_tokens, args.overlap), text, args.max_tokens)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
-import tkinter as tk
-from tkinter import filedialog
-import PyPDF2
-import json
 import os
+import sys
+from pdf_extractor import extract_pdf_text_streaming
 
 def select_pdf_and_print_name():
     """创建一个窗口选择PDF文件并打印文件名"""
+    # 只在需要对话框时才导入tkinter，无图形界面的服务器上也能使用本模块
+    import tkinter as tk
+    from tkinter import filedialog
+    
     # 初始化Tkinter
     root = tk.Tk()
     root.withdraw()  # 隐藏主窗口
@@ -28,66 +30,22 @@ def select_pdf_and_print_name():
     else:
         print("未选择任何文件")
 
-def extract_pdf_text(pdf_path, pdf_name):
-    """提取PDF中的文字并保存为JSON文件"""
+def extract_pdf_text(pdf_path, pdf_name, workers=None):
+    """提取PDF中的文字并保存为JSONL文件（多进程分段提取，按页序流式写出）"""
     try:
-        # 打开PDF文件
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            
-            # 提取所有页面的文字
-            text_content = []
-            full_text = ""  # 用于存储合并后的完整文本
-            
-            for page_num, page in enumerate(pdf_reader.pages):
-                text = page.extract_text()
-                text_content.append({
-                    "page": page_num + 1,
-                    "text": text
-                })
-                # 将每页文字添加到完整文本中，并在页面之间添加分隔符
-                # full_text += f"\n--- 第 {page_num + 1} 页 ---\n"
-                full_text += text
-                # full_text += "\n"
-            
-            # 创建JSON数据结构
-            pdf_data = {
-                "filename": pdf_name,
-                "total_pages": len(pdf_reader.pages),
-                "pages": text_content
-            }
-            
-            # 生成输出文件名
-            output_filename = pdf_name.replace('.pdf', '_extracted.json')
-            output_path = os.path.join(os.path.dirname(pdf_path), output_filename)
-            
-            # 保存为JSON文件
-            with open(output_path, 'w', encoding='utf-8') as json_file:
-                json.dump(pdf_data, json_file, ensure_ascii=False, indent=2)
-            
-            # 创建包含完整文本的新JSON文件
-            full_text_data = {
-                "filename": pdf_name,
-                "total_pages": len(pdf_reader.pages),
-                "full_text": full_text.strip()  # 移除首尾空白字符
-            }
-            
-            # 生成完整文本的JSON文件名
-            full_text_filename = pdf_name.replace('.pdf', '_full_text.json')
-            full_text_path = os.path.join(os.path.dirname(pdf_path), full_text_filename)
-            
-            # 保存完整文本的JSON文件
-            with open(full_text_path, 'w', encoding='utf-8') as json_file:
-                json.dump(full_text_data, json_file, ensure_ascii=False, indent=2)
-            
-            print(f"PDF文字提取完成！")
-            print(f"总页数: {len(pdf_reader.pages)}")
-            print(f"分页JSON文件已保存到: {output_path}")
-            print(f"完整文本JSON文件已保存到: {full_text_path}")
+        output_path, total_pages = extract_pdf_text_streaming(pdf_path, pdf_name, workers=workers)
+        
+        print(f"PDF文字提取完成！")
+        print(f"总页数: {total_pages}")
+        print(f"分页JSONL文件已保存到: {output_path}")
             
     except Exception as e:
         print(f"提取PDF文字时出错: {str(e)}")
 
 # 运行函数
 if __name__ == "__main__":
-    select_pdf_and_print_name()
\ No newline at end of file
+    # 命令行传入文件路径时不弹出对话框
+    if len(sys.argv) > 1:
+        extract_pdf_text(sys.argv[1], os.path.basename(sys.argv[1]))
+    else:
+        select_pdf_and_print_name()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import PyPDF2
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from jsonl_store import JsonlWriter
+
+
+def _extract_page_range(pdf_path, start, end):
+    """子进程中提取 [start, end) 页的文字（每个进程自己打开PDF）"""
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def extract_pdf_text_streaming(pdf_path, pdf_name, output_dir=None, workers=None, pages_per_task=16, compress=False):
+    """
+    多进程分段提取PDF文字，按页序边提取边写出，内存占用不随页数增长
+    每页一行写入JSONL文件，完整文本在需要时由 jsonl_store.load_full_text 从分页文件拼出
+    :param workers: 进程数，默认为CPU核数
+    :param pages_per_task: 每个任务提取的页数
+    :param compress: 是否使用zstd压缩（输出 .jsonl.zst）
+    :return: (分页JSONL路径, 总页数)
+    """
+    output_dir = output_dir or os.path.dirname(pdf_path)
+    extension = '_pages.jsonl.zst' if compress else '_pages.jsonl'
+    output_path = os.path.join(output_dir, pdf_name.replace('.pdf', extension))
+
+    # 只读取页数，不在主进程中解析页面内容
+    with open(pdf_path, 'rb') as file:
+        total_pages = len(PyPDF2.PdfReader(file).pages)
+
+    workers = workers or os.cpu_count() or 1
+    ranges = [(start, min(start + pages_per_task, total_pages)) for start in range(0, total_pages, pages_per_task)]
+    # 限制同时提交的任务数，已完成但还不能按顺序写出的结果也就有了上限
+    max_pending = workers * 2
+
+    start_time = time.perf_counter()
+    meta = {"filename": pdf_name, "total_pages": total_pages}
+    with JsonlWriter(output_path, "pages", meta) as pages_writer, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+
+        next_range = 0
+        next_to_write = 0
+        running = {}
+        finished = {}
+        pages_written = 0
+        while next_to_write < len(ranges):
+            while next_range < len(ranges) and len(running) + len(finished) < max_pending:
+                start, end = ranges[next_range]
+                running[executor.submit(_extract_page_range, pdf_path, start, end)] = next_range
+                next_range += 1
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                finished[running.pop(future)] = future.result()
+
+            # 按页序写出已经连续完成的部分
+            while next_to_write in finished:
+                start, _ = ranges[next_to_write]
+                for offset, text in enumerate(finished.pop(next_to_write)):
+                    pages_writer.write({"page": start + offset + 1, "text": text})
+                    pages_written += 1
+                next_to_write += 1
+
+            elapsed = time.perf_counter() - start_time
+            print(f"已提取 {pages_written}/{total_pages} 页（{pages_written / max(elapsed, 1e-9):.1f} 页/秒）")
+
+    elapsed = time.perf_counter() - start_time
+    print(f"提取耗时 {elapsed:.2f} 秒，平均 {total_pages / max(elapsed, 1e-9):.1f} 页/秒")
+    return output_path, total_pages
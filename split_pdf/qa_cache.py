@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+# 默认缓存位置与大小上限
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), ".qa_cache.sqlite3")
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+def make_cache_key(model: str, system_prompt: str, user_prompt_template: str, temperature: float, text_chunk: str) -> str:
+    """根据生成参数和文本内容计算缓存键（内容寻址）"""
+    payload = json.dumps(
+        [model, system_prompt, user_prompt_template, temperature, text_chunk],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class QACache:
+    """持久化的QA生成结果缓存，超过大小上限时按最近最少使用淘汰（可在多个线程间共享）"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        :param path: SQLite缓存文件路径
+        :param max_bytes: 缓存内容的总字节数上限
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.oversize = 0
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS qa_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_qa_cache_access ON qa_cache(last_access)")
+        self.conn.commit()
+        # 缓存内容的总字节数只在启动时统计一次，之后随写入、替换和淘汰增减
+        self._total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM qa_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[List[Dict[str, str]]]:
+        """读取缓存，未命中返回None"""
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM qa_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.conn.execute("UPDATE qa_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, qa_pairs: List[Dict[str, str]]) -> bool:
+        """写入缓存并在超过上限时淘汰旧条目，单条内容超过上限时不写入，返回是否写入"""
+        value = json.dumps(qa_pairs, ensure_ascii=False)
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            if size > self.max_bytes:
+                # 写入后会把整个缓存（包括它自己）淘汰掉
+                self.oversize += 1
+                return False
+            row = self.conn.execute("SELECT size FROM qa_cache WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO qa_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._total_bytes += size - (row[0] if row else 0)
+            self.writes += 1
+            self._evict()
+            self.conn.commit()
+        return True
+
+    def total_bytes(self) -> int:
+        """缓存内容的总字节数"""
+        return self._total_bytes
+
+    def _evict(self):
+        """按最近访问时间从旧到新删除，直到总大小不超过上限"""
+        excess = self._total_bytes - self.max_bytes
+        if excess <= 0:
+            return
+
+        freed = 0
+        stale_keys = []
+        for key, size in self.conn.execute("SELECT key, size FROM qa_cache ORDER BY last_access"):
+            stale_keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self.conn.executemany("DELETE FROM qa_cache WHERE key = ?", stale_keys)
+        self._total_bytes -= freed
+        self.evictions += len(stale_keys)
+
+    def report(self):
+        """打印本次运行的命中统计"""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            writes, evictions, oversize = self.writes, self.evictions, self.oversize
+            entries = self.conn.execute("SELECT COUNT(*) FROM qa_cache").fetchone()[0]
+            total_bytes = self._total_bytes
+        lookups = hits + misses
+        hit_rate = hits / lookups if lookups else 0.0
+        print("=== QA缓存统计 ===")
+        print(f"命中: {hits}  未命中: {misses}  命中率: {hit_rate:.1%}")
+        print(f"新写入: {writes}  淘汰: {evictions}  超过上限未写入: {oversize}")
+        print(f"缓存条目: {entries}  占用: {total_bytes / 1024 / 1024:.2f} MB / {self.max_bytes / 1024 / 1024:.0f} MB")
+
+    def close(self):
+        self.conn.close()
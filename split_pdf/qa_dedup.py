@@ -0,0 +1,137 @@
+"""
+问答对近似重复检测：基于jieba分词片段的MinHash + LSH
+
+大模型在不同文本块中经常生成措辞不同、意思相同的问题。每个问题计算一次MinHash签名，
+按LSH分桶后只与同桶内已保留的问题比较，总耗时随问答对数量近似线性增长。
+"""
+import os
+import re
+import sys
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import jieba
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from jsonl_store import JsonlWriter
+
+DEFAULT_THRESHOLD = 0.7
+DEFAULT_NUM_PERM = 128
+
+# 梅森素数，MinHash的哈希取模
+_MERSENNE_PRIME = (1 << 61) - 1
+_PUNCTUATION_ONLY = re.compile(r'[^\w]+')
+
+
+def shingles(text: str, size: int = 2) -> set:
+    """jieba分词（关闭HMM以加快速度）后取1到size个连续词组成的片段（短问题只用长片段区分度不够）"""
+    words = [w for w in jieba.lcut(text.lower(), HMM=False) if w.strip() and not _PUNCTUATION_ONLY.fullmatch(w)]
+    result = set()
+    for n in range(1, size + 1):
+        for i in range(len(words) - n + 1):
+            result.add(" ".join(words[i:i + n]))
+    return result
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def choose_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """选择LSH的分段数和每段行数，使候选概率的拐点 (1/b)^(1/r) 最接近阈值且不高于阈值"""
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        knee = (1 / bands) ** (1 / rows)
+        if knee <= threshold and (best is None or threshold - knee < best[0]):
+            best = (threshold - knee, bands, rows)
+    return (best[1], best[2]) if best else (num_perm, 1)
+
+
+class MinHashDeduplicator:
+    """按出现顺序处理问答对，与已保留问题的相似度达到阈值时合并"""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = DEFAULT_NUM_PERM,
+                 shingle_size: int = 2, seed: int = 1):
+        """
+        :param threshold: 问题分词片段的Jaccard相似度阈值，达到即视为重复
+        :param num_perm: MinHash签名长度
+        :param shingle_size: 分词片段最多包含的词数
+        """
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands, self.rows = choose_bands(threshold, num_perm)
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+        self._buckets = [{} for _ in range(self.bands)]
+        # 已保留的问题：(分词片段, 在结果中的位置)
+        self._kept = []
+
+    def signature(self, items: set) -> np.ndarray:
+        if not items:
+            return np.zeros(len(self._a), dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in items), dtype=np.uint64, count=len(items))
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+    def find_duplicate(self, items: set, signature: np.ndarray) -> Tuple[Optional[int], float]:
+        """在同桶的已保留问题中找最相似的一个，返回 (序号, 相似度)，没有达到阈值时序号为None"""
+        candidates = set()
+        for band, bucket in enumerate(self._buckets):
+            key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            candidates.update(bucket.get(key, ()))
+
+        best, best_similarity = None, 0.0
+        for kept_id in candidates:
+            similarity = jaccard(items, self._kept[kept_id][0])
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = kept_id, similarity
+        return best, best_similarity
+
+    def add(self, items: set, signature: np.ndarray, position: int):
+        kept_id = len(self._kept)
+        self._kept.append((items, position))
+        for band, bucket in enumerate(self._buckets):
+            key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            bucket.setdefault(key, []).append(kept_id)
+
+    def deduplicate(self, qa_pairs: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], List[Dict]]:
+        """
+        :return: (去重后的问答对, 合并记录列表)
+        """
+        unique = []
+        merges = []
+        for qa in qa_pairs:
+            items = shingles(qa["question"], self.shingle_size)
+            signature = self.signature(items)
+            kept_id, similarity = self.find_duplicate(items, signature)
+            if kept_id is None:
+                self.add(items, signature, len(unique))
+                unique.append(qa)
+            else:
+                kept = unique[self._kept[kept_id][1]]
+                merges.append({
+                    "kept_question": kept["question"],
+                    "merged_question": qa["question"],
+                    "merged_answer": qa["answer"],
+                    "similarity": round(similarity, 4),
+                })
+        return unique, merges
+
+
+def deduplicate_qa_pairs(qa_pairs: List[Dict[str, str]], threshold: float = DEFAULT_THRESHOLD,
+                         num_perm: int = DEFAULT_NUM_PERM) -> Tuple[List[Dict[str, str]], List[Dict]]:
+    """去除近似重复的问答对，保留每组中最先出现的一个"""
+    return MinHashDeduplicator(threshold, num_perm).deduplicate(qa_pairs)
+
+
+def write_merge_report(path: str, merges: List[Dict], threshold: float):
+    """把合并记录写成JSONL，便于人工检查阈值是否合适"""
+    with JsonlWriter(path, "qa_merges", {"threshold": threshold}) as writer:
+        for merge in merges:
+            writer.write(merge)
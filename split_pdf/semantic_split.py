@@ -1,16 +1,47 @@
 import re
 import json
-import tkinter as tk
-from tkinter import filedialog
-from typing import List, Dict, Optional
-import tiktoken
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Dict, Optional, Tuple
 import os
 from dotenv import load_dotenv
 from openai import OpenAI
 
+# 添加上级目录到路径，以便导入rate_limiter
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from rate_limiter import RateLimiter, call_with_retries
+from token_counter import count_tokens, get_encoder
+from jsonl_store import load_full_text, write_qa_pairs
+from qa_cache import QACache, make_cache_key
+from qa_dedup import DEFAULT_THRESHOLD, deduplicate_qa_pairs, write_merge_report
+
 # 加载环境变量
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
 
+# 默认使用火山方舟，可通过 ARK_BASE_URL 指向本地兼容OpenAI的服务（例如 stub_llm_server.py）
+DEFAULT_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+
+# QA生成使用的模型与提示词
+QA_MODEL = "doubao-pro-32k-241215"
+# QA_SYSTEM_PROMPT = "你是一个专业的内容分析师，请根据提供的文本生成高质量的问答对。"
+QA_SYSTEM_PROMPT = "你是一个高级web前端工程师，请根据提供的文本生成高质量的问答对。"
+QA_USER_PROMPT_TEMPLATE = """请根据以下文本生成3-5个问答对，要求：
+1. 问题类型包括：事实型、概念解释型、操作步骤型
+2. 答案必须直接引用或精确概括原文
+3. 用JSON格式返回结果，格式为：{{"qa_pairs": [{{"question": "问题", "answer": "答案"}}]}}
+
+文本内容：
+{text_chunk}"""
+QA_TEMPERATURE = 0.3
+# 估算单次请求token时为模型输出预留的数量
+QA_EXPECTED_OUTPUT_TOKENS = 800
+
+# 批量编码的线程数
+ENCODE_THREADS = os.cpu_count() or 1
+# 超长段落的切分位置：句末标点（连续的标点和右引号归入同一句）
+SENTENCE_END = re.compile(r"[。！？]+[”’」』）)]*")
+
 
 def check_api_key():
     """检查API密钥是否设置"""
@@ -25,7 +56,7 @@ def create_client():
     try:
         api_key = check_api_key()
         client = OpenAI(
-            base_url="https://ark.cn-beijing.volces.com/api/v3",
+            base_url=os.environ.get("ARK_BASE_URL", DEFAULT_BASE_URL),
             api_key=api_key,
         )
         return client
@@ -36,21 +67,35 @@ def create_client():
 
 def select_json_file():
     """选择JSON文件并读取full_text"""
+    # 只在需要对话框时才导入tkinter，无图形界面的服务器上也能使用本模块的其他功能
+    import tkinter as tk
+    from tkinter import filedialog
+
     # 初始化Tkinter
     root = tk.Tk()
     root.withdraw()  # 隐藏主窗口
 
     # 设置文件选择对话框
     file_path = filedialog.askopenfilename(
-        title="选择包含full_text的JSON文件",
-        filetypes=[("JSON文件", "*.json"), ("所有文件", "*.*")],
+        title="选择分页JSONL文件或包含full_text的JSON文件",
+        filetypes=[("分页JSONL文件", "*.jsonl *.zst"), ("JSON文件", "*.json"), ("所有文件", "*.*")],
     )
 
     if not file_path:
         print("未选择任何文件")
         return None
 
+    return read_full_text(file_path)
+
+
+def read_full_text(file_path: str) -> Optional[str]:
+    """读取完整文本：分页JSONL文件按页拼出，旧版JSON文件读取full_text字段"""
     try:
+        if not file_path.endswith(".json"):
+            full_text = load_full_text(file_path)
+            print(f"成功读取分页文件: {os.path.basename(file_path)}")
+            return full_text
+
         with open(file_path, "r", encoding="utf-8") as f:
             data = json.load(f)
 
@@ -66,41 +111,169 @@ def select_json_file():
         return None
 
 
-def split_text_semantically(text: str, max_tokens: int = 2000) -> List[str]:
+def _encode_batch(texts: List[str]) -> List[List[int]]:
+    """批量编码；单核时逐个编码，避免线程池为每段文本提交任务的开销"""
+    encoder = get_encoder()
+    if ENCODE_THREADS > 1 and len(texts) > ENCODE_THREADS:
+        return encoder.encode_ordinary_batch(texts, num_threads=ENCODE_THREADS)
+    return [encoder.encode_ordinary(text) for text in texts]
+
+
+def _split_sentences(paragraph: str) -> List[str]:
+    """在句末标点（。！？）之后切分段落"""
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(paragraph):
+        sentences.append(paragraph[start:match.end()])
+        start = match.end()
+    if start < len(paragraph):
+        sentences.append(paragraph[start:])
+    return sentences
+
+
+def _split_by_tokens(tokens: List[int], max_tokens: int) -> List[Tuple[str, int]]:
+    """没有句末标点的超长文本按token数硬切，只在字符边界处切开，返回 [(文本, token数)]"""
+    text, offsets = get_encoder().decode_with_offsets(tokens)
+    offsets.append(len(text))
+    window = max_tokens
+    while True:
+        cuts = [0]
+        while cuts[-1] + window < len(tokens):
+            cut = cuts[-1] + window
+            # 一个汉字可能被编码成多个token，往回退到字符开头
+            while cut > cuts[-1] + 1 and offsets[cut] == offsets[cut - 1]:
+                cut -= 1
+            cuts.append(cut)
+        cuts.append(len(tokens))
+        pieces = [text[offsets[a]:offsets[b]] for a, b in zip(cuts, cuts[1:]) if offsets[a] < offsets[b]]
+        counts = [len(piece_tokens) for piece_tokens in _encode_batch(pieces)]
+        # 单独编码后token数可能略有变化，超出时缩小窗口重切
+        if max(counts) <= max_tokens or window == 1:
+            return list(zip(pieces, counts))
+        window = max(1, window - (max(counts) - max_tokens))
+
+
+def _split_into_units(paragraphs: List[str], max_tokens: int) -> List[Tuple[str, int, bool]]:
+    """
+    把段落切成不超过max_tokens的单元：所有段落一次批量编码，只有超长段落才再按句切分
+    :return: [(文本, token数, 是否段落开头)]
     """
-    语义化拆分长文本
+    units = []
+    long_paragraphs = []
+    for para, tokens in zip(paragraphs, _encode_batch(paragraphs)):
+        if len(tokens) > max_tokens:
+            # 先占位，下面统一切分后再填回
+            long_paragraphs.append((len(units), para))
+        units.append((para, len(tokens), True))
+
+    if not long_paragraphs:
+        return units
+
+    sentences_per_paragraph = [_split_sentences(para) for _, para in long_paragraphs]
+    sentence_tokens = iter(_encode_batch([s for sentences in sentences_per_paragraph for s in sentences]))
+
+    replacements = {}
+    for (position, _), sentences in zip(long_paragraphs, sentences_per_paragraph):
+        pieces = []
+        for sentence in sentences:
+            tokens = next(sentence_tokens)
+            if len(tokens) <= max_tokens:
+                pieces.append((sentence, len(tokens)))
+            else:
+                pieces.extend(_split_by_tokens(tokens, max_tokens))
+        replacements[position] = [(text, count, i == 0) for i, (text, count) in enumerate(pieces)]
+
+    result = []
+    for position, unit in enumerate(units):
+        result.extend(replacements.get(position, [unit]))
+    return result
+
+
+def split_text_semantically(text: str, max_tokens: int = 2000, overlap_tokens: int = 0) -> List[str]:
+    """
+    语义化拆分长文本：按段落合并，超长段落在句末标点处切开
     :param text: 输入文本
     :param max_tokens: 每个分块的最大token数
+    :param overlap_tokens: 相邻分块重叠的最大token数（以句子/段落为单位，0表示不重叠）
     :return: 拆分后的文本块列表
     """
-    # 初始化tokenizer
-    tokenizer = tiktoken.get_encoding("cl100k_base")
-
     # 按段落分割文本
     paragraphs = [p.strip() for p in text.split("\n") if p.strip()]
+    units = _split_into_units(paragraphs, max_tokens)
+
     chunks = []
     current_chunk = []
     current_tokens = 0
 
-    for para in paragraphs:
-        para_tokens = len(tokenizer.encode(para))
-
-        # 如果当前块加上新段落超过限制，保存当前块并开始新块
-        if current_tokens + para_tokens > max_tokens and current_chunk:
-            chunks.append("\n".join(current_chunk))
-            current_chunk = []
-            current_tokens = 0
-
-        current_chunk.append(para)
-        current_tokens += para_tokens
+    def cost(unit):
+        # 段落之间的换行按一个token计
+        return unit[1] + (1 if unit[2] else 0)
+
+    def flush():
+        # 同一段落内的句子直接相连，不同段落之间换行
+        chunks.append("".join(("\n" if starts_paragraph and i else "") + unit_text
+                              for i, (unit_text, _, starts_paragraph) in enumerate(current_chunk)))
+
+    for unit in units:
+        # 如果当前块加上新单元超过限制，保存当前块并开始新块
+        if current_chunk and current_tokens + cost(unit) > max_tokens:
+            flush()
+            # 新块以上一块末尾不超过overlap_tokens的单元开头
+            carried = []
+            carried_tokens = 0
+            for previous in reversed(current_chunk):
+                if carried_tokens + cost(previous) > overlap_tokens or \
+                        carried_tokens + cost(previous) + cost(unit) > max_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += cost(previous)
+            current_chunk = carried
+            current_tokens = carried_tokens
+
+        # 块的第一个单元前面没有换行
+        current_tokens += cost(unit) if current_chunk else unit[1]
+        current_chunk.append(unit)
 
     # 添加最后一个块
     if current_chunk:
-        chunks.append("\n".join(current_chunk))
+        flush()
 
     return chunks
 
 
+def build_qa_messages(text_chunk: str) -> List[Dict[str, str]]:
+    """构建生成问答对的消息列表"""
+    return [
+        {"role": "system", "content": QA_SYSTEM_PROMPT},
+        {"role": "user", "content": QA_USER_PROMPT_TEMPLATE.format(text_chunk=text_chunk)},
+    ]
+
+
+def estimate_request_tokens(messages: List[Dict[str, str]]) -> int:
+    """估算一次请求消耗的token数（输入 + 预留输出），用于限流"""
+    prompt_tokens = sum(count_tokens(m["content"]) for m in messages)
+    return prompt_tokens + QA_EXPECTED_OUTPUT_TOKENS
+
+
+def request_qa_pairs(client: OpenAI, text_chunk: str) -> List[Dict[str, str]]:
+    """
+    请求大模型生成问答对，出错时直接抛出异常（由调用方决定是否重试）
+    :param client: OpenAI客户端实例
+    :param text_chunk: 文本块
+    :return: 生成的QA对列表
+    """
+    response = client.chat.completions.create(
+        model=QA_MODEL,
+        messages=build_qa_messages(text_chunk),
+        temperature=QA_TEMPERATURE,
+        response_format={"type": "json_object"},
+    )
+
+    result = response.choices[0].message.content
+    parsed_result = json.loads(result)
+    return parsed_result.get("qa_pairs", [])
+
+
 def generate_qa_pairs(client: OpenAI, text_chunk: str) -> List[Dict[str, str]]:
     """
     使用大模型生成问答对
@@ -109,58 +282,178 @@ def generate_qa_pairs(client: OpenAI, text_chunk: str) -> List[Dict[str, str]]:
     :return: 生成的QA对列表
     """
     try:
-        response = client.chat.completions.create(
-            model="doubao-pro-32k-241215",
-            messages=[
-                {
-                    "role": "system",
-                    # "content": "你是一个专业的内容分析师，请根据提供的文本生成高质量的问答对。",
-                    "content": "你是一个高级web前端工程师，请根据提供的文本生成高质量的问答对。",
-                },
-                {
-                    "role": "user",
-                    "content": f"""请根据以下文本生成3-5个问答对，要求：
-1. 问题类型包括：事实型、概念解释型、操作步骤型
-2. 答案必须直接引用或精确概括原文
-3. 用JSON格式返回结果，格式为：{{"qa_pairs": [{{"question": "问题", "answer": "答案"}}]}}
-
-文本内容：
-{text_chunk}""",
-                },
-            ],
-            temperature=0.3,
-            response_format={"type": "json_object"},
-        )
-
-        result = response.choices[0].message.content
-        parsed_result = json.loads(result)
-        return parsed_result.get("qa_pairs", [])
+        return request_qa_pairs(client, text_chunk)
 
     except Exception as e:
         print(f"生成QA对时出错: {e}")
         return []
 
 
-def process_text_to_qa(text: str) -> List[Dict[str, str]]:
+def generate_qa_pairs_concurrently(
+    client: OpenAI,
+    text_chunks: List[str],
+    max_in_flight: int = 4,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+    max_retries: int = 5,
+    request_timeout: float = 120.0,
+    on_result: Optional[Callable[[int, List[Dict[str, str]]], None]] = None,
+    limiter: Optional[RateLimiter] = None,
+    on_error: Optional[Callable[[int, Exception], None]] = None,
+) -> List[List[Dict[str, str]]]:
+    """
+    并发生成问答对，遇到429和超时时退避重试，结果按文本块顺序返回
+    :param client: OpenAI客户端实例
+    :param text_chunks: 文本块列表
+    :param max_in_flight: 同时进行中的最大请求数
+    :param requests_per_minute: 每分钟最大请求数，None表示不限制
+    :param tokens_per_minute: 每分钟最大token数，None表示不限制
+    :param max_retries: 单个文本块的最大重试次数
+    :param request_timeout: 单次请求超时秒数
+    :param on_result: 每个文本块成功完成时的回调 on_result(块序号, QA对列表)，在调用线程中执行
+    :param limiter: 共享的限流器（多个文档同时处理时共用同一个配额），传入时忽略上面两个限流参数
+    :param on_error: 文本块重试用尽仍失败时的回调 on_error(块序号, 异常)，在调用线程中执行
+    :return: 与text_chunks一一对应的QA对列表（失败的文本块为空列表）
+    """
+    limiter = limiter or RateLimiter(requests_per_minute, tokens_per_minute)
+    # 重试由我们自己控制，关闭客户端内置的重试
+    worker_client = client.with_options(max_retries=0, timeout=request_timeout)
+
+    def attempt(text_chunk, tokens):
+        # 每次尝试（包括重试）都要经过限流
+        limiter.acquire(tokens)
+        return request_qa_pairs(worker_client, text_chunk)
+
+    def worker(text_chunk):
+        tokens = estimate_request_tokens(build_qa_messages(text_chunk))
+        return call_with_retries(attempt, text_chunk, tokens, max_retries=max_retries)
+
+    results: List[List[Dict[str, str]]] = [[] for _ in text_chunks]
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = {executor.submit(worker, chunk): i for i, chunk in enumerate(text_chunks)}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+                if on_result:
+                    on_result(i, results[i])
+            except Exception as e:
+                print(f"第 {i + 1} 个文本块生成QA对时出错: {e}")
+                if on_error:
+                    on_error(i, e)
+            print(f"已完成 {done}/{len(text_chunks)} 个文本块")
+
+    return results
+
+
+def process_text_to_qa(
+    text: str,
+    max_in_flight: int = 4,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+    cache: Optional[QACache] = None,
+    limiter: Optional[RateLimiter] = None,
+    overlap_tokens: int = 0,
+    dedup_threshold: Optional[float] = DEFAULT_THRESHOLD,
+    dedup_report_path: Optional[str] = None,
+) -> List[Dict[str, str]]:
     """
     处理文本生成问答对的主流程
     :param text: 输入文本
+    :param max_in_flight: 同时进行中的最大LLM请求数
+    :param requests_per_minute: 每分钟最大请求数，None表示不限制
+    :param tokens_per_minute: 每分钟最大token数，None表示不限制
+    :param cache: QA结果缓存，命中的文本块不再请求大模型
+    :param limiter: 共享的限流器
+    :param overlap_tokens: 相邻文本块重叠的最大token数
+    :param dedup_threshold: 近似重复问题的相似度阈值，None表示只去除完全相同的问题
+    :param dedup_report_path: 合并记录的保存路径，None表示不保存
     :return: 结构化QA对列表
     """
-    client = create_client()
-    if not client:
-        print("无法创建LLM客户端，请检查API配置")
-        return []
-
     print("开始语义化拆分文本...")
     # 语义化拆分文本
-    text_chunks = split_text_semantically(text)
+    text_chunks = split_text_semantically(text, overlap_tokens=overlap_tokens)
     print(f"文本已拆分为 {len(text_chunks)} 个块")
 
+    return generate_qa_for_chunks(
+        text_chunks,
+        max_in_flight=max_in_flight,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        cache=cache,
+        limiter=limiter,
+        dedup_threshold=dedup_threshold,
+        dedup_report_path=dedup_report_path,
+    )
+
+
+def generate_qa_for_chunks(
+    text_chunks: List[str],
+    max_in_flight: int = 4,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+    cache: Optional[QACache] = None,
+    limiter: Optional[RateLimiter] = None,
+    dedup_threshold: Optional[float] = DEFAULT_THRESHOLD,
+    dedup_report_path: Optional[str] = None,
+    failed_chunks: Optional[List[int]] = None,
+) -> List[Dict[str, str]]:
+    """
+    为已拆分的文本块生成问答对（查缓存、并发请求、去重）
+    参数含义同 process_text_to_qa
+    :param failed_chunks: 传入列表时追加生成失败的文本块序号（失败的块不写入缓存，重新调用时会再次请求）
+    :return: 结构化QA对列表（不含失败的文本块）
+    """
+    # 先查缓存，只有新增或变化的文本块才需要请求大模型
+    cache_keys = [
+        make_cache_key(QA_MODEL, QA_SYSTEM_PROMPT, QA_USER_PROMPT_TEMPLATE, QA_TEMPERATURE, chunk)
+        for chunk in text_chunks
+    ]
+    chunk_results: List[List[Dict[str, str]]] = [[] for _ in text_chunks]
+    pending = []
+    for i, key in enumerate(cache_keys):
+        cached = cache.get(key) if cache else None
+        if cached is not None:
+            chunk_results[i] = cached
+        else:
+            pending.append(i)
+
+    if cache:
+        print(f"缓存命中 {len(text_chunks) - len(pending)} 个文本块，需要请求 {len(pending)} 个")
+
+    if pending:
+        client = create_client()
+        if not client:
+            print("无法创建LLM客户端，请检查API配置")
+            if failed_chunks is not None:
+                failed_chunks.extend(pending)
+            return []
+
+        def store_result(j, chunk_qa):
+            # 每个文本块完成后立即写入缓存，中途失败也不会丢失已付费的结果
+            if cache:
+                cache.put(cache_keys[pending[j]], chunk_qa)
+
+        def record_failure(j, error):
+            if failed_chunks is not None:
+                failed_chunks.append(pending[j])
+
+        print(f"正在并发处理文本块（最多同时 {max_in_flight} 个请求）...")
+        generated = generate_qa_pairs_concurrently(
+            client,
+            [text_chunks[i] for i in pending],
+            max_in_flight=max_in_flight,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            on_result=store_result,
+            limiter=limiter,
+            on_error=record_failure,
+        )
+        for i, chunk_qa in zip(pending, generated):
+            chunk_results[i] = chunk_qa
+
     qa_pairs = []
-    for i, chunk in enumerate(text_chunks, 1):
-        print(f"正在处理第 {i}/{len(text_chunks)} 个文本块...")
-        chunk_qa = generate_qa_pairs(client, chunk)
+    for chunk_qa in chunk_results:
         qa_pairs.extend(chunk_qa)
 
     # 后处理：去重和过滤
@@ -175,19 +468,27 @@ def process_text_to_qa(text: str) -> List[Dict[str, str]]:
             seen_questions.add(question)
             unique_qa.append({"question": question, "answer": answer})
 
-    return unique_qa
+    if dedup_threshold is None or not unique_qa:
+        return unique_qa
+
+    # 再合并措辞不同的近似重复问题
+    start = time.perf_counter()
+    deduplicated, merges = deduplicate_qa_pairs(unique_qa, threshold=dedup_threshold)
+    print(f"近似去重：{len(unique_qa)} → {len(deduplicated)} 个问答对，合并 {len(merges)} 个，"
+          f"耗时 {time.perf_counter() - start:.2f} 秒")
+    if dedup_report_path:
+        write_merge_report(dedup_report_path, merges, dedup_threshold)
+        print(f"合并记录已保存到: {dedup_report_path}")
+    return deduplicated
 
 
 def save_qa_results(qa_pairs: List[Dict[str, str]], output_path: str = None):
-    """保存QA结果到JSON文件"""
+    """保存QA结果到JSONL文件（每行一个问答对，路径以 .zst 结尾时压缩）"""
     if not output_path:
-        # output_path = "qa_output.json"
-        output_path = "qa_output_2_web_engineer.json"
-
-    result_data = {"total_qa_pairs": len(qa_pairs), "qa_pairs": qa_pairs}
+        # output_path = "qa_output.jsonl"
+        output_path = "qa_output_2_web_engineer.jsonl"
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(result_data, f, ensure_ascii=False, indent=2)
+    write_qa_pairs(output_path, qa_pairs)
 
     print(f"QA结果已保存到: {output_path}")
 
@@ -195,17 +496,36 @@ def save_qa_results(qa_pairs: List[Dict[str, str]], output_path: str = None):
 def main():
     """主函数"""
     print("=== PDF文本QA生成器 ===")
-    print("请选择包含full_text的JSON文件...")
 
-    # 选择并读取JSON文件
-    full_text = select_json_file()
+    # 命令行传入文件路径时不弹出对话框
+    if len(sys.argv) > 1:
+        full_text = read_full_text(sys.argv[1])
+    else:
+        print("请选择包含full_text的JSON文件...")
+        # 选择并读取JSON文件
+        full_text = select_json_file()
     if not full_text:
         return
 
     print(f"文本长度: {len(full_text)} 字符")
 
-    # 处理文本生成QA对
-    qa_results = process_text_to_qa(full_text)
+    # 处理文本生成QA对（并发与限流参数可通过环境变量调整）
+    cache = QACache()
+    try:
+        qa_results = process_text_to_qa(
+            full_text,
+            max_in_flight=int(os.environ.get("QA_MAX_IN_FLIGHT", "4")),
+            requests_per_minute=int(os.environ.get("QA_RPM", "0")) or None,
+            tokens_per_minute=int(os.environ.get("QA_TPM", "0")) or None,
+            cache=cache,
+            overlap_tokens=int(os.environ.get("QA_CHUNK_OVERLAP", "0")),
+            # QA_DEDUP_THRESHOLD=0 表示只去除完全相同的问题
+            dedup_threshold=float(os.environ.get("QA_DEDUP_THRESHOLD", str(DEFAULT_THRESHOLD))) or None,
+            dedup_report_path="qa_dedup_report.jsonl",
+        )
+        cache.report()
+    finally:
+        cache.close()
 
     if qa_results:
         # 保存结果
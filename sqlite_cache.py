@@ -0,0 +1,94 @@
+"""
+按（配置指纹, 文本）的哈希缓存计算结果的SQLite表，批量读写，可在多个线程间共享
+
+向量缓存（远程向量化接口和本地句向量模型共用）和分词缓存都基于它，子类只需指定表名和值的编解码。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+
+import numpy as np
+
+# SQLite单条语句的参数个数有限制，批量查询时分批
+QUERY_BATCH_SIZE = 500
+
+
+class SQLiteCache:
+    """键为哈希字符串的缓存表，子类实现 encode / decode"""
+
+    table = None
+    column = None
+    column_type = 'BLOB'
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, {self.column} {self.column_type} NOT NULL)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(signature, text):
+        """signature为影响结果的配置（如模型名或分词配置的指纹）"""
+        return hashlib.sha256(f"{signature}\n{text}".encode('utf-8')).hexdigest()
+
+    def encode(self, value):
+        raise NotImplementedError
+
+    def decode(self, stored):
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """批量读取，返回 {key: 值}"""
+        found = {}
+        unique_keys = list(set(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), QUERY_BATCH_SIZE):
+                batch = unique_keys[start:start + QUERY_BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, {self.column} FROM {self.table} WHERE key IN ({placeholders})", batch
+                )
+                for key, stored in rows:
+                    found[key] = self.decode(stored)
+        return found
+
+    def put_many(self, items):
+        """批量写入 {key: 值}"""
+        rows = [(key, self.encode(value)) for key, value in items.items()]
+        with self._lock:
+            self.conn.executemany(f"INSERT OR REPLACE INTO {self.table} (key, {self.column}) VALUES (?, ?)", rows)
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class EmbeddingCache(SQLiteCache):
+    """向量缓存，值为float32向量"""
+
+    table = 'embeddings'
+    column = 'vector'
+
+    def encode(self, value):
+        return np.asarray(value, dtype=np.float32).tobytes()
+
+    def decode(self, stored):
+        return np.frombuffer(stored, dtype=np.float32)
+
+
+class JSONCache(SQLiteCache):
+    """值为可JSON序列化对象的缓存"""
+
+    column_type = 'TEXT'
+
+    def encode(self, value):
+        return json.dumps(value, ensure_ascii=False)
+
+    def decode(self, stored):
+        return json.loads(stored)
@@ -0,0 +1,197 @@
+"""
+本地模拟的OpenAI兼容服务，用于在不访问真实大模型的情况下测试并发、限流和重试逻辑
+
+用法：
+    python stub_llm_server.py --port 8765 --latency 0.5 --fail-rate 0.2
+    ARK_BASE_URL=http://127.0.0.1:8765/v1 ARK_API_KEY=stub python split_pdf/semantic_split.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """处理 /chat/completions（支持stream）、/embeddings 和 /models 请求"""
+
+    # 使用HTTP/1.1，客户端可以复用连接
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    token_latency = 0.0
+    fail_rate = 0.0
+    in_flight = 0
+    max_in_flight = 0
+    total_requests = 0
+    total_connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        cls = type(self)
+        with cls.lock:
+            cls.total_connections += 1
+
+    def log_message(self, format, *args):
+        # 不打印每个请求的访问日志
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, completion):
+        """把回答拆成小片段，以SSE格式逐个发送（分块传输编码）"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(data):
+            payload = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(payload):X}\r\n".encode("ascii") + payload + b"\r\n")
+            self.wfile.flush()
+
+        content = completion["choices"][0]["message"]["content"]
+        for start in range(0, len(content), 4):
+            chunk = {
+                "id": completion["id"],
+                "object": "chat.completion.chunk",
+                "created": completion["created"],
+                "model": completion["model"],
+                "choices": [{"index": 0, "delta": {"content": content[start:start + 4]}, "finish_reason": None}],
+            }
+            send_event(json.dumps(chunk, ensure_ascii=False))
+            time.sleep(self.token_latency)
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        if self.path.endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        # 先读完请求体，保持连接上的下一个请求完整
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.endswith("/chat/completions"):
+            build_response = self._build_completion
+        elif self.path.endswith("/embeddings"):
+            build_response = self._build_embeddings
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        cls = type(self)
+        with cls.lock:
+            cls.total_requests += 1
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            if random.random() < cls.fail_rate:
+                self._send_json(
+                    429,
+                    {"error": {"message": "rate limited", "type": "rate_limit_error"}},
+                    headers={"Retry-After": "0.2"},
+                )
+                return
+
+            time.sleep(cls.latency)
+            if request.get("stream"):
+                self._send_stream(build_response(request))
+            else:
+                self._send_json(200, build_response(request))
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def _build_completion(self, request):
+        """根据最后一条用户消息生成确定性的回答"""
+        messages = request.get("messages", [])
+        user_content = messages[-1]["content"] if messages else ""
+        if request.get("response_format", {}).get("type") == "json_object":
+            # QA生成：用文本的最后一行构造一个问答对
+            last_line = user_content.strip().splitlines()[-1] if user_content.strip() else ""
+            content = json.dumps(
+                {"qa_pairs": [{"question": f"{last_line[:30]}是什么？", "answer": last_line}]},
+                ensure_ascii=False,
+            )
+        else:
+            content = "NOT_SIMILAR"
+
+        return {
+            "id": f"stub-{self.total_requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": len(user_content),
+                "completion_tokens": len(content),
+                "total_tokens": len(user_content) + len(content),
+            },
+        }
+
+
+    def _build_embeddings(self, request):
+        """根据文本哈希生成确定性的向量"""
+        texts = request.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        data = []
+        for i, text in enumerate(texts):
+            digest = hashlib.sha256(str(text).encode("utf-8")).digest()
+            data.append({"object": "embedding", "index": i, "embedding": [b / 255.0 - 0.5 for b in digest[:16]]})
+        tokens = sum(len(str(text)) for text in texts)
+        return {
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "stub"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的OpenAI兼容服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="每个请求的模拟延迟（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="流式响应中每个片段之间的间隔（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回429的概率")
+    args = parser.parse_args()
+
+    StubLLMHandler.latency = args.latency
+    StubLLMHandler.token_latency = args.token_latency
+    StubLLMHandler.fail_rate = args.fail_rate
+
+    server = ThreadingHTTPServer((args.host, args.port), StubLLMHandler)
+    print(f"模拟LLM服务已启动: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"共处理 {StubLLMHandler.total_requests} 个请求，{StubLLMHandler.total_connections} 个连接，"
+              f"最大并发 {StubLLMHandler.max_in_flight}")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
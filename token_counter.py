@@ -0,0 +1,18 @@
+"""
+token计数：所有模块共用同一个 cl100k_base 编码器，估算结果一致
+
+编码器在首次使用时加载并缓存，离线环境下导入依赖它的模块不会失败。
+"""
+import functools
+
+import tiktoken
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoder():
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    """估算文本的token数"""
+    return len(get_encoder().encode_ordinary(text))
@@ -0,0 +1,280 @@
+"""
+FAISS近似最近邻索引：flat（暴力检索）、IVF-Flat、IVF-PQ、HNSW
+
+默认使用内积（metric=ip）：向量先做L2归一化，检索分数即余弦相似度；旧版存储为L2距离（metric=l2），
+可用 migrate_store.py 转换。
+
+索引配置（类型、度量、建索引参数、查询参数nprobe/efSearch）保存在存储目录的 index_config.json 中，
+修改其中的nprobe/ef_search后重新加载即可生效，无需重建索引。
+
+用法（对比各类索引的召回率和延迟，并把选定的配置应用到存储）：
+    python ann_index.py --output-dir faiss_data --types ivf_flat ivf_pq hnsw
+    python ann_index.py --output-dir faiss_data --apply ivf_flat --nprobe 16
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+from mmap_store import replace_file
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+METRICS = {'ip': faiss.METRIC_INNER_PRODUCT, 'l2': faiss.METRIC_L2}
+INDEX_CONFIG_FILENAME = 'index_config.json'
+DEFAULT_INDEX_CONFIG = {'index_type': 'flat', 'metric': 'ip'}
+
+
+def default_nlist(n):
+    """IVF的聚类数：约4·√n，并保证每个聚类至少有39个训练样本"""
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def default_pq_m(dimension, max_m=64):
+    """PQ的子空间数：不超过max_m且能整除维度的最大值（每个子空间至少4维）"""
+    for m in range(min(max_m, dimension // 4), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def complete_config(config, n, dimension):
+    """
+    补全未指定的建索引参数
+    沿用旧配置重建时维度或数据量可能已经变化（如重新拟合词表后），不再适用的参数改用默认值
+    """
+    config = dict(DEFAULT_INDEX_CONFIG, **(config or {}))
+    index_type = config['index_type']
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type}，可选: {', '.join(INDEX_TYPES)}")
+    if config['metric'] not in METRICS:
+        raise ValueError(f"不支持的度量: {config['metric']}，可选: {', '.join(METRICS)}")
+
+    if config.get('nlist', 0) > max(n, 1):
+        print(f"nlist={config.pop('nlist')} 超过向量数 {n}，改用默认值")
+    if config.get('pq_m') and dimension % config['pq_m']:
+        print(f"pq_m={config.pop('pq_m')} 不能整除维度 {dimension}，改用默认值")
+    if config.get('pq_nbits') and 2 ** config['pq_nbits'] > max(n, 1):
+        print(f"pq_nbits={config.pop('pq_nbits')} 的码本大于向量数 {n}，改用默认值")
+
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        config.setdefault('nlist', default_nlist(n))
+        config.setdefault('nprobe', min(config['nlist'], 8))
+    if index_type == 'ivf_pq':
+        config.setdefault('pq_m', default_pq_m(dimension))
+        # 每个子空间的码本需要足够的训练样本
+        config.setdefault('pq_nbits', max(1, min(8, int(math.log2(max(n // 39, 2))))))
+    if index_type == 'hnsw':
+        config.setdefault('hnsw_m', 32)
+        config.setdefault('ef_construction', 40)
+        config.setdefault('ef_search', 64)
+    return config
+
+
+def _make_inner_index(config, dimension):
+    index_type = config['index_type']
+    metric = METRICS[config['metric']]
+    if index_type == 'flat':
+        return faiss.IndexFlat(dimension, metric)
+    # IVF的粗量化器与索引使用同一种度量
+    quantizer = faiss.IndexFlat(dimension, metric)
+    if index_type == 'ivf_flat':
+        return faiss.IndexIVFFlat(quantizer, dimension, config['nlist'], metric)
+    if index_type == 'ivf_pq':
+        return faiss.IndexIVFPQ(quantizer, dimension, config['nlist'], config['pq_m'], config['pq_nbits'], metric)
+    index = faiss.IndexHNSWFlat(dimension, config['hnsw_m'], metric)
+    index.hnsw.efConstruction = config['ef_construction']
+    return index
+
+
+def build_ann_index(vectors, ids, config=None, train_size=None, seed=0):
+    """
+    按配置创建索引，IVF类索引在随机抽样的向量上训练
+    :param vectors: float32矩阵（metric=ip时应已L2归一化，见normalize_vectors）
+    :param train_size: 训练样本数，默认为每个聚类中心（及PQ码字）64个样本
+    :return: IndexIDMap包装的索引
+    """
+    n, dimension = vectors.shape
+    config = complete_config(config, n, dimension)
+    inner = _make_inner_index(config, dimension)
+
+    if not inner.is_trained:
+        if train_size is None:
+            train_size = 64 * max(config['nlist'], 2 ** config.get('pq_nbits', 0))
+        sample = vectors
+        if n > train_size:
+            sample = vectors[np.random.default_rng(seed).choice(n, train_size, replace=False)]
+        start = time.perf_counter()
+        inner.train(np.ascontiguousarray(sample))
+        print(f"{config['index_type']} 索引训练完成（{len(sample)} 个样本），耗时 {time.perf_counter() - start:.2f} 秒")
+
+    index = faiss.IndexIDMap(inner)
+    index.add_with_ids(vectors, np.asarray(ids, dtype='int64'))
+    apply_search_params(index, config)
+    return index
+
+
+def inner_index(index):
+    """取出IndexIDMap包装的实际索引"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def normalize_vectors(vectors):
+    """返回L2归一化后的float32副本（全零向量保持为零），内积即余弦相似度"""
+    vectors = np.array(vectors, dtype='float32', order='C')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def index_metric(index):
+    """索引的度量：ip 或 l2"""
+    return 'ip' if index.metric_type == faiss.METRIC_INNER_PRODUCT else 'l2'
+
+
+def describe_index(index):
+    """从索引本身读出配置（类型、度量、建索引参数和当前查询参数）"""
+    inner = inner_index(index)
+    metric = index_metric(inner)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return {'index_type': 'ivf_pq', 'metric': metric, 'nlist': inner.nlist, 'nprobe': inner.nprobe,
+                'pq_m': inner.pq.M, 'pq_nbits': inner.pq.nbits}
+    if isinstance(inner, faiss.IndexIVFFlat):
+        return {'index_type': 'ivf_flat', 'metric': metric, 'nlist': inner.nlist, 'nprobe': inner.nprobe}
+    if isinstance(inner, faiss.IndexHNSWFlat):
+        return {'index_type': 'hnsw', 'metric': metric, 'hnsw_m': inner.hnsw.nb_neighbors(1),
+                'ef_construction': inner.hnsw.efConstruction, 'ef_search': inner.hnsw.efSearch}
+    return {'index_type': 'flat', 'metric': metric}
+
+
+def apply_search_params(index, config):
+    """设置查询参数：IVF的nprobe、HNSW的efSearch"""
+    inner = inner_index(index)
+    if isinstance(inner, faiss.IndexIVF) and config.get('nprobe'):
+        inner.nprobe = int(config['nprobe'])
+    if isinstance(inner, faiss.IndexHNSW) and config.get('ef_search'):
+        inner.hnsw.efSearch = int(config['ef_search'])
+
+
+def supports_remove(index):
+    """HNSW不支持按ID删除，增删时需要重建"""
+    return not isinstance(inner_index(index), faiss.IndexHNSW)
+
+
+def write_index_config(output_dir, config):
+    """先写临时文件再替换，热重载时不会读到写了一半的配置"""
+    def write(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+
+    replace_file(os.path.join(output_dir, INDEX_CONFIG_FILENAME), write)
+
+
+def read_index_config(output_dir):
+    """读取索引配置，不存在时返回None"""
+    path = os.path.join(output_dir, INDEX_CONFIG_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def stored_vectors(index):
+    """从flat索引中取出全部向量和ID，用于以其他类型重建"""
+    inner = inner_index(index)
+    if not isinstance(inner, faiss.IndexFlat):
+        raise ValueError("只能从flat索引中取出原始向量，请先用flat类型重建存储")
+    ids = faiss.vector_to_array(index.id_map) if inner is not index else np.arange(index.ntotal, dtype='int64')
+    return inner.reconstruct_n(0, inner.ntotal), ids
+
+
+def measure(index, queries, k, truth):
+    """逐条查询，返回 (recall@k, 平均每条查询毫秒数)"""
+    found = []
+    start = time.perf_counter()
+    for query in queries:
+        found.append(index.search(query[None, :], k)[1][0])
+    elapsed = time.perf_counter() - start
+
+    hits = total = 0
+    for expected, actual in zip(truth, found):
+        expected = set(expected[expected >= 0].tolist())
+        hits += len(expected & set(actual.tolist()))
+        total += len(expected)
+    return (hits / total if total else 1.0), elapsed / max(len(queries), 1) * 1000
+
+
+def benchmark(vectors, ids, queries, index_types, k=5, sweep=None, metric='ip'):
+    """
+    对比各类索引与flat索引的recall@k和延迟
+    :param sweep: {参数名: [取值]}，默认nprobe/efSearch各取一组
+    """
+    sweep = sweep or {'nprobe': [1, 2, 4, 8, 16, 32, 64], 'ef_search': [16, 32, 64, 128, 256]}
+    flat = build_ann_index(vectors, ids, {'index_type': 'flat', 'metric': metric})
+    truth = flat.search(queries, k)[1]
+    _, flat_ms = measure(flat, queries, k, truth)
+    print(f"\n{'索引':10s} {'参数':16s} {'recall@' + str(k):>10s} {'毫秒/查询':>10s} {'加速':>8s}")
+    print(f"{'flat':10s} {'-':16s} {1.0:10.3f} {flat_ms:10.3f} {1.0:8.1f}x")
+
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_ann_index(vectors, ids, {'index_type': index_type, 'metric': metric})
+        build_seconds = time.perf_counter() - start
+        config = describe_index(index)
+        param = 'ef_search' if index_type == 'hnsw' else 'nprobe'
+        values = [v for v in sweep[param] if index_type == 'hnsw' or v <= config['nlist']]
+        for value in values:
+            apply_search_params(index, {param: value})
+            recall, ms = measure(index, queries, k, truth)
+            print(f"{index_type:10s} {param + '=' + str(value):16s} {recall:10.3f} {ms:10.3f} {flat_ms / max(ms, 1e-9):8.1f}x")
+        print(f"{index_type:10s} 建索引耗时 {build_seconds:.2f} 秒，配置: {json.dumps(config, ensure_ascii=False)}")
+
+
+def main():
+    # faiss_vector_store依赖本模块，在这里导入避免循环导入
+    from faiss_vector_store import load_faiss_store, save_faiss_store, to_dense
+
+    parser = argparse.ArgumentParser(description="对比近似最近邻索引的召回率和延迟，或把选定的索引类型应用到存储")
+    parser.add_argument('--output-dir', default='faiss_data')
+    parser.add_argument('--types', nargs='+', choices=INDEX_TYPES[1:], default=list(INDEX_TYPES[1:]))
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=1000, help="用于评估的查询数（从已存问题中抽样）")
+    parser.add_argument('--apply', choices=INDEX_TYPES, help="以指定类型重建存储中的索引并保存")
+    parser.add_argument('--nlist', type=int)
+    parser.add_argument('--nprobe', type=int)
+    parser.add_argument('--pq-m', type=int)
+    parser.add_argument('--hnsw-m', type=int)
+    parser.add_argument('--ef-search', type=int)
+    args = parser.parse_args()
+
+    index, vectorizer, metadata = load_faiss_store(args.output_dir, mmap=False)
+    if index is None:
+        return
+    vectors, ids = stored_vectors(index)
+    metric = index_metric(index)
+
+    if args.apply:
+        config = {'index_type': args.apply, 'metric': metric}
+        for name in ('nlist', 'nprobe', 'pq_m', 'hnsw_m', 'ef_search'):
+            if getattr(args, name) is not None:
+                config[name] = getattr(args, name)
+        new_index = build_ann_index(vectors, ids, config)
+        save_faiss_store(new_index, vectorizer, metadata, args.output_dir)
+        print(f"✅ 已应用索引配置: {json.dumps(describe_index(new_index), ensure_ascii=False)}")
+        return
+
+    # 用已存问题作为查询（只用问题文本，比问答组合的向量更接近真实查询）
+    rng = np.random.default_rng(0)
+    sample_ids = rng.choice(ids, min(args.queries, len(ids)), replace=False)
+    questions = [metadata['records'][int(doc_id)]['question'] for doc_id in sample_ids]
+    queries = normalize_vectors(to_dense(vectorizer.transform(questions)))
+    print(f"向量数: {len(ids)}，维度: {vectors.shape[1]}，度量: {metric}，评估查询数: {len(queries)}")
+    benchmark(vectors, ids, queries, args.types, k=args.k, metric=metric)
+
+
+if __name__ == '__main__':
+    main()
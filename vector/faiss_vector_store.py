@@ -1,22 +1,58 @@
-import json
+import argparse
 import os
 import numpy as np
 import pickle
+import sys
+import time
 import faiss
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import jieba
+
+from jieba_tokenizer import JiebaTokenizer, TokenCache, default_workers, passthrough_preprocessor, tokenize_corpus
+from embeddings import EmbeddingCache, OnnxEmbedder, build_embedder, embed_corpus
+from sparse_index import SparseTfidfIndex, create_sparse_index
+from ann_index import (
+    DEFAULT_INDEX_CONFIG,
+    INDEX_CONFIG_FILENAME,
+    INDEX_TYPES,
+    apply_search_params,
+    build_ann_index,
+    describe_index,
+    index_metric,
+    normalize_vectors,
+    read_index_config,
+    write_index_config,
+)
+from mmap_store import (
+    CONFIG_FILENAME,
+    IDF_FILENAME,
+    IDS_FILENAME,
+    OFFSETS_FILENAME,
+    RECORDS_FILENAME,
+    STORE_FORMAT_VERSION,
+    VOCABULARY_FILENAME,
+    MmapRecords,
+    read_config,
+    read_vectorizer,
+    replace_file,
+    write_config,
+    write_records,
+    write_vectorizer,
+)
+
+# 添加上级目录到路径，以便导入jsonl_store
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from jsonl_store import find_data_file, load_qa_data
 
 def read_qa_json_file():
-    """读取QA JSON文件"""
+    """读取QA文件（JSONL或旧版JSON）"""
     # 获取当前文件所在目录的上级目录中的split_pdf文件夹
     current_dir = os.path.dirname(__file__)
     split_pdf_dir = os.path.join(current_dir, '..', 'split_pdf')
-    json_file_path = os.path.join(split_pdf_dir, 'qa_output_2_web_engineer.json')
+    json_file_path = find_data_file(split_pdf_dir, 'qa_output_2_web_engineer')
     
     try:
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = load_qa_data(json_file_path)
         
         print(f"成功读取QA文件: {os.path.basename(json_file_path)}")
         print(f"总共有 {data.get('total_qa_pairs', 0)} 个问答对")
@@ -38,139 +74,418 @@ def preprocess_text(text):
     text = re.sub(r'[^\w\s]', '', text)
     return text
 
-def create_tfidf_vectors(qa_data):
-    """使用TF-IDF创建文本向量"""
+def create_tfidf_vectors(qa_data, max_features=1000, tokenizer=None, workers=None, token_cache=None):
+    """
+    使用TF-IDF创建文本向量
+    :param tokenizer: 分词器（如JiebaTokenizer），None时使用TfidfVectorizer默认的正则分词
+    :param workers: 并行分词的进程数
+    :param token_cache: 分词结果缓存
+    """
     if not qa_data or 'qa_pairs' not in qa_data:
         print("没有找到QA数据")
         return None, None, None
     
     qa_pairs = qa_data['qa_pairs']
     
-    # 准备文本数据
-    questions = []
-    answers = []
+    # 准备文本数据，每个问答对分配一个稳定的ID
+    records = {}
     combined_texts = []
     
-    for qa in qa_pairs:
-        question = qa.get('question', '')
-        answer = qa.get('answer', '')
-        
-        questions.append(question)
-        answers.append(answer)
-        # 将问题和答案组合
-        combined_text = f"{question} {answer}"
-        combined_texts.append(preprocess_text(combined_text))
+    for doc_id, qa in enumerate(qa_pairs):
+        record = make_record(qa)
+        records[doc_id] = record
+        combined_texts.append(record['combined_text'])
     
     print(f"准备处理 {len(combined_texts)} 个文本...")
     
     # 创建TF-IDF向量
-    vectorizer = TfidfVectorizer(
-        max_features=1000,
-        stop_words=None,
-        ngram_range=(1, 2)
-    )
+    vectorizer = create_vectorizer(max_features, tokenizer)
+    
+    if tokenizer is not None:
+        # 先并行分词（命中缓存的文本跳过），再把词列表交给向量器
+        print("正在分词...")
+        documents = tokenize_corpus(combined_texts, tokenizer, workers=workers, cache=token_cache)
+    else:
+        documents = combined_texts
     
-    tfidf_matrix = vectorizer.fit_transform(combined_texts)
+    tfidf_matrix = vectorizer.fit_transform(documents)
     print(f"TF-IDF矩阵形状: {tfidf_matrix.shape}")
     
     return tfidf_matrix, vectorizer, {
-        'questions': questions,
-        'answers': answers,
-        'combined_texts': combined_texts
+        'records': records,
+        'next_id': len(records)
+    }
+
+def create_dense_vectors(qa_data, embedder, cache=None):
+    """
+    使用本地句向量模型创建稠密向量
+    :param embedder: OnnxEmbedder实例，之后作为向量器保存在存储中
+    :param cache: 句向量缓存
+    """
+    if not qa_data or 'qa_pairs' not in qa_data:
+        print("没有找到QA数据")
+        return None, None, None
+    
+    records = {doc_id: make_record(qa) for doc_id, qa in enumerate(qa_data['qa_pairs'])}
+    print(f"准备编码 {len(records)} 个文本...")
+    vectors = embed_corpus([record['combined_text'] for record in records.values()], embedder, cache=cache)
+    print(f"句向量矩阵形状: {vectors.shape}")
+    
+    return vectors, embedder, {
+        'records': records,
+        'next_id': len(records)
     }
 
-def create_faiss_index(tfidf_matrix):
-    """创建FAISS索引"""
-    # 转换为numpy数组
-    vectors = tfidf_matrix.toarray().astype('float32')
+def is_dense_embedder(vectorizer):
+    """向量器是否为句向量模型（没有词表，不需要重新拟合）"""
+    return isinstance(vectorizer, OnnxEmbedder)
+
+def create_vectorizer(max_features=1000, tokenizer=None):
+    """创建TF-IDF向量器"""
+    if tokenizer is not None:
+        # 分词器负责小写、去标点和停用词
+        return TfidfVectorizer(
+            max_features=max_features,
+            tokenizer=tokenizer,
+            preprocessor=passthrough_preprocessor,
+            lowercase=False,
+            token_pattern=None,
+            ngram_range=(1, 2)
+        )
+    return TfidfVectorizer(
+        max_features=max_features,
+        stop_words=None,
+        ngram_range=(1, 2)
+    )
+
+def make_record(qa):
+    """把问答对转换为按ID保存的元数据记录，保留调用方附带的其他字段"""
+    record = dict(qa)
+    record['question'] = qa.get('question', '')
+    record['answer'] = qa.get('answer', '')
+    # 将问题和答案组合
+    record['combined_text'] = preprocess_text(f"{record['question']} {record['answer']}")
+    return record
+
+def normalize_metadata(metadata):
+    """把旧版按位置保存的元数据（questions/answers列表）转换为按ID保存"""
+    if 'records' in metadata:
+        return metadata
+    
+    questions = metadata.get('questions', [])
+    answers = metadata.get('answers', [])
+    combined_texts = metadata.get('combined_texts') or [
+        preprocess_text(f"{q} {a}") for q, a in zip(questions, answers)
+    ]
+    records = {
+        doc_id: {'question': q, 'answer': a, 'combined_text': c}
+        for doc_id, (q, a, c) in enumerate(zip(questions, answers, combined_texts))
+    }
+    return {'records': records, 'next_id': len(records)}
+
+def create_faiss_index(tfidf_matrix, ids=None, index_config=None):
+    """
+    创建FAISS索引
+    :param tfidf_matrix: TF-IDF稀疏矩阵或句向量稠密矩阵
+    :param index_config: 索引配置（见ann_index），默认为暴力检索的flat索引
+    """
+    index_config = dict(DEFAULT_INDEX_CONFIG, **(index_config or {}))
+    # 转换为numpy数组（L2归一化，内积即余弦相似度；旧版L2索引同样使用归一化向量）
+    vectors = normalize_vectors(to_dense(tfidf_matrix))
     dimension = vectors.shape[1]
     
-    print(f"创建FAISS索引，维度: {dimension}")
+    if ids is None:
+        ids = np.arange(vectors.shape[0], dtype='int64')
+    
+    print(f"创建FAISS索引，类型: {index_config['index_type']}，度量: {index_config['metric']}，维度: {dimension}")
     
-    # 创建L2距离的索引
-    index = faiss.IndexFlatL2(dimension)
-    index.add(vectors)
+    # 外层用IndexIDMap保存稳定的ID，便于增量增删
+    index = build_ann_index(vectors, ids, index_config)
     
     print(f"FAISS索引创建完成，包含 {index.ntotal} 个向量")
     return index
 
+def create_index(tfidf_matrix, ids=None, backend='faiss', index_config=None):
+    """按后端创建索引：faiss为稠密索引（flat/IVF/HNSW），sparse为不稠密化的稀疏索引"""
+    if backend == 'sparse':
+        if not sp.issparse(tfidf_matrix):
+            raise ValueError("稀疏索引只能用于TF-IDF向量")
+        return create_sparse_index(tfidf_matrix, ids)
+    return create_faiss_index(tfidf_matrix, ids, index_config)
+
+def index_backend(index):
+    """返回索引对应的后端名称"""
+    return 'sparse' if isinstance(index, SparseTfidfIndex) else 'faiss'
+
+def to_dense(matrix):
+    """TF-IDF稀疏矩阵转换为稠密矩阵，句向量原样返回"""
+    return matrix.toarray() if sp.issparse(matrix) else matrix
+
+def encode_for_index(index, tfidf_matrix):
+    """把向量器的输出转换为索引接受的格式（稀疏索引保持稀疏，由索引自己归一化）"""
+    if isinstance(index, SparseTfidfIndex):
+        return tfidf_matrix
+    return normalize_vectors(to_dense(tfidf_matrix))
+
+def store_metric(index):
+    """索引检索分数的含义：ip为余弦相似度，l2为平方L2距离（旧版存储）"""
+    if isinstance(index, SparseTfidfIndex):
+        return 'ip'
+    return index_metric(index)
+
+def scores_to_similarities(index, scores, ids):
+    """
+    把索引返回的分数转换为[0, 1]区间的余弦相似度，不同查询之间可以直接比较
+    旧版L2索引的向量同样是归一化的，平方L2距离 d = 2 - 2·cos，因此 cos = 1 - d/2
+    """
+    scores = scores.astype('float64')
+    if store_metric(index) == 'l2':
+        scores = 1.0 - scores / 2.0
+    # 结果不足top_k的位置（ID为-1）相似度为0
+    return np.where(ids >= 0, np.clip(scores, 0.0, 1.0), 0.0).astype('float32')
+
+def ensure_id_map(index):
+    """旧版索引没有ID映射时，用位置作为ID重建为IndexIDMap"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, SparseTfidfIndex)):
+        return index
+    
+    vectors = index.reconstruct_n(0, index.ntotal)
+    id_map = faiss.IndexIDMap(faiss.IndexFlat(index.d, index.metric_type))
+    id_map.add_with_ids(vectors, np.arange(index.ntotal, dtype='int64'))
+    return id_map
+
 def save_faiss_store(index, vectorizer, metadata, output_dir='faiss_data'):
-    """保存FAISS向量存储到文件"""
+    """保存向量存储：索引、词表和idf、问答记录块分别写入，加载时可直接内存映射"""
     # 创建输出目录
     os.makedirs(output_dir, exist_ok=True)
     
-    # 保存FAISS索引
-    faiss_path = os.path.join(output_dir, 'qa_index.faiss')
-    faiss.write_index(index, faiss_path)
-    print(f"FAISS索引已保存到: {faiss_path}")
+    # 保存索引（稀疏索引保存为npz），并删除另一种后端的旧文件，避免加载时混淆
+    if isinstance(index, SparseTfidfIndex):
+        faiss_path = os.path.join(output_dir, 'qa_index.npz')
+        stale_paths = [os.path.join(output_dir, name) for name in ('qa_index.faiss', INDEX_CONFIG_FILENAME)]
+        replace_file(faiss_path, index.save)
+    else:
+        faiss_path = os.path.join(output_dir, 'qa_index.faiss')
+        stale_paths = [os.path.join(output_dir, 'qa_index.npz')]
+        replace_file(faiss_path, lambda path: faiss.write_index(index, path))
+        # 索引类型和查询参数随索引一起保存
+        write_index_config(output_dir, describe_index(index))
+    for stale_path in stale_paths:
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+    print(f"索引已保存到: {faiss_path}")
     
-    # 保存向量器
-    vectorizer_path = os.path.join(output_dir, 'tfidf_vectorizer.pkl')
-    with open(vectorizer_path, 'wb') as f:
-        pickle.dump(vectorizer, f)
-    print(f"TF-IDF向量器已保存到: {vectorizer_path}")
+    if is_dense_embedder(vectorizer):
+        # 句向量模型只保存配置（模型目录和编码参数），查询时从模型目录加载
+        vectorizer_config = None
+        vectorizer_path = os.path.join(output_dir, CONFIG_FILENAME)
+        for name in (VOCABULARY_FILENAME, IDF_FILENAME):
+            if os.path.exists(os.path.join(output_dir, name)):
+                os.remove(os.path.join(output_dir, name))
+        print(f"句向量模型: {os.path.join(vectorizer.model_dir, vectorizer.model_file)}")
+    else:
+        # 保存词表和idf（不再pickle整个向量器）
+        vectorizer_config = write_vectorizer(output_dir, vectorizer)
+        vectorizer_path = os.path.join(output_dir, VOCABULARY_FILENAME)
+        print(f"TF-IDF词表已保存到: {vectorizer_path}")
     
-    # 保存元数据
-    metadata_path = os.path.join(output_dir, 'qa_metadata.pkl')
-    with open(metadata_path, 'wb') as f:
-        pickle.dump(metadata, f)
-    print(f"元数据已保存到: {metadata_path}")
+    # 保存问答记录
+    write_records(output_dir, metadata['records'])
+    metadata_path = os.path.join(output_dir, RECORDS_FILENAME)
+    print(f"问答记录已保存到: {metadata_path}")
+    
+    # 配置最后写入，其他文件都已就绪
+    store_config = {
+        'format_version': STORE_FORMAT_VERSION,
+        'next_id': metadata['next_id'],
+    }
+    if vectorizer_config is None:
+        store_config['embedder'] = vectorizer.config()
+    else:
+        store_config['vectorizer'] = vectorizer_config
+    write_config(output_dir, store_config)
+    
+    # 删除旧版的pickle文件
+    for name in LEGACY_FILES:
+        legacy_path = os.path.join(output_dir, name)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
     
     return faiss_path, vectorizer_path, metadata_path
 
-def load_faiss_store(output_dir='faiss_data'):
-    """加载FAISS向量存储"""
+# 旧版存储的pickle文件
+LEGACY_FILES = ('tfidf_vectorizer.pkl', 'qa_metadata.pkl')
+
+# 向量存储目录中的文件，任何一个变化都意味着存储被重建或更新
+STORE_FILES = ('qa_index.faiss', 'qa_index.npz', INDEX_CONFIG_FILENAME, CONFIG_FILENAME, VOCABULARY_FILENAME, IDF_FILENAME,
+               RECORDS_FILENAME, OFFSETS_FILENAME, IDS_FILENAME) + LEGACY_FILES
+
+def store_fingerprint(output_dir='faiss_data'):
+    """存储文件的修改时间和大小，用于检测存储是否变化"""
+    fingerprint = []
+    for name in STORE_FILES:
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+def read_faiss_index(faiss_path, mmap=True):
+    """读取FAISS索引；mmap时向量数据按需从文件映射，多个进程共享页缓存（只读）"""
+    if mmap:
+        # 较新的faiss才支持映射平坦索引的向量（IO_FLAG_MMAP_IFC），旧版本退回普通读取
+        flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return faiss.read_index(faiss_path, flags)
+        except RuntimeError:
+            pass
+    return faiss.read_index(faiss_path)
+
+def load_faiss_store(output_dir='faiss_data', mmap=True):
+    """
+    加载FAISS向量存储
+    :param mmap: 是否以只读内存映射方式加载索引和问答记录；需要增删改时传False，得到可修改的副本
+    """
     try:
-        # 加载FAISS索引
-        faiss_path = os.path.join(output_dir, 'qa_index.faiss')
-        index = faiss.read_index(faiss_path)
-        print(f"FAISS索引加载成功，包含 {index.ntotal} 个向量")
+        start = time.perf_counter()
+        # 加载索引（优先识别稀疏索引）
+        sparse_path = os.path.join(output_dir, 'qa_index.npz')
+        if os.path.exists(sparse_path):
+            index = SparseTfidfIndex.load(sparse_path)
+            print(f"稀疏索引加载成功，包含 {index.ntotal} 个向量")
+        else:
+            faiss_path = os.path.join(output_dir, 'qa_index.faiss')
+            index = read_faiss_index(faiss_path, mmap=mmap)
+            # index_config.json中的nprobe/ef_search可以手动调整，加载时生效
+            index_config = read_index_config(output_dir)
+            if index_config:
+                apply_search_params(index, index_config)
+            print(f"FAISS索引加载成功（{describe_index(index)['index_type']}），包含 {index.ntotal} 个向量")
         
-        # 加载向量器
-        vectorizer_path = os.path.join(output_dir, 'tfidf_vectorizer.pkl')
-        with open(vectorizer_path, 'rb') as f:
-            vectorizer = pickle.load(f)
+        config = read_config(output_dir)
+        if config is None:
+            vectorizer, metadata = load_legacy_store(output_dir)
+        else:
+            if 'embedder' in config:
+                vectorizer = build_embedder(config['embedder'])
+            else:
+                vectorizer = read_vectorizer(output_dir, config['vectorizer'])
+            records = MmapRecords(output_dir, decorate=make_record)
+            if not mmap:
+                records = dict(records.items())
+            metadata = {'records': records, 'next_id': config['next_id']}
         
-        # 加载元数据
-        metadata_path = os.path.join(output_dir, 'qa_metadata.pkl')
-        with open(metadata_path, 'rb') as f:
-            metadata = pickle.load(f)
-        
-        print("✅ FAISS向量存储加载成功！")
+        print(f"✅ FAISS向量存储加载成功！耗时 {time.perf_counter() - start:.3f} 秒")
         return index, vectorizer, metadata
         
     except Exception as e:
         print(f"❌ 加载FAISS向量存储失败: {e}")
         return None, None, None
 
+def load_legacy_store(output_dir):
+    """加载旧版pickle格式的向量器和元数据（下次保存时转换为新格式）"""
+    # 加载向量器
+    vectorizer_path = os.path.join(output_dir, 'tfidf_vectorizer.pkl')
+    with open(vectorizer_path, 'rb') as f:
+        vectorizer = pickle.load(f)
+    
+    # 加载元数据
+    metadata_path = os.path.join(output_dir, 'qa_metadata.pkl')
+    with open(metadata_path, 'rb') as f:
+        metadata = normalize_metadata(pickle.load(f))
+    return vectorizer, metadata
+
 def search_similar_questions_faiss(index, vectorizer, metadata, query, top_k=5):
     """使用FAISS搜索相似问题"""
+    similarities, distances, ids = search_similar_questions_faiss_batch(index, vectorizer, [query], top_k=top_k)
+    return build_search_results(metadata, similarities[0], distances[0], ids[0])
+
+def search_similar_questions_faiss_batch(index, vectorizer, queries, top_k=5):
+    """
+    批量搜索相似问题：一次向量化、一次检索
+    :param queries: 查询文本列表
+    :return: (similarities, distances, ids)，形状均为 (查询数, top_k)；
+             similarities为余弦相似度，distances为余弦距离（1 - 相似度）；不足top_k的位置ID为-1、相似度为0
+    """
     # 预处理查询
-    processed_query = preprocess_text(query)
+    processed_queries = [preprocess_text(query) for query in queries]
     
-    # 将查询转换为TF-IDF向量
-    query_vector = vectorizer.transform([processed_query]).toarray().astype('float32')
+    # 将查询转换为TF-IDF向量（稀疏索引直接使用稀疏向量）
+    query_vectors = encode_for_index(index, vectorizer.transform(processed_queries))
     
     # 使用FAISS搜索
-    distances, indices = index.search(query_vector, top_k)
+    scores, ids = index.search(query_vectors, top_k)
     
+    similarities = scores_to_similarities(index, scores, ids)
+    return similarities, 1.0 - similarities, ids
+
+def build_search_results(metadata, similarities, distances, ids):
+    """把一个查询的检索结果数组转换为结果字典列表"""
     results = []
-    for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-        if idx < len(metadata['questions']):
-            # 将L2距离转换为相似度分数 (1 / (1 + distance))
-            similarity = 1 / (1 + distance)
+    for i, (similarity, distance, idx) in enumerate(zip(similarities, distances, ids)):
+        # 结果不足top_k时FAISS返回-1
+        record = metadata['records'].get(int(idx))
+        if record is not None:
             results.append({
                 'rank': i + 1,
+                'id': int(idx),
                 'similarity': float(similarity),
                 'distance': float(distance),
-                'question': metadata['questions'][idx],
-                'answer': metadata['answers'][idx]
+                'question': record['question'],
+                'answer': record['answer']
             })
     
     return results
 
+def iter_search_results(index, vectorizer, metadata, queries, top_k=5, batch_size=256):
+    """
+    流式批量搜索：queries可以是任意可迭代对象（如逐行读取的文件），内存中只保留一个批次
+    :return: 逐个产出 (query, results)
+    """
+    batch = []
+    for query in queries:
+        batch.append(query)
+        if len(batch) >= batch_size:
+            yield from _search_batch(index, vectorizer, metadata, batch, top_k)
+            batch = []
+    if batch:
+        yield from _search_batch(index, vectorizer, metadata, batch, top_k)
+
+def _search_batch(index, vectorizer, metadata, batch, top_k):
+    similarities, distances, ids = search_similar_questions_faiss_batch(index, vectorizer, batch, top_k=top_k)
+    for i, query in enumerate(batch):
+        yield query, build_search_results(metadata, similarities[i], distances[i], ids[i])
+
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="创建FAISS本地向量存储")
+    parser.add_argument('--output-dir', default='faiss_data', help="向量存储目录（混合检索的句向量存储可放在 faiss_data_dense）")
+    parser.add_argument('--backend', choices=['faiss', 'sparse'], default='faiss',
+                        help="索引后端：faiss为稠密索引，sparse为稀疏倒排索引（适合大词表）")
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default='flat',
+                        help="faiss后端的索引类型：flat暴力检索，ivf_flat/ivf_pq/hnsw为近似检索（问答库很大时使用）")
+    parser.add_argument('--metric', choices=['ip', 'l2'], default='ip',
+                        help="faiss后端的度量：ip为归一化向量的内积（余弦相似度），l2为旧版的L2距离")
+    parser.add_argument('--nlist', type=int, help="IVF聚类数（默认约4·√n）")
+    parser.add_argument('--nprobe', type=int, help="IVF查询时检查的聚类数")
+    parser.add_argument('--pq-m', type=int, help="IVF-PQ的子空间数（需整除维度）")
+    parser.add_argument('--hnsw-m', type=int, help="HNSW每个节点的邻居数")
+    parser.add_argument('--ef-search', type=int, help="HNSW查询时的候选队列长度")
+    parser.add_argument('--max-features', type=int, default=1000, help="TF-IDF词表大小")
+    parser.add_argument('--tokenizer', choices=['jieba', 'regex'], default='jieba',
+                        help="分词方式：jieba中文分词，或TfidfVectorizer默认的正则分词")
+    parser.add_argument('--user-dict', help="jieba用户词典路径")
+    parser.add_argument('--stopwords', help="停用词文件路径")
+    parser.add_argument('--workers', type=int, default=default_workers(), help="并行分词的进程数")
+    parser.add_argument('--embedding', choices=['tfidf', 'onnx'], default='tfidf',
+                        help="向量类型：tfidf为词频向量，onnx为本地句向量模型（需要--model-dir）")
+    parser.add_argument('--model-dir', help="句向量模型目录（含tokenizer.json和ONNX模型）")
+    parser.add_argument('--embed-batch-size', type=int, default=32, help="句向量每批编码的文本数")
+    parser.add_argument('--embed-threads', type=int, help="句向量推理线程数，默认由ONNX Runtime决定")
+    args = parser.parse_args()
+    if args.embedding == 'onnx' and (not args.model_dir or args.backend == 'sparse'):
+        parser.error("--embedding onnx 需要 --model-dir，且只能使用faiss后端")
+    
     print("=== FAISS本地向量存储系统 ===")
     print("正在初始化...")
     
@@ -180,28 +495,54 @@ def main():
         print("❌ 无法读取问答库，程序退出")
         return
     
-    # 创建TF-IDF向量
-    print("\n正在创建TF-IDF向量...")
-    tfidf_matrix, vectorizer, metadata = create_tfidf_vectors(qa_data)
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.embedding == 'onnx':
+        # 创建句向量（按内容哈希缓存，未变化的问答对不再编码）
+        print("\n正在创建句向量...")
+        embedder = OnnxEmbedder(args.model_dir, batch_size=args.embed_batch_size, threads=args.embed_threads)
+        embedding_cache = EmbeddingCache(os.path.join(args.output_dir, 'embedding_cache.sqlite3'))
+        tfidf_matrix, vectorizer, metadata = create_dense_vectors(qa_data, embedder, cache=embedding_cache)
+        embedding_cache.close()
+    else:
+        # 创建TF-IDF向量
+        print("\n正在创建TF-IDF向量...")
+        tokenizer = None
+        token_cache = None
+        if args.tokenizer == 'jieba':
+            tokenizer = JiebaTokenizer(user_dict=args.user_dict, stopwords_path=args.stopwords)
+            token_cache = TokenCache(os.path.join(args.output_dir, 'token_cache.sqlite3'))
+        tfidf_matrix, vectorizer, metadata = create_tfidf_vectors(
+            qa_data,
+            max_features=args.max_features,
+            tokenizer=tokenizer,
+            workers=args.workers,
+            token_cache=token_cache
+        )
+        if token_cache is not None:
+            token_cache.close()
     if tfidf_matrix is None:
-        print("❌ TF-IDF向量创建失败")
+        print("❌ 向量创建失败")
         return
     
-    # 创建FAISS索引
-    print("\n正在创建FAISS索引...")
-    index = create_faiss_index(tfidf_matrix)
+    # 创建索引
+    print(f"\n正在创建索引（后端: {args.backend}）...")
+    index_config = {'index_type': args.index_type, 'metric': args.metric}
+    for name in ('nlist', 'nprobe', 'pq_m', 'hnsw_m', 'ef_search'):
+        if getattr(args, name) is not None:
+            index_config[name] = getattr(args, name)
+    index = create_index(tfidf_matrix, ids=list(metadata['records']), backend=args.backend, index_config=index_config)
     if index is None:
         print("❌ FAISS索引创建失败")
         return
     
     # 保存FAISS向量存储
     print("\n正在保存FAISS向量存储...")
-    faiss_path, vectorizer_path, metadata_path = save_faiss_store(index, vectorizer, metadata)
+    faiss_path, vectorizer_path, metadata_path = save_faiss_store(index, vectorizer, metadata, args.output_dir)
     
     print("\n✅ FAISS向量存储创建完成！")
     print(f"FAISS索引文件: {faiss_path}")
     print(f"向量器文件: {vectorizer_path}")
-    print(f"元数据文件: {metadata_path}")
+    print(f"问答记录文件: {metadata_path}")
     
     # 测试搜索功能
     print("\n=== 测试FAISS搜索功能 ===")
@@ -216,13 +557,13 @@ def main():
         results = search_similar_questions_faiss(index, vectorizer, metadata, query, top_k=3)
         
         for result in results:
-            print(f"  {result['rank']}. 相似度: {result['similarity']:.4f} (距离: {result['distance']:.4f})")
+            print(f"  {result['rank']}. 相似度: {result['similarity']:.4f} (余弦距离: {result['distance']:.4f})")
             print(f"     问题: {result['question']}")
             print(f"     答案: {result['answer'][:100]}...")
     
     # 测试加载功能
     print("\n=== 测试加载功能 ===")
-    loaded_index, loaded_vectorizer, loaded_metadata = load_faiss_store()
+    loaded_index, loaded_vectorizer, loaded_metadata = load_faiss_store(args.output_dir)
     if loaded_index:
         print("✅ 加载测试成功！")
         results = search_similar_questions_faiss(loaded_index, loaded_vectorizer, loaded_metadata, "JavaScript数据类型", top_k=1)
@@ -0,0 +1,251 @@
+"""
+混合检索：TF-IDF（精确匹配Symbol、useEffect等API名）与句向量（匹配改写过的问题）两路并行检索，再融合排序
+
+两个存储需由同一份问答库建立，问答对的ID一致：
+    python faiss_vector_store.py                                                  # TF-IDF存储 faiss_data
+    python faiss_vector_store.py --embedding onnx --model-dir models/bge-small-zh --output-dir faiss_data_dense
+
+融合方式：
+    rrf       倒数排名融合 Σ w / (k + 排名)，不依赖两路分数的尺度
+    weighted  余弦相似度加权求和
+
+评估（各路与融合后的recall@k，以及各阶段延迟），标注文件格式同 tiered_decision.py：
+    python hybrid_retriever.py labeled.jsonl --dense-dir faiss_data_dense
+"""
+import argparse
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from faiss_vector_store import load_faiss_store, search_similar_questions_faiss_batch
+
+FUSION_METHODS = ('rrf', 'weighted')
+RRF_K = 60
+
+
+def check_aligned(primary_metadata, metadata, sample_size=100):
+    """抽查两个存储中相同ID的问题是否一致"""
+    if primary_metadata['next_id'] != metadata['next_id']:
+        return False
+    for doc_id in itertools.islice(iter(metadata['records']), sample_size):
+        record = primary_metadata['records'].get(doc_id)
+        if record is None or record['question'] != metadata['records'][doc_id]['question']:
+            return False
+    return True
+
+
+class HybridRetriever:
+    """
+    多路并行检索并融合，接口与 search_similar_questions_faiss 的结果格式一致
+
+    每条结果的 similarity 为各路余弦相似度按权重的平均（某一路没有召回时按0计），
+    可以继续用于分级判定；排序按 fused_score。
+    """
+
+    def __init__(self, stores, weights=None, fusion='rrf', candidate_k=20, rrf_k=RRF_K, history=1000):
+        """
+        :param stores: [(名称, index, vectorizer, metadata)]，第一个存储提供问答记录
+        :param weights: 各路权重，默认相同
+        :param candidate_k: 每一路参与融合的候选数
+        :param history: 每个阶段保留最近多少次的耗时，用于统计分位数
+        """
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"不支持的融合方式: {fusion}，可选: {', '.join(FUSION_METHODS)}")
+        primary_metadata = stores[0][3]
+        for name, _, _, metadata in stores[1:]:
+            if not check_aligned(primary_metadata, metadata):
+                raise ValueError(f"存储 {name} 与 {stores[0][0]} 的问答对ID不一致，请用同一份问答库重建")
+
+        self.stores = stores
+        self.weights = list(weights) if weights else [1.0] * len(stores)
+        self.fusion = fusion
+        self.candidate_k = candidate_k
+        self.rrf_k = rrf_k
+        # 每一路一个线程：FAISS检索和ONNX推理都会释放GIL
+        self.pool = ThreadPoolExecutor(max_workers=len(stores), thread_name_prefix='hybrid-search')
+        self._latencies = {name: deque(maxlen=history) for name in self.stage_names()}
+        self._lock = threading.Lock()
+
+    def stage_names(self):
+        return [name for name, _, _, _ in self.stores] + ['fusion', 'total']
+
+    @property
+    def metadata(self):
+        return self.stores[0][3]
+
+    def _search_store(self, store, queries, k):
+        _, index, vectorizer, _ = store
+        start = time.perf_counter()
+        similarities, _, ids = search_similar_questions_faiss_batch(index, vectorizer, queries, top_k=k)
+        return similarities, ids, (time.perf_counter() - start) * 1000
+
+    def warm_up(self, query="warm up"):
+        """预先加载分词词典和推理会话，避免第一个真实查询承担加载耗时（不计入统计）"""
+        for store in self.stores:
+            self._search_store(store, [query], 1)
+
+    def search_batch(self, queries, top_k=5):
+        """
+        批量检索
+        :return: (每个查询的结果列表, 各阶段耗时毫秒数 {名称: 毫秒})
+        """
+        start = time.perf_counter()
+        k = max(top_k, self.candidate_k)
+        futures = [self.pool.submit(self._search_store, store, queries, k) for store in self.stores]
+        outputs = [future.result() for future in futures]
+        timings = {store[0]: output[2] for store, output in zip(self.stores, outputs)}
+
+        fusion_start = time.perf_counter()
+        results = [self._fuse(outputs, row, top_k) for row in range(len(queries))]
+        timings['fusion'] = (time.perf_counter() - fusion_start) * 1000
+        timings['total'] = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            for name, ms in timings.items():
+                self._latencies[name].append(ms)
+        return results, timings
+
+    def search(self, query, top_k=5):
+        """检索单个查询，返回 (结果列表, 各阶段耗时)"""
+        results, timings = self.search_batch([query], top_k)
+        return results[0], timings
+
+    def iter_search_results(self, queries, top_k=5, batch_size=256):
+        """流式批量检索，逐个产出 (query, results)，与 faiss_vector_store.iter_search_results 对应"""
+        batch = []
+        for query in queries:
+            batch.append(query)
+            if len(batch) >= batch_size:
+                yield from zip(batch, self.search_batch(batch, top_k)[0])
+                batch = []
+        if batch:
+            yield from zip(batch, self.search_batch(batch, top_k)[0])
+
+    def _fuse(self, outputs, row, top_k):
+        scores = {}
+        sources = {}
+        for (name, _, _, _), weight, (similarities, ids, _) in zip(self.stores, self.weights, outputs):
+            for rank, (similarity, doc_id) in enumerate(zip(similarities[row], ids[row]), 1):
+                if doc_id < 0:
+                    continue
+                doc_id = int(doc_id)
+                if self.fusion == 'rrf':
+                    contribution = weight / (self.rrf_k + rank)
+                else:
+                    contribution = weight * float(similarity)
+                scores[doc_id] = scores.get(doc_id, 0.0) + contribution
+                sources.setdefault(doc_id, {})[name] = {'rank': rank, 'similarity': float(similarity)}
+
+        total_weight = sum(self.weights)
+        results = []
+        for doc_id in sorted(scores, key=lambda d: -scores[d]):
+            record = self.metadata['records'].get(doc_id)
+            if record is None:
+                continue
+            similarity = sum(
+                weight * sources[doc_id][name]['similarity']
+                for (name, _, _, _), weight in zip(self.stores, self.weights) if name in sources[doc_id]
+            ) / total_weight
+            results.append({
+                'rank': len(results) + 1,
+                'id': doc_id,
+                'similarity': similarity,
+                'distance': 1.0 - similarity,
+                'fused_score': scores[doc_id],
+                'sources': sources[doc_id],
+                'question': record['question'],
+                'answer': record['answer'],
+            })
+            if len(results) >= top_k:
+                break
+        return results
+
+    def stats(self):
+        """各阶段最近若干次耗时的p50/p95（毫秒）"""
+        with self._lock:
+            snapshot = {name: sorted(values) for name, values in self._latencies.items()}
+        stats = {}
+        for name, values in snapshot.items():
+            if values:
+                stats[name] = {
+                    'count': len(values),
+                    'p50_ms': values[len(values) // 2],
+                    'p95_ms': values[min(len(values) - 1, int(len(values) * 0.95))],
+                }
+        return stats
+
+    def report(self):
+        print("=== 混合检索各阶段耗时 ===")
+        for name, stage in self.stats().items():
+            print(f"{name:10s} p50 {stage['p50_ms']:8.2f} 毫秒  p95 {stage['p95_ms']:8.2f} 毫秒  （{stage['count']} 次）")
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+
+def load_hybrid_retriever(output_dir='faiss_data', dense_dir='faiss_data_dense', **kwargs):
+    """加载TF-IDF和句向量两个存储，任一加载失败时返回None"""
+    stores = []
+    for name, directory in (('tfidf', output_dir), ('dense', dense_dir)):
+        index, vectorizer, metadata = load_faiss_store(directory)
+        if index is None:
+            return None
+        stores.append((name, index, vectorizer, metadata))
+    try:
+        retriever = HybridRetriever(stores, **kwargs)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return None
+    retriever.warm_up()
+    return retriever
+
+
+def recall_at_k(labeled, results_list):
+    """有对应答案的查询中，正确答案出现在结果中的比例"""
+    hits = total = 0
+    for item, results in zip(labeled, results_list):
+        if item.get('expected_id') is None:
+            continue
+        total += 1
+        hits += any(r['id'] == item['expected_id'] for r in results)
+    return hits / total if total else 0.0
+
+
+def main():
+    from tiered_decision import read_labeled_samples
+
+    parser = argparse.ArgumentParser(description="评估混合检索的召回率和各阶段延迟")
+    parser.add_argument('labeled', help="标注文件（JSONL，格式同 tiered_decision.py）")
+    parser.add_argument('--output-dir', default='faiss_data', help="TF-IDF存储目录")
+    parser.add_argument('--dense-dir', default='faiss_data_dense', help="句向量存储目录")
+    parser.add_argument('--fusion', choices=FUSION_METHODS, default='rrf')
+    parser.add_argument('--weights', type=float, nargs=2, default=[1.0, 1.0], metavar=('TFIDF', 'DENSE'))
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--candidate-k', type=int, default=20)
+    args = parser.parse_args()
+
+    retriever = load_hybrid_retriever(args.output_dir, args.dense_dir, weights=args.weights,
+                                      fusion=args.fusion, candidate_k=args.candidate_k)
+    if retriever is None:
+        print("❌ 无法加载混合检索所需的向量存储，程序退出")
+        return
+
+    labeled = list(read_labeled_samples(args.labeled))
+    questions = [item['question'] for item in labeled]
+    print(f"\n评估查询数: {len(labeled)}，融合方式: {args.fusion}，权重: {args.weights}")
+    for name, index, vectorizer, _ in retriever.stores:
+        _, _, ids = search_similar_questions_faiss_batch(index, vectorizer, questions, top_k=args.top_k)
+        results_list = [[{'id': int(doc_id)} for doc_id in row] for row in ids]
+        print(f"{name:10s} recall@{args.top_k}: {recall_at_k(labeled, results_list):.3f}")
+
+    # 逐条检索，延迟统计与在线查询一致
+    fused = [retriever.search(question, top_k=args.top_k)[0] for question in questions]
+    print(f"{'hybrid':10s} recall@{args.top_k}: {recall_at_k(labeled, fused):.3f}")
+    retriever.report()
+    retriever.close()
+
+
+if __name__ == '__main__':
+    main()
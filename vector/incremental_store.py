@@ -0,0 +1,308 @@
+import argparse
+import threading
+
+import numpy as np
+from sklearn.base import clone
+
+from ann_index import describe_index, supports_remove
+from faiss_vector_store import (
+    create_index,
+    create_tfidf_vectors,
+    encode_for_index,
+    ensure_id_map,
+    index_backend,
+    is_dense_embedder,
+    load_faiss_store,
+    make_record,
+    read_qa_json_file,
+    save_faiss_store,
+    search_similar_questions_faiss,
+)
+
+
+class IncrementalQAStore:
+    """
+    支持增量追加、删除、更新的FAISS问答存储
+
+    小批量更新直接用已有的TF-IDF词表编码新文本，不重新拟合；
+    只有新文本中未登录词的累计占比超过阈值时才在后台重新拟合并重建索引。
+    句向量存储没有词表，不统计漂移，也不重新拟合。
+    """
+
+    def __init__(self, index, vectorizer, metadata, output_dir='faiss_data', drift_threshold=0.05, background_refit=True):
+        """
+        :param drift_threshold: 词表漂移阈值，超过后触发重新拟合
+        :param background_refit: 是否在后台线程中重新拟合（否则同步执行）
+        """
+        self.index = ensure_id_map(index)
+        self.vectorizer = vectorizer
+        self.metadata = metadata
+        self.output_dir = output_dir
+        self.drift_threshold = drift_threshold
+        self.background_refit = background_refit
+
+        self._lock = threading.RLock()
+        self._refit_thread = None
+        # 重新拟合期间发生变化的ID，拟合完成后需要用新词表重新编码
+        self._changed_during_refit = None
+        self._reset_drift()
+
+    @classmethod
+    def load(cls, output_dir='faiss_data', **kwargs):
+        """从目录加载已保存的存储（不使用内存映射，索引和记录需要可修改）"""
+        index, vectorizer, metadata = load_faiss_store(output_dir, mmap=False)
+        if index is None:
+            return None
+        return cls(index, vectorizer, metadata, output_dir=output_dir, **kwargs)
+
+    @classmethod
+    def create(cls, qa_pairs, output_dir='faiss_data', tokenizer=None, backend='faiss', max_features=1000,
+               index_config=None, **kwargs):
+        """用一批问答对新建存储"""
+        tfidf_matrix, vectorizer, metadata = create_tfidf_vectors(
+            {'qa_pairs': qa_pairs}, max_features=max_features, tokenizer=tokenizer
+        )
+        index = create_index(tfidf_matrix, ids=list(metadata['records']), backend=backend, index_config=index_config)
+        return cls(index, vectorizer, metadata, output_dir=output_dir, **kwargs)
+
+    def _reset_drift(self):
+        """重置漂移统计（重新拟合后调用）"""
+        self._corpus_terms = None
+        self._baseline_oov_rate = 0.0
+        self._drift_mass = 0.0
+
+    def _count_terms(self, texts):
+        """统计文本的词项总数和未登录词数"""
+        analyzer = self.vectorizer.build_analyzer()
+        vocabulary = self.vectorizer.vocabulary_
+        total = oov = 0
+        for text in texts:
+            terms = analyzer(text)
+            total += len(terms)
+            oov += sum(1 for term in terms if term not in vocabulary)
+        return total, oov
+
+    def _record_drift(self, texts):
+        """累计新文本带来的词表漂移"""
+        if self._corpus_terms is None:
+            # 词表本身有max_features上限，拟合语料也有未登录词，以它为基线
+            corpus = [r['combined_text'] for r in self.metadata['records'].values()]
+            total, oov = self._count_terms(corpus)
+            self._corpus_terms = max(total, 1)
+            self._baseline_oov_rate = oov / self._corpus_terms
+
+        total, oov = self._count_terms(texts)
+        if total:
+            excess_rate = max(0.0, oov / total - self._baseline_oov_rate)
+            self._drift_mass += excess_rate * total
+
+    def drift(self):
+        """当前词表漂移程度：超出基线的未登录词数 / 拟合时语料的词项数"""
+        if self._corpus_terms is None:
+            return 0.0
+        return self._drift_mass / self._corpus_terms
+
+    def _encode(self, records):
+        """用当前词表编码记录"""
+        texts = [r['combined_text'] for r in records]
+        return encode_for_index(self.index, self.vectorizer.transform(texts))
+
+    def add(self, qa_pairs):
+        """追加问答对，返回分配的ID列表"""
+        with self._lock:
+            start = self.metadata['next_id']
+            ids = list(range(start, start + len(qa_pairs)))
+            self.metadata['next_id'] = start + len(qa_pairs)
+            self._put(dict(zip(ids, qa_pairs)))
+            return ids
+
+    def upsert(self, items):
+        """按ID新增或替换问答对，items为 {id: qa} 字典"""
+        with self._lock:
+            self.metadata['next_id'] = max([self.metadata['next_id']] + [doc_id + 1 for doc_id in items])
+            self._put(items)
+
+    def delete(self, ids):
+        """按ID删除问答对，返回实际删除的数量"""
+        with self._lock:
+            existing = [doc_id for doc_id in ids if doc_id in self.metadata['records']]
+            if not existing:
+                return 0
+            for doc_id in existing:
+                del self.metadata['records'][doc_id]
+            self._remove_from_index(existing)
+            self._mark_changed(existing)
+            return len(existing)
+
+    def _remove_from_index(self, ids):
+        """从索引中删除向量；HNSW不支持删除，用当前词表重建（记录需已更新）"""
+        if supports_remove(self.index):
+            self.index.remove_ids(np.asarray(ids, dtype='int64'))
+            return
+        alive = list(self.metadata['records'])
+        vectors = self.vectorizer.transform([self.metadata['records'][doc_id]['combined_text'] for doc_id in alive])
+        self.index = create_index(vectors, alive, backend='faiss', index_config=describe_index(self.index))
+
+    def _put(self, items):
+        """写入记录和向量（已存在的ID先删除再写入）"""
+        if not items:
+            return
+        ids = np.asarray(list(items), dtype='int64')
+        records = [make_record(qa) for qa in items.values()]
+
+        replaced = [doc_id for doc_id in items if doc_id in self.metadata['records']]
+        if replaced:
+            # 先去掉旧记录，重建HNSW时不会包含旧向量
+            for doc_id in replaced:
+                del self.metadata['records'][doc_id]
+            self._remove_from_index(replaced)
+        self.index.add_with_ids(self._encode(records), ids)
+        for doc_id, record in zip(items, records):
+            self.metadata['records'][doc_id] = record
+        self._mark_changed(items)
+
+        if is_dense_embedder(self.vectorizer):
+            return
+        self._record_drift([r['combined_text'] for r in records])
+        if self.drift() > self.drift_threshold:
+            print(f"词表漂移 {self.drift():.2%} 超过阈值 {self.drift_threshold:.2%}，开始重新拟合...")
+            self.refit(background=self.background_refit)
+
+    def _mark_changed(self, ids):
+        if self._changed_during_refit is not None:
+            self._changed_during_refit.update(ids)
+
+    def refit(self, background=False):
+        """重新拟合TF-IDF词表并重建索引"""
+        if is_dense_embedder(self.vectorizer):
+            print("句向量存储不需要重新拟合")
+            return
+        with self._lock:
+            if self._refit_thread is not None and self._refit_thread.is_alive():
+                return
+            self._changed_during_refit = set()
+            snapshot = dict(self.metadata['records'])
+
+        if background:
+            self._refit_thread = threading.Thread(target=self._refit, args=(snapshot,), daemon=True)
+            self._refit_thread.start()
+        else:
+            self._refit(snapshot)
+
+    def _refit(self, snapshot):
+        """在锁外拟合新词表，完成后替换并补上拟合期间的变更"""
+        ids = list(snapshot)
+        # 沿用当前向量器的参数（词表大小等）、索引后端和索引类型（IVF在新向量上重新训练）
+        vectorizer = clone(self.vectorizer)
+        tfidf_matrix = vectorizer.fit_transform([snapshot[doc_id]['combined_text'] for doc_id in ids])
+        backend = index_backend(self.index)
+        index_config = describe_index(self.index) if backend == 'faiss' else None
+        index = create_index(tfidf_matrix, ids, backend=backend, index_config=index_config)
+
+        with self._lock:
+            changed = self._changed_during_refit
+            self._changed_during_refit = None
+            self.index, self.vectorizer = index, vectorizer
+            if changed and not supports_remove(self.index):
+                # HNSW无法删除拟合期间变化的向量，按当前记录重建
+                alive = list(self.metadata['records'])
+                texts = [self.metadata['records'][doc_id]['combined_text'] for doc_id in alive]
+                self.index = create_index(vectorizer.transform(texts), alive, backend=backend, index_config=index_config)
+            elif changed:
+                changed_ids = np.asarray(list(changed), dtype='int64')
+                self.index.remove_ids(changed_ids)
+                alive = [doc_id for doc_id in changed if doc_id in self.metadata['records']]
+                if alive:
+                    records = [self.metadata['records'][doc_id] for doc_id in alive]
+                    self.index.add_with_ids(self._encode(records), np.asarray(alive, dtype='int64'))
+            self._reset_drift()
+        print(f"✅ 重新拟合完成，索引包含 {self.index.ntotal} 个向量")
+
+    def wait_for_refit(self):
+        """等待后台重新拟合结束"""
+        if self._refit_thread is not None:
+            self._refit_thread.join()
+
+    def sync_with_qa_data(self, qa_data):
+        """
+        按问题文本与QA数据对齐：新增的问题追加，答案变化的更新，消失的删除
+        :return: (新增数, 更新数, 删除数)
+        """
+        with self._lock:
+            by_question = {r['question']: doc_id for doc_id, r in self.metadata['records'].items()}
+            added, updated = [], {}
+            seen = set()
+            for qa in qa_data.get('qa_pairs', []):
+                question = qa.get('question', '')
+                seen.add(question)
+                doc_id = by_question.get(question)
+                if doc_id is None:
+                    added.append(qa)
+                elif self.metadata['records'][doc_id]['answer'] != qa.get('answer', ''):
+                    updated[doc_id] = qa
+            removed = [doc_id for question, doc_id in by_question.items() if question not in seen]
+
+            self.delete(removed)
+            self.upsert(updated)
+            self.add(added)
+            return len(added), len(updated), len(removed)
+
+    def search(self, query, top_k=5):
+        """搜索相似问题"""
+        with self._lock:
+            return search_similar_questions_faiss(self.index, self.vectorizer, self.metadata, query, top_k=top_k)
+
+    def save(self):
+        """保存到output_dir"""
+        self.wait_for_refit()
+        with self._lock:
+            return save_faiss_store(self.index, self.vectorizer, self.metadata, self.output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="增量更新FAISS问答存储")
+    parser.add_argument('--output-dir', default='faiss_data')
+    parser.add_argument('--drift-threshold', type=float, default=0.05)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser('add', help="追加一个问答对")
+    add_parser.add_argument('--question', required=True)
+    add_parser.add_argument('--answer', required=True)
+
+    update_parser = subparsers.add_parser('update', help="更新指定ID的问答对")
+    update_parser.add_argument('--id', type=int, required=True)
+    update_parser.add_argument('--question', required=True)
+    update_parser.add_argument('--answer', required=True)
+
+    delete_parser = subparsers.add_parser('delete', help="删除指定ID的问答对")
+    delete_parser.add_argument('--id', type=int, nargs='+', required=True)
+
+    subparsers.add_parser('sync', help="与split_pdf中的QA JSON文件对齐")
+
+    args = parser.parse_args()
+
+    store = IncrementalQAStore.load(args.output_dir, drift_threshold=args.drift_threshold, background_refit=False)
+    if store is None:
+        print("❌ 无法加载FAISS向量存储，请先运行 faiss_vector_store.py 创建")
+        return
+
+    if args.command == 'add':
+        ids = store.add([{'question': args.question, 'answer': args.answer}])
+        print(f"✅ 已追加，ID: {ids[0]}")
+    elif args.command == 'update':
+        store.upsert({args.id: {'question': args.question, 'answer': args.answer}})
+        print(f"✅ 已更新 ID: {args.id}")
+    elif args.command == 'delete':
+        print(f"✅ 已删除 {store.delete(args.id)} 个问答对")
+    elif args.command == 'sync':
+        qa_data = read_qa_json_file()
+        if not qa_data:
+            return
+        added, updated, removed = store.sync_with_qa_data(qa_data)
+        print(f"✅ 同步完成：新增 {added}，更新 {updated}，删除 {removed}")
+
+    store.save()
+
+
+if __name__ == '__main__':
+    main()
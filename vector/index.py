@@ -1,73 +1,15 @@
-import json
 import os
 import sys
-import numpy as np
-import pickle
-import faiss
+import time
 
 # 添加上级目录到路径，以便导入llm_connector
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from llm_connector import create_client, chat_with_llm
-
-def load_faiss_store(output_dir='faiss_data'):
-    """加载FAISS向量存储"""
-    try:
-        # 加载FAISS索引
-        faiss_path = os.path.join(output_dir, 'qa_index.faiss')
-        index = faiss.read_index(faiss_path)
-        print(f"FAISS索引加载成功，包含 {index.ntotal} 个向量")
-        
-        # 加载向量器
-        vectorizer_path = os.path.join(output_dir, 'tfidf_vectorizer.pkl')
-        with open(vectorizer_path, 'rb') as f:
-            vectorizer = pickle.load(f)
-        
-        # 加载元数据
-        metadata_path = os.path.join(output_dir, 'qa_metadata.pkl')
-        with open(metadata_path, 'rb') as f:
-            metadata = pickle.load(f)
-        
-        print("✅ FAISS向量存储加载成功！")
-        return index, vectorizer, metadata
-        
-    except Exception as e:
-        print(f"❌ 加载FAISS向量存储失败: {e}")
-        return None, None, None
-
-def preprocess_text(text):
-    """预处理文本"""
-    # 简单的文本预处理
-    text = text.lower()
-    # 移除标点符号
-    import re
-    text = re.sub(r'[^\w\s]', '', text)
-    return text
-
-def search_similar_questions_faiss(index, vectorizer, metadata, query, top_k=5):
-    """使用FAISS搜索相似问题"""
-    # 预处理查询
-    processed_query = preprocess_text(query)
-    
-    # 将查询转换为TF-IDF向量
-    query_vector = vectorizer.transform([processed_query]).toarray().astype('float32')
-    
-    # 使用FAISS搜索
-    distances, indices = index.search(query_vector, top_k)
-    
-    results = []
-    for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-        if idx < len(metadata['questions']):
-            # 将L2距离转换为相似度分数 (1 / (1 + distance))
-            similarity = 1 / (1 + distance)
-            results.append({
-                'rank': i + 1,
-                'similarity': float(similarity),
-                'distance': float(distance),
-                'question': metadata['questions'][idx],
-                'answer': metadata['answers'][idx]
-            })
-    
-    return results
+# 与构建脚本共用加载和搜索逻辑，保证元数据格式一致
+from answer_cache import SemanticAnswerCache
+from faiss_vector_store import load_faiss_store, search_similar_questions_faiss, store_fingerprint
+from hybrid_retriever import load_hybrid_retriever
+from tiered_decision import TieredJudge, retrieval_mode
 
 def create_similarity_prompt(user_question, search_results):
     """创建相似度匹配的prompt"""
@@ -77,14 +19,14 @@ def create_similarity_prompt(user_question, search_results):
 
 用户问题：{user_question}
 
-请从以下搜索结果中找出与用户问题最相似的问题。如果找到相似度超过80%的问题，请回答"SIMILAR"并给出对应的答案；如果没有找到相似度超过80%的问题，请回答"NOT_SIMILAR"。
+请从以下搜索结果中找出与用户问题最相似的问题。每个结果附带检索得到的余弦相似度（0%表示无关，100%表示用词完全一致），仅供参考，请以语义为准。如果找到相似度超过80%的问题，请回答"SIMILAR"并给出对应的答案；如果没有找到相似度超过80%的问题，请回答"NOT_SIMILAR"。
 
 搜索结果：
 """
     
     # 添加搜索结果
     for i, result in enumerate(search_results[:5], 1):
-        prompt += f"{i}. 问题：{result['question']}\n   答案：{result['answer']}\n   相似度：{result['similarity']:.4f}\n\n"
+        prompt += f"{i}. 问题：{result['question']}\n   答案：{result['answer']}\n   相似度：{result['similarity']:.0%}\n\n"
     
     prompt += """请严格按照以下格式回答：
 - 如果找到相似问题：SIMILAR|答案内容
@@ -124,6 +66,36 @@ def ask_llm_for_similarity(client, user_question, search_results):
     
     return None, None
 
+def answer_question(index, vectorizer, metadata, judge, llm_judge, user_input, retriever=None):
+    """
+    检索相似问题并分级判定，返回 (结果, 答案)
+    :param retriever: 混合检索器，指定时代替单一的FAISS检索
+    """
+    # 使用FAISS搜索相似问题
+    print("🔍 正在搜索相似问题...")
+    if retriever is not None:
+        search_results, timings = retriever.search(user_input, top_k=5)
+        print("⏱️ 检索耗时: " + "，".join(f"{name} {ms:.1f}ms" for name, ms in timings.items()))
+    else:
+        search_results = search_similar_questions_faiss(index, vectorizer, metadata, user_input, top_k=5)
+    
+    if not search_results:
+        return "NOT_SIMILAR", None
+    
+    print(f"找到 {len(search_results)} 个相似问题")
+    # 显示前3个结果
+    for i, result in enumerate(search_results[:3], 1):
+        print(f"  {i}. 相似度: {result['similarity']:.4f} - {result['question']}")
+    
+    # 置信度明确时直接判定，否则使用大模型进行相似度匹配
+    start = time.perf_counter()
+    similarity_result, answer, tier = judge.decide(user_input, search_results, llm_judge)
+    if tier != 'llm':
+        print(f"⚡ 检索置信度明确，跳过大模型（{tier}）")
+    else:
+        print(f"⏱️ 大模型判定耗时: {(time.perf_counter() - start) * 1000:.0f}ms")
+    return similarity_result, answer
+
 def main():
     """主函数"""
     print("=== 智能问答系统（FAISS向量版）===")
@@ -135,12 +107,34 @@ def main():
         print("❌ 无法加载FAISS向量存储，程序退出")
         return
     
+    # 设置DENSE_STORE_DIR时使用TF-IDF + 句向量的混合检索
+    retriever = None
+    dense_dir = os.environ.get("DENSE_STORE_DIR")
+    fusion = os.environ.get("HYBRID_FUSION", "rrf")
+    if dense_dir:
+        retriever = load_hybrid_retriever('faiss_data', dense_dir, fusion=fusion)
+        if retriever is None:
+            print("❌ 无法加载混合检索，程序退出")
+            return
+    
     # 创建LLM客户端
     client = create_client()
     if not client:
         print("❌ 无法创建LLM客户端，程序退出")
         return
     
+    # 分级判定：只有模糊区间才调用大模型
+    judge = TieredJudge.load(retrieval=retrieval_mode(dense_dir, fusion))
+    llm_judge = lambda question, results: ask_llm_for_similarity(client, question, results)
+    
+    # 问答缓存：重复或改写过的问题直接返回之前的判定结果
+    answer_cache = SemanticAnswerCache()
+    # 句向量存储重建后缓存的答案同样可能过时
+    fingerprint = store_fingerprint()
+    if dense_dir:
+        fingerprint += store_fingerprint(dense_dir)
+    answer_cache.check_version(fingerprint)
+    
     print("✅ 系统初始化完成！")
     print("输入 'quit' 或 'exit' 退出对话")
     print("-" * 50)
@@ -153,34 +147,34 @@ def main():
                 continue
                 
             if user_input.lower() in ['quit', 'exit', '退出']:
+                judge.report()
+                answer_cache.report()
+                if retriever is not None:
+                    retriever.report()
                 print("👋 再见！")
                 break
             
-            # 使用FAISS搜索相似问题
-            print("🔍 正在搜索相似问题...")
-            search_results = search_similar_questions_faiss(index, vectorizer, metadata, user_input, top_k=5)
+            # 先查问答缓存
+            cached, match = answer_cache.get(user_input)
+            if cached is not None:
+                similarity_result, answer = cached
+                print(f"💾 命中缓存（{'精确' if match == 'exact' else '近似'}匹配）")
+            else:
+                similarity_result, answer = answer_question(index, vectorizer, metadata, judge, llm_judge, user_input, retriever)
+                if similarity_result is not None:
+                    answer_cache.put(user_input, (similarity_result, answer))
             
-            if search_results:
-                print(f"找到 {len(search_results)} 个相似问题")
-                # 显示前3个结果
-                for i, result in enumerate(search_results[:3], 1):
-                    print(f"  {i}. 相似度: {result['similarity']:.4f} - {result['question']}")
-                
-                # 使用大模型进行相似度匹配
-                print("🤖 正在分析问题相似度...")
-                similarity_result, answer = ask_llm_for_similarity(client, user_input, search_results)
-                
-                if similarity_result == "SIMILAR" and answer:
-                    print(f"✅ 找到相似问题")
-                    print(f"📝 答案：{answer}")
-                elif similarity_result == "NOT_SIMILAR":
-                    print("AI: 不好意思，我不知道")
-                else:
-                    print("AI: 不好意思，我不知道")
+            if similarity_result == "SIMILAR" and answer:
+                print(f"✅ 找到相似问题")
+                print(f"📝 答案：{answer}")
             else:
                 print("AI: 不好意思，我不知道")
                     
         except KeyboardInterrupt:
+            judge.report()
+            answer_cache.report()
+            if retriever is not None:
+                retriever.report()
             print("\n👋 再见！")
             break
         except Exception as e:
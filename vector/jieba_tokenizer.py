@@ -0,0 +1,162 @@
+import hashlib
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import jieba
+
+# 添加上级目录到路径，以便导入sqlite_cache
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from sqlite_cache import JSONCache
+
+# 默认停用词：只去掉几乎不影响语义的虚词
+DEFAULT_STOPWORDS = frozenset([
+    '的', '了', '和', '与', '及', '或', '在', '是', '吗', '呢', '吧', '啊', '之', '其', '一个',
+])
+
+_PUNCTUATION_ONLY = re.compile(r'[^\w]+')
+
+# 当前进程已加载到jieba中的用户词典
+_loaded_user_dicts = set()
+
+
+class JiebaTokenizer:
+    """
+    基于jieba的中文分词器，可作为TfidfVectorizer的tokenizer使用
+
+    已经分好词的文档（列表）会原样返回，这样批量建索引时可以先并行分词、
+    再把分词结果交给向量器，查询时仍然直接传入字符串。
+    """
+
+    def __init__(self, user_dict=None, stopwords_path=None, use_default_stopwords=True):
+        """
+        :param user_dict: jieba用户词典路径（每行：词 [词频] [词性]）
+        :param stopwords_path: 停用词文件路径（每行一个词）
+        :param use_default_stopwords: 是否使用内置的停用词
+        """
+        self.user_dict = user_dict
+        self.stopwords_path = stopwords_path
+        self.use_default_stopwords = use_default_stopwords
+        self._stopwords = None
+
+    def __getstate__(self):
+        # 停用词集合在使用时重新加载，不随向量器一起序列化
+        state = self.__dict__.copy()
+        state['_stopwords'] = None
+        return state
+
+    def _get_stopwords(self):
+        if self._stopwords is None:
+            stopwords = set(DEFAULT_STOPWORDS) if self.use_default_stopwords else set()
+            if self.stopwords_path:
+                with open(self.stopwords_path, 'r', encoding='utf-8') as f:
+                    stopwords.update(line.strip() for line in f if line.strip())
+            self._stopwords = stopwords
+        return self._stopwords
+
+    def _load_user_dict(self):
+        if self.user_dict and self.user_dict not in _loaded_user_dicts:
+            jieba.load_userdict(self.user_dict)
+            _loaded_user_dicts.add(self.user_dict)
+
+    def signature(self):
+        """分词配置的指纹，用于分词缓存的键"""
+        parts = [str(self.use_default_stopwords)]
+        for path in (self.user_dict, self.stopwords_path):
+            if path:
+                with open(path, 'rb') as f:
+                    parts.append(hashlib.sha256(f.read()).hexdigest())
+            else:
+                parts.append('')
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def tokenize(self, text):
+        """分词，并去掉空白、纯标点和停用词"""
+        self._load_user_dict()
+        stopwords = self._get_stopwords()
+        tokens = []
+        for token in jieba.lcut(text.lower()):
+            token = token.strip()
+            if not token or _PUNCTUATION_ONLY.fullmatch(token) or token in stopwords:
+                continue
+            tokens.append(token)
+        return tokens
+
+    def __call__(self, doc):
+        if isinstance(doc, (list, tuple)):
+            return list(doc)
+        return self.tokenize(doc)
+
+
+def passthrough_preprocessor(doc):
+    """向量器的预处理器：分词器自己负责小写和去标点"""
+    return doc
+
+
+class TokenCache(JSONCache):
+    """分词结果缓存，按（分词配置, 文本）的哈希保存，重建索引时未变化的文本不再分词"""
+
+    table = 'tokens'
+    column = 'tokens'
+
+
+_worker_tokenizer = None
+
+
+def _init_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+    # 在每个子进程中提前加载词典，避免第一批任务等待
+    jieba.initialize()
+
+
+def _tokenize_batch(texts):
+    return [_worker_tokenizer.tokenize(text) for text in texts]
+
+
+def tokenize_corpus(texts, tokenizer, workers=None, cache=None, batch_size=256):
+    """
+    批量分词
+    :param texts: 文本列表
+    :param tokenizer: JiebaTokenizer实例
+    :param workers: 进程数，None或1时在当前进程中分词
+    :param cache: TokenCache实例，命中的文本不再分词
+    :return: 与texts一一对应的词列表
+    """
+    results = [None] * len(texts)
+    keys = None
+    if cache is not None:
+        signature = tokenizer.signature()
+        keys = [TokenCache.make_key(signature, text) for text in texts]
+        cached = cache.get_many(keys)
+        for i, key in enumerate(keys):
+            if key in cached:
+                results[i] = cached[key]
+
+    pending = [i for i, tokens in enumerate(results) if tokens is None]
+    if cache is not None:
+        cache.hits += len(texts) - len(pending)
+        cache.misses += len(pending)
+        print(f"分词缓存命中 {len(texts) - len(pending)}/{len(texts)}")
+
+    if pending:
+        pending_texts = [texts[i] for i in pending]
+        if workers and workers > 1 and len(pending_texts) > batch_size:
+            batches = [pending_texts[s:s + batch_size] for s in range(0, len(pending_texts), batch_size)]
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tokenizer,)) as executor:
+                tokenized = [tokens for batch in executor.map(_tokenize_batch, batches) for tokens in batch]
+        else:
+            tokenized = [tokenizer.tokenize(text) for text in pending_texts]
+
+        for i, tokens in zip(pending, tokenized):
+            results[i] = tokens
+        if cache is not None:
+            cache.put_many({keys[i]: results[i] for i in pending})
+
+    return results
+
+
+def default_workers():
+    """默认分词进程数"""
+    return max(1, (os.cpu_count() or 1) - 1)
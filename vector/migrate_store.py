@@ -0,0 +1,154 @@
+"""
+把旧版L2距离的向量存储转换为内积（余弦相似度）存储
+
+旧版索引用平方L2距离检索，相似度为 1 / (1 + 距离)，不同查询之间不可比较。
+转换后索引改为内积检索，相似度即余弦相似度（0~1），分级判定阈值按同样的换算保存。
+TF-IDF向量本身已经是归一化的，转换前后每个查询的排序不变。
+
+用法：
+    python migrate_store.py --output-dir faiss_data
+    python migrate_store.py --output-dir faiss_data --backup   # 先把原文件复制到 faiss_data/l2_backup/
+    python migrate_store.py --output-dir faiss_data --restore  # 从备份恢复转换前的存储
+"""
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+
+from ann_index import build_ann_index, describe_index, normalize_vectors, stored_vectors
+from faiss_vector_store import (
+    STORE_FILES,
+    index_backend,
+    load_faiss_store,
+    save_faiss_store,
+    search_similar_questions_faiss_batch,
+    store_metric,
+    to_dense,
+)
+from tiered_decision import SIMILARITY_SCALE, THRESHOLDS_FILENAME, legacy_similarity_to_cosine
+
+BACKUP_DIRNAME = 'l2_backup'
+
+
+def rebuild_as_inner_product(index, vectorizer, metadata):
+    """以相同的索引类型和参数、内积度量重建索引"""
+    config = dict(describe_index(index), metric='ip')
+    try:
+        # flat索引直接取出原向量，不需要重新分词
+        vectors, ids = stored_vectors(index)
+    except ValueError:
+        ids = np.asarray(list(metadata['records']), dtype='int64')
+        texts = [metadata['records'][int(doc_id)]['combined_text'] for doc_id in ids]
+        vectors = to_dense(vectorizer.transform(texts))
+    return build_ann_index(normalize_vectors(vectors), ids, config)
+
+
+def compare_rankings(old_index, new_index, vectorizer, metadata, sample_size=200, top_k=5):
+    """用已存问题作为查询，统计转换前后top-1一致的比例"""
+    doc_ids = list(metadata['records'])
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(doc_ids), min(sample_size, len(doc_ids)), replace=False)
+    questions = [metadata['records'][doc_ids[i]]['question'] for i in sample]
+    if not questions:
+        return 1.0
+    _, _, old_ids = search_similar_questions_faiss_batch(old_index, vectorizer, questions, top_k)
+    _, _, new_ids = search_similar_questions_faiss_batch(new_index, vectorizer, questions, top_k)
+    return float(np.mean(old_ids[:, 0] == new_ids[:, 0]))
+
+
+def migrate_thresholds(output_dir):
+    """把旧口径的分级判定阈值换算为余弦相似度，返回是否做了换算"""
+    path = os.path.join(output_dir, THRESHOLDS_FILENAME)
+    if not os.path.exists(path):
+        return False
+    with open(path, 'r', encoding='utf-8') as f:
+        thresholds = json.load(f)
+    if thresholds.get('similarity') == SIMILARITY_SCALE:
+        return False
+
+    for name in ('accept_threshold', 'reject_threshold'):
+        old_value = thresholds[name]
+        thresholds[name] = legacy_similarity_to_cosine(old_value)
+        print(f"{name}: {old_value:.4f} -> {thresholds[name]:.4f}")
+    thresholds['similarity'] = SIMILARITY_SCALE
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(thresholds, f, ensure_ascii=False, indent=2)
+    return True
+
+
+# 转换时可能被改写或删除的文件：save_faiss_store写入和删除的全部存储文件（含旧版pickle），以及阈值文件
+BACKUP_FILES = STORE_FILES + (THRESHOLDS_FILENAME,)
+
+
+def backup_files(output_dir):
+    """复制会被改写或删除的文件，备份目录中只保留本次备份的文件"""
+    backup_dir = os.path.join(output_dir, BACKUP_DIRNAME)
+    if os.path.isdir(backup_dir):
+        shutil.rmtree(backup_dir)
+    os.makedirs(backup_dir)
+    for name in BACKUP_FILES:
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path):
+            shutil.copy2(path, os.path.join(backup_dir, name))
+    print(f"原文件已备份到: {backup_dir}")
+
+
+def restore_backup(output_dir):
+    """用备份替换当前的存储文件：备份中没有的存储文件（如转换时新写入的配置）一并删除"""
+    backup_dir = os.path.join(output_dir, BACKUP_DIRNAME)
+    if not os.path.isdir(backup_dir):
+        raise FileNotFoundError(f"没有找到备份目录: {backup_dir}")
+    for name in BACKUP_FILES:
+        path = os.path.join(output_dir, name)
+        backup_path = os.path.join(backup_dir, name)
+        if os.path.exists(backup_path):
+            shutil.copy2(backup_path, path)
+        elif os.path.exists(path):
+            os.remove(path)
+    print(f"已从备份恢复: {backup_dir}")
+
+
+def migrate_store(output_dir, backup=False, check_queries=200):
+    """转换存储和阈值，返回是否成功加载了存储"""
+    index, vectorizer, metadata = load_faiss_store(output_dir, mmap=False)
+    if index is None:
+        return False
+
+    if backup:
+        backup_files(output_dir)
+
+    if index_backend(index) == 'sparse' or store_metric(index) == 'ip':
+        print("索引已使用余弦相似度，无需转换")
+    else:
+        print(f"正在以内积度量重建索引（{describe_index(index)['index_type']}，{index.ntotal} 个向量）...")
+        new_index = rebuild_as_inner_product(index, vectorizer, metadata)
+        agreement = compare_rankings(index, new_index, vectorizer, metadata, check_queries)
+        print(f"转换前后top-1一致率: {agreement:.1%}")
+        save_faiss_store(new_index, vectorizer, metadata, output_dir)
+        print(f"✅ 索引已转换: {json.dumps(describe_index(new_index), ensure_ascii=False)}")
+
+    if migrate_thresholds(output_dir):
+        print(f"✅ 分级判定阈值已换算为余弦相似度: {THRESHOLDS_FILENAME}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把L2距离的FAISS存储转换为内积（余弦相似度）存储")
+    parser.add_argument('--output-dir', default='faiss_data')
+    parser.add_argument('--backup', action='store_true', help=f"转换前把原文件复制到 {BACKUP_DIRNAME}/ 子目录")
+    parser.add_argument('--restore', action='store_true', help=f"从 {BACKUP_DIRNAME}/ 恢复转换前的存储")
+    parser.add_argument('--check-queries', type=int, default=200, help="用于核对转换前后排序的查询数")
+    args = parser.parse_args()
+
+    if args.restore:
+        restore_backup(args.output_dir)
+        return
+
+    if not migrate_store(args.output_dir, args.backup, args.check_queries):
+        print("❌ 无法加载FAISS向量存储，程序退出")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+内存映射的向量存储格式
+
+    store_config.json        格式版本、next_id、索引读取方式和向量器/分词器参数
+    tfidf_vocabulary.json    按列序排列的词表
+    tfidf_idf.npy            每列的idf
+    qa_records.bin           每条问答记录一段UTF-8 JSON，首尾相接
+    qa_record_offsets.npy    第i条记录在qa_records.bin中的起止偏移（int64，长度n+1）
+    qa_record_ids.npy        第i条记录的ID（int64，升序）
+
+.npy和.bin文件都以只读mmap打开，多个工作进程共享同一份页缓存，启动时不随问答对数量增长。
+"""
+import json
+import mmap
+import os
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from jieba_tokenizer import JiebaTokenizer, passthrough_preprocessor
+
+STORE_FORMAT_VERSION = 1
+CONFIG_FILENAME = 'store_config.json'
+VOCABULARY_FILENAME = 'tfidf_vocabulary.json'
+IDF_FILENAME = 'tfidf_idf.npy'
+RECORDS_FILENAME = 'qa_records.bin'
+OFFSETS_FILENAME = 'qa_record_offsets.npy'
+IDS_FILENAME = 'qa_record_ids.npy'
+
+# 重建向量器时需要的参数（拟合阶段才用到的min_df/max_df等不影响transform）
+VECTORIZER_PARAMS = ('max_features', 'ngram_range', 'lowercase', 'token_pattern', 'stop_words',
+                     'norm', 'use_idf', 'smooth_idf', 'sublinear_tf', 'analyzer', 'strip_accents')
+
+
+def replace_file(path, write):
+    """先写临时文件再替换，读取方不会看到写了一半的文件"""
+    tmp_path = path + '.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def vectorizer_config(vectorizer):
+    """把向量器的参数转换为可写入JSON的配置，只支持本项目使用的两种配置"""
+    params = vectorizer.get_params()
+    config = {name: params[name] for name in VECTORIZER_PARAMS}
+    if isinstance(config['stop_words'], (set, frozenset)):
+        config['stop_words'] = sorted(config['stop_words'])
+
+    tokenizer = params['tokenizer']
+    if tokenizer is None:
+        config['tokenizer'] = None
+    elif isinstance(tokenizer, JiebaTokenizer):
+        config['tokenizer'] = {
+            'type': 'jieba',
+            'user_dict': tokenizer.user_dict,
+            'stopwords_path': tokenizer.stopwords_path,
+            'use_default_stopwords': tokenizer.use_default_stopwords,
+        }
+    else:
+        raise ValueError(f"不支持保存的分词器: {type(tokenizer).__name__}")
+
+    preprocessor = params['preprocessor']
+    if preprocessor is not None and preprocessor is not passthrough_preprocessor:
+        raise ValueError(f"不支持保存的预处理器: {preprocessor}")
+    config['preprocessor'] = 'passthrough' if preprocessor is passthrough_preprocessor else None
+    return config
+
+
+def build_vectorizer(config, vocabulary, idf):
+    """按配置、词表和idf重建已拟合的向量器，不需要重新拟合"""
+    params = {name: config[name] for name in VECTORIZER_PARAMS}
+    params['ngram_range'] = tuple(params['ngram_range'])
+    tokenizer = config['tokenizer']
+    if tokenizer is not None:
+        params['tokenizer'] = JiebaTokenizer(
+            user_dict=tokenizer['user_dict'],
+            stopwords_path=tokenizer['stopwords_path'],
+            use_default_stopwords=tokenizer['use_default_stopwords'],
+        )
+    if config['preprocessor'] == 'passthrough':
+        params['preprocessor'] = passthrough_preprocessor
+
+    vectorizer = TfidfVectorizer(**params)
+    vectorizer.vocabulary_ = {term: column for column, term in enumerate(vocabulary)}
+    vectorizer.fixed_vocabulary_ = False
+    if config['use_idf']:
+        vectorizer.idf_ = np.asarray(idf, dtype=np.float64)
+    return vectorizer
+
+
+def write_vectorizer(output_dir, vectorizer):
+    """保存词表和idf，返回写入store_config.json的向量器配置"""
+    config = vectorizer_config(vectorizer)
+    vocabulary = [None] * len(vectorizer.vocabulary_)
+    for term, column in vectorizer.vocabulary_.items():
+        vocabulary[column] = term
+
+    def write_vocabulary(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(vocabulary, f, ensure_ascii=False)
+
+    def write_idf(path):
+        with open(path, 'wb') as f:
+            np.save(f, np.asarray(vectorizer.idf_ if config['use_idf'] else [], dtype=np.float64))
+
+    replace_file(os.path.join(output_dir, VOCABULARY_FILENAME), write_vocabulary)
+    replace_file(os.path.join(output_dir, IDF_FILENAME), write_idf)
+    return config
+
+
+def read_vectorizer(output_dir, config):
+    with open(os.path.join(output_dir, VOCABULARY_FILENAME), 'r', encoding='utf-8') as f:
+        vocabulary = json.load(f)
+    idf = np.load(os.path.join(output_dir, IDF_FILENAME))
+    return build_vectorizer(config, vocabulary, idf)
+
+
+def write_records(output_dir, records, exclude=('combined_text',)):
+    """
+    按ID升序把记录写入字符串块和偏移数组
+    :param exclude: 不保存的字段（combined_text可由问答重新计算）
+    """
+    ids = np.array(sorted(records), dtype=np.int64)
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+
+    def write_blob(path):
+        with open(path, 'wb') as f:
+            for i, doc_id in enumerate(ids):
+                record = {k: v for k, v in records[int(doc_id)].items() if k not in exclude}
+                data = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                f.write(data)
+                offsets[i + 1] = offsets[i] + len(data)
+
+    def write_array(array):
+        def write(path):
+            with open(path, 'wb') as f:
+                np.save(f, array)
+        return write
+
+    replace_file(os.path.join(output_dir, RECORDS_FILENAME), write_blob)
+    replace_file(os.path.join(output_dir, OFFSETS_FILENAME), write_array(offsets))
+    replace_file(os.path.join(output_dir, IDS_FILENAME), write_array(ids))
+
+
+class MmapRecords:
+    """
+    只读的问答记录，接口与 metadata['records'] 字典一致（get、in、len、items等）
+    记录只在访问时才从mmap中解码
+    """
+
+    def __init__(self, output_dir, decorate=None):
+        """
+        :param decorate: 解码后对记录的处理（如补上combined_text）
+        """
+        self.ids = np.load(os.path.join(output_dir, IDS_FILENAME), mmap_mode='r')
+        self.offsets = np.load(os.path.join(output_dir, OFFSETS_FILENAME), mmap_mode='r')
+        self.decorate = decorate
+        with open(os.path.join(output_dir, RECORDS_FILENAME), 'rb') as f:
+            # 空文件不能mmap
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b''
+
+    def _position(self, doc_id):
+        position = int(np.searchsorted(self.ids, doc_id))
+        if position < len(self.ids) and self.ids[position] == doc_id:
+            return position
+        return None
+
+    def _decode(self, position):
+        record = json.loads(self._blob[self.offsets[position]:self.offsets[position + 1]])
+        return self.decorate(record) if self.decorate else record
+
+    def get(self, doc_id, default=None):
+        position = self._position(doc_id)
+        return default if position is None else self._decode(position)
+
+    def __getitem__(self, doc_id):
+        position = self._position(doc_id)
+        if position is None:
+            raise KeyError(doc_id)
+        return self._decode(position)
+
+    def __contains__(self, doc_id):
+        return self._position(doc_id) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (int(doc_id) for doc_id in self.ids)
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return (self._decode(position) for position in range(len(self.ids)))
+
+    def items(self):
+        return ((int(self.ids[position]), self._decode(position)) for position in range(len(self.ids)))
+
+
+def write_config(output_dir, config):
+    def write(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+    replace_file(os.path.join(output_dir, CONFIG_FILENAME), write)
+
+
+def read_config(output_dir):
+    """读取存储配置，旧版（pickle）存储返回None"""
+    path = os.path.join(output_dir, CONFIG_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if config.get('format_version') != STORE_FORMAT_VERSION:
+        raise ValueError(f"不支持的存储格式版本: {config.get('format_version')}")
+    return config
@@ -0,0 +1,330 @@
+"""
+常驻的本地问答查询服务：启动时加载一次FAISS向量存储，之后通过HTTP/JSON回答并发查询
+
+用法：
+    python query_service.py --port 8000
+    curl -X POST localhost:8000/search -d '{"query": "什么是Symbol？", "top_k": 3}'
+    curl -X POST localhost:8000/ask -d '{"question": "什么是Symbol？"}'
+
+混合检索（TF-IDF + 句向量并行检索后融合，见 hybrid_retriever.py）：
+    python query_service.py --dense-dir faiss_data_dense --fusion rrf
+
+使用本地模拟LLM测试：
+    python ../stub_llm_server.py --port 8765
+    ARK_BASE_URL=http://127.0.0.1:8765/v1 ARK_API_KEY=stub python query_service.py
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加上级目录到路径，以便导入llm_connector
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from answer_cache import SemanticAnswerCache
+from faiss_vector_store import iter_search_results, load_faiss_store, search_similar_questions_faiss, store_fingerprint
+from hybrid_retriever import HybridRetriever
+from index import ask_llm_for_similarity
+from llm_connector import create_client
+from tiered_decision import THRESHOLDS_FILENAME, TieredJudge, retrieval_mode
+
+
+# 单次请求返回的结果数上限，避免一个请求拖慢整个服务
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 100
+
+
+def parse_top_k(value):
+    """解析请求中的top_k（整数或数字字符串），不是正整数时抛出ValueError，超过上限时取上限"""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError("top_k 必须是正整数")
+    return min(value, MAX_TOP_K)
+
+
+class QueryService:
+    """持有已加载的向量存储，负责并发检索和热重载"""
+
+    def __init__(self, output_dir='faiss_data', search_threads=4, reload_interval=2.0, dense_dir=None, fusion='rrf',
+                 weights=None):
+        """
+        :param search_threads: 执行FAISS检索的线程数（FAISS检索时会释放GIL）
+        :param reload_interval: 检查存储文件变化的间隔（秒），0表示不热重载
+        :param dense_dir: 句向量存储目录，指定时使用混合检索
+        :param fusion: 混合检索的融合方式（rrf / weighted）
+        :param weights: 混合检索中TF-IDF和句向量的权重
+        """
+        self.output_dir = output_dir
+        self.dense_dir = dense_dir
+        self.fusion = fusion
+        self.weights = weights
+        self.reload_interval = reload_interval
+        self.search_pool = ThreadPoolExecutor(max_workers=search_threads, thread_name_prefix='faiss-search')
+        self.client = None
+        # 分级判定阈值随存储一起加载和替换
+        self.judge = None
+        self.answer_cache = SemanticAnswerCache()
+        self.version = 0
+        self.loaded_at = None
+        # (index, vectorizer, metadata) 作为一个整体替换，读者拿到的始终是一致的快照
+        self._store = None
+        # 混合检索器（未指定dense_dir时为None），与_store一起替换
+        self._retriever = None
+        self._fingerprint = None
+        self._stop = threading.Event()
+        self._watcher = None
+
+        if not self.reload():
+            raise RuntimeError(f"无法加载FAISS向量存储: {output_dir}")
+
+    def _current_fingerprint(self):
+        fingerprint = store_fingerprint(self.output_dir)
+        if self.dense_dir:
+            fingerprint += store_fingerprint(self.dense_dir)
+        # 重新校准阈值也触发重新加载
+        thresholds_path = os.path.join(self.output_dir, THRESHOLDS_FILENAME)
+        if os.path.exists(thresholds_path):
+            stat = os.stat(thresholds_path)
+            fingerprint += ((THRESHOLDS_FILENAME, stat.st_mtime_ns, stat.st_size),)
+        return fingerprint
+
+    def reload(self):
+        """重新加载存储，成功后原子替换"""
+        fingerprint = self._current_fingerprint()
+        index, vectorizer, metadata = load_faiss_store(self.output_dir)
+        if index is None:
+            return False
+        retriever = None
+        if self.dense_dir:
+            dense_index, dense_vectorizer, dense_metadata = load_faiss_store(self.dense_dir)
+            if dense_index is None:
+                return False
+            try:
+                retriever = HybridRetriever(
+                    [('tfidf', index, vectorizer, metadata), ('dense', dense_index, dense_vectorizer, dense_metadata)],
+                    weights=self.weights, fusion=self.fusion,
+                )
+            except ValueError as e:
+                # 两个存储可能正在分别重建，等下次变化时再加载
+                print(f"❌ {e}")
+                return False
+            retriever.warm_up()
+        # 阈值按新存储校准，与存储一起替换（判定统计从新版本开始重新计数）
+        judge = TieredJudge.load(self.output_dir, retrieval_mode(self.dense_dir, self.fusion))
+        # 旧的检索器不关闭，仍在使用旧快照的请求可以正常完成
+        self._store, self._retriever, self.judge = (index, vectorizer, metadata), retriever, judge
+        self._fingerprint = fingerprint
+        # 存储重建后缓存的答案可能已经过时
+        self.answer_cache.check_version(fingerprint)
+        self.version += 1
+        self.loaded_at = time.time()
+        return True
+
+    def start_watching(self):
+        """启动后台线程，存储文件变化时自动重新加载"""
+        if self.reload_interval <= 0:
+            return
+        self._watcher = threading.Thread(target=self._watch, name='store-watcher', daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        while not self._stop.wait(self.reload_interval):
+            fingerprint = self._current_fingerprint()
+            if fingerprint == self._fingerprint:
+                continue
+            # 等文件写完（两次检查结果一致）再加载
+            time.sleep(self.reload_interval / 2)
+            if fingerprint != self._current_fingerprint():
+                continue
+            print("🔄 检测到向量存储变化，正在重新加载...")
+            if self.reload():
+                print(f"✅ 重新加载完成（版本 {self.version}）")
+            else:
+                # 加载失败时继续使用旧版本，下次变化时再试
+                self._fingerprint = fingerprint
+
+    def search_with_timings(self, query, top_k=5):
+        """
+        检索单个查询，返回 (结果列表, 各阶段耗时毫秒数)
+        混合检索时耗时包含每一路检索和融合，否则只有total
+        """
+        retriever = self._retriever
+        if retriever is not None:
+            return retriever.search(query, top_k)
+        index, vectorizer, metadata = self._store
+        start = time.perf_counter()
+        results = self.search_pool.submit(
+            search_similar_questions_faiss, index, vectorizer, metadata, query, top_k
+        ).result()
+        return results, {'total': (time.perf_counter() - start) * 1000}
+
+    def search(self, query, top_k=5):
+        """在线程池中检索单个查询"""
+        return self.search_with_timings(query, top_k)[0]
+
+    def search_batch(self, queries, top_k=5):
+        """在线程池中批量检索"""
+        retriever = self._retriever
+        if retriever is not None:
+            return retriever.search_batch(queries, top_k)[0]
+        index, vectorizer, metadata = self._store
+
+        def run():
+            return [results for _, results in iter_search_results(index, vectorizer, metadata, queries, top_k=top_k)]
+
+        return self.search_pool.submit(run).result()
+
+    def _llm_judge(self, question, search_results):
+        """模糊区间才会调用大模型，客户端按需创建"""
+        if self.client is None:
+            self.client = create_client()
+            if self.client is None:
+                raise RuntimeError("无法创建LLM客户端")
+        return ask_llm_for_similarity(self.client, question, search_results)
+
+    def ask(self, question, top_k=5):
+        """先查问答缓存，未命中时检索并分级判定，只有模糊区间才使用大模型判断相似度"""
+        cached, match = self.answer_cache.get(question)
+        if cached is not None:
+            return dict(cached, cache=match)
+
+        search_results, timings = self.search_with_timings(question, top_k)
+        timings = {f"search_{name}": ms for name, ms in timings.items()}
+        start = time.perf_counter()
+        similarity_result, answer, tier = self.judge.decide(question, search_results, self._llm_judge)
+        timings['decide'] = (time.perf_counter() - start) * 1000
+        if similarity_result == "SIMILAR" and answer:
+            response = {'status': 'SIMILAR', 'answer': answer, 'tier': tier, 'results': search_results}
+        else:
+            response = {'status': 'NOT_SIMILAR', 'answer': "不好意思，我不知道", 'tier': tier, 'results': search_results}
+        if similarity_result is not None:
+            # 大模型调用失败时不缓存
+            self.answer_cache.put(question, response)
+        return dict(response, cache=None, timings_ms=timings)
+
+    def health(self):
+        index, _, metadata = self._store
+        health = {
+            'status': 'ok',
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'ntotal': int(index.ntotal),
+            'records': len(metadata['records']),
+            'decision': dict(self.judge.stats(), accept_threshold=self.judge.accept_threshold,
+                             reject_threshold=self.judge.reject_threshold),
+            'answer_cache': self.answer_cache.stats(),
+        }
+        if self._retriever is not None:
+            health['retrieval_latency'] = self._retriever.stats()
+        return health
+
+    def close(self):
+        self._stop.set()
+        self.search_pool.shutdown(wait=False)
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """HTTP/JSON接口"""
+
+    service = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, self.service.health())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        try:
+            body = self._read_json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self._send_json(400, {'error': '请求体不是合法的JSON'})
+            return
+        if not isinstance(body, dict):
+            self._send_json(400, {'error': '请求体必须是JSON对象'})
+            return
+
+        try:
+            top_k = parse_top_k(body.get('top_k', DEFAULT_TOP_K))
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            if self.path == '/search':
+                if 'queries' in body:
+                    queries = body['queries']
+                    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+                        self._send_json(400, {'error': 'queries 必须是字符串列表'})
+                    else:
+                        self._send_json(200, {'results': self.service.search_batch(queries, top_k)})
+                elif isinstance(body.get('query'), str) and body['query']:
+                    self._send_json(200, {'results': self.service.search(body['query'], top_k)})
+                else:
+                    self._send_json(400, {'error': '缺少 query 或 queries 字段'})
+            elif self.path == '/ask':
+                if isinstance(body.get('question'), str) and body['question']:
+                    self._send_json(200, self.service.ask(body['question'], top_k))
+                else:
+                    self._send_json(400, {'error': '缺少 question 字段'})
+            else:
+                self._send_json(404, {'error': 'not found'})
+        except Exception as e:
+            print(f"❌ 处理请求出错: {e}")
+            self._send_json(500, {'error': str(e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻的本地问答查询服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--output-dir', default='faiss_data', help="向量存储目录")
+    parser.add_argument('--search-threads', type=int, default=4, help="FAISS检索线程数")
+    parser.add_argument('--reload-interval', type=float, default=2.0, help="热重载检查间隔（秒），0表示关闭")
+    parser.add_argument('--dense-dir', help="句向量存储目录，指定时使用混合检索")
+    parser.add_argument('--fusion', choices=['rrf', 'weighted'], default='rrf', help="混合检索的融合方式")
+    parser.add_argument('--weights', type=float, nargs=2, metavar=('TFIDF', 'DENSE'), help="混合检索的权重")
+    args = parser.parse_args()
+
+    print("=== 问答查询服务 ===")
+    print("正在加载向量存储...")
+    try:
+        service = QueryService(args.output_dir, search_threads=args.search_threads, reload_interval=args.reload_interval,
+                               dense_dir=args.dense_dir, fusion=args.fusion, weights=args.weights)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return
+    service.start_watching()
+
+    QueryRequestHandler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), QueryRequestHandler)
+    print(f"✅ 服务已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 服务已停止")
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import json
+import time
+
+from faiss_vector_store import iter_search_results, load_faiss_store
+
+
+def read_queries(input_path):
+    """
+    逐行读取查询文件，不一次性加载到内存
+    支持纯文本（每行一个问题）和JSONL（取question或query字段）
+    """
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                record = json.loads(line)
+                yield record.get('question') or record.get('query') or ''
+            else:
+                yield line
+
+
+def replay_query_file(index, vectorizer, metadata, input_path, output_path, top_k=5, batch_size=256):
+    """批量回放查询文件，结果按行写入JSONL，返回处理的查询数"""
+    start = time.perf_counter()
+    count = 0
+    with open(output_path, 'w', encoding='utf-8') as out:
+        for query, results in iter_search_results(
+            index, vectorizer, metadata, read_queries(input_path), top_k=top_k, batch_size=batch_size
+        ):
+            out.write(json.dumps({'query': query, 'results': results}, ensure_ascii=False) + '\n')
+            count += 1
+            if count % (batch_size * 40) == 0:
+                elapsed = time.perf_counter() - start
+                print(f"已处理 {count} 个查询，{count / elapsed:.0f} 条/秒")
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ 共回放 {count} 个查询，耗时 {elapsed:.2f} 秒（{count / max(elapsed, 1e-9):.0f} 条/秒）")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量回放历史用户问题，用于检索质量检查")
+    parser.add_argument('input', help="查询文件（每行一个问题，或JSONL）")
+    parser.add_argument('output', help="结果输出文件（JSONL）")
+    parser.add_argument('--output-dir', default='faiss_data', help="向量存储目录")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=256)
+    args = parser.parse_args()
+
+    index, vectorizer, metadata = load_faiss_store(args.output_dir)
+    if index is None:
+        print("❌ 无法加载FAISS向量存储，程序退出")
+        return
+
+    replay_query_file(index, vectorizer, metadata, args.input, args.output, top_k=args.top_k, batch_size=args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+# 结果不足top_k时的填充值，与FAISS内积索引保持一致
+MISSING_ID = -1
+MISSING_SCORE = -np.finfo('float32').max
+
+
+class SparseTfidfIndex:
+    """
+    基于稀疏矩阵的TF-IDF检索索引，全程不转换为稠密矩阵
+
+    接口与FAISS索引保持一致（ntotal、add_with_ids、remove_ids、search），
+    search返回L2归一化向量之间的内积（即余弦相似度），
+    因此可以直接替换IndexFlatIP使用。
+    """
+
+    def __init__(self, dimension):
+        self.d = dimension
+        self._matrix = sp.csr_matrix((0, dimension), dtype='float32')
+        self._ids = np.empty(0, dtype='int64')
+        # 待合并的新增块，避免每次追加都复制整个矩阵
+        self._pending = []
+        # 倒排表（词项 × 文档），查询时只访问查询词对应的文档
+        self._postings = None
+
+    @property
+    def ntotal(self):
+        return self._matrix.shape[0] + sum(block.shape[0] for block, _ in self._pending)
+
+    def _consolidate(self):
+        """合并待追加的块"""
+        if self._pending:
+            self._matrix = sp.vstack([self._matrix] + [block for block, _ in self._pending], format='csr')
+            self._ids = np.concatenate([self._ids] + [ids for _, ids in self._pending])
+            self._pending = []
+            self._postings = None
+
+    def _get_postings(self):
+        """按需构建倒排表"""
+        self._consolidate()
+        if self._postings is None:
+            self._postings = self._matrix.T.tocsr()
+        return self._postings
+
+    def add_with_ids(self, matrix, ids):
+        """追加向量（稀疏矩阵），会做L2归一化"""
+        block = normalize(sp.csr_matrix(matrix, dtype='float32'), norm='l2', copy=True)
+        self._pending.append((block, np.asarray(ids, dtype='int64')))
+        self._postings = None
+
+    def remove_ids(self, ids):
+        """删除指定ID，返回删除的数量"""
+        self._consolidate()
+        remove = np.isin(self._ids, np.asarray(ids, dtype='int64'))
+        removed = int(remove.sum())
+        if removed:
+            keep = ~remove
+            self._matrix = self._matrix[keep]
+            self._ids = self._ids[keep]
+            self._postings = None
+        return removed
+
+    def search(self, queries, k):
+        """
+        搜索最相似的k个向量
+        :param queries: 查询矩阵（稀疏，每行一个查询）
+        :return: (scores, ids)，形状均为 (查询数, k)，scores为余弦相似度，从高到低
+        """
+        postings = self._get_postings()
+        queries = normalize(sp.csr_matrix(queries, dtype='float32'), norm='l2', copy=True)
+        # 稀疏 × 稀疏：只有与查询共享词项的文档才会出现在结果中
+        scores = (queries @ postings).tocsr()
+
+        n_queries = queries.shape[0]
+        result_scores = np.full((n_queries, k), MISSING_SCORE, dtype='float32')
+        labels = np.full((n_queries, k), MISSING_ID, dtype='int64')
+        for row in range(n_queries):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            if start == end:
+                continue
+            docs = scores.indices[start:end]
+            sims = scores.data[start:end]
+            if len(sims) > k:
+                top = np.argpartition(-sims, k - 1)[:k]
+                docs, sims = docs[top], sims[top]
+            order = np.argsort(-sims, kind='stable')
+            n = len(order)
+            result_scores[row, :n] = sims[order]
+            labels[row, :n] = self._ids[docs[order]]
+        return result_scores, labels
+
+    def save(self, path):
+        """保存为npz文件"""
+        self._consolidate()
+        # 传入文件对象，np.savez不会给路径补上.npz后缀
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                data=self._matrix.data,
+                indices=self._matrix.indices,
+                indptr=self._matrix.indptr,
+                shape=np.asarray(self._matrix.shape, dtype='int64'),
+                ids=self._ids,
+            )
+
+    @classmethod
+    def load(cls, path):
+        """从npz文件加载"""
+        with np.load(path) as data:
+            shape = tuple(data['shape'])
+            index = cls(shape[1])
+            index._matrix = sp.csr_matrix((data['data'], data['indices'], data['indptr']), shape=shape)
+            index._ids = data['ids']
+        return index
+
+
+def create_sparse_index(tfidf_matrix, ids=None):
+    """创建稀疏TF-IDF索引"""
+    if ids is None:
+        ids = np.arange(tfidf_matrix.shape[0], dtype='int64')
+
+    print(f"创建稀疏TF-IDF索引，维度: {tfidf_matrix.shape[1]}，非零元素: {tfidf_matrix.nnz}")
+    index = SparseTfidfIndex(tfidf_matrix.shape[1])
+    index.add_with_ids(tfidf_matrix, ids)
+
+    print(f"稀疏索引创建完成，包含 {index.ntotal} 个向量")
+    return index
@@ -0,0 +1,97 @@
+"""
+migrate_store.py 的备份与恢复：转换旧版pickle存储后，从备份恢复的存储仍然可以加载和检索
+
+    cd vector && python -m pytest test_migrate_store.py
+"""
+import os
+import pickle
+
+import faiss
+
+from faiss_vector_store import (
+    LEGACY_FILES,
+    create_vectorizer,
+    ensure_id_map,
+    load_faiss_store,
+    normalize_vectors,
+    preprocess_text,
+    save_faiss_store,
+    search_similar_questions_faiss,
+    store_metric,
+)
+from mmap_store import CONFIG_FILENAME
+from migrate_store import BACKUP_DIRNAME, migrate_store, restore_backup
+
+QA_PAIRS = [
+    ("什么是闭包", "函数和其词法环境的组合"),
+    ("useEffect什么时候执行", "组件渲染到屏幕之后执行"),
+    ("虚拟DOM有什么作用", "减少直接操作真实DOM的次数"),
+    ("Promise有哪几种状态", "pending、fulfilled和rejected"),
+]
+
+
+def write_legacy_store(output_dir):
+    """按旧版格式写入存储：L2距离的flat索引、pickle的向量器和按位置保存的元数据"""
+    questions = [q for q, _ in QA_PAIRS]
+    answers = [a for _, a in QA_PAIRS]
+    combined_texts = [preprocess_text(f"{q} {a}") for q, a in QA_PAIRS]
+    vectorizer = create_vectorizer()
+    vectors = normalize_vectors(vectorizer.fit_transform(combined_texts).toarray())
+
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    faiss.write_index(index, os.path.join(output_dir, 'qa_index.faiss'))
+    with open(os.path.join(output_dir, 'tfidf_vectorizer.pkl'), 'wb') as f:
+        pickle.dump(vectorizer, f)
+    with open(os.path.join(output_dir, 'qa_metadata.pkl'), 'wb') as f:
+        pickle.dump({'questions': questions, 'answers': answers, 'combined_texts': combined_texts}, f)
+
+
+def top_question(output_dir, query):
+    index, vectorizer, metadata = load_faiss_store(output_dir)
+    assert index is not None
+    results = search_similar_questions_faiss(index, vectorizer, metadata, query, top_k=1)
+    return store_metric(index), results[0]['question']
+
+
+def test_restore_after_migrating_legacy_store(tmp_path):
+    output_dir = str(tmp_path)
+    write_legacy_store(output_dir)
+    query = "Promise有哪几种状态"
+    assert top_question(output_dir, query) == ('l2', query)
+
+    assert migrate_store(output_dir, backup=True, check_queries=10)
+    # 转换后旧版pickle被删除，存储改为内积度量
+    assert not any(os.path.exists(os.path.join(output_dir, name)) for name in LEGACY_FILES)
+    assert top_question(output_dir, query) == ('ip', query)
+    for name in LEGACY_FILES:
+        assert os.path.exists(os.path.join(output_dir, BACKUP_DIRNAME, name))
+
+    restore_backup(output_dir)
+    # 恢复后是完整的旧版存储，转换时新写入的文件被删除
+    assert all(os.path.exists(os.path.join(output_dir, name)) for name in LEGACY_FILES)
+    assert not os.path.exists(os.path.join(output_dir, CONFIG_FILENAME))
+    assert top_question(output_dir, query) == ('l2', query)
+
+
+def read_files(output_dir):
+    return {name: open(os.path.join(output_dir, name), 'rb').read()
+            for name in os.listdir(output_dir) if os.path.isfile(os.path.join(output_dir, name))}
+
+
+def test_restore_after_migrating_mmap_store(tmp_path):
+    output_dir = str(tmp_path)
+    write_legacy_store(output_dir)
+    # 先保存为新格式（mmap文件）的L2存储
+    index, vectorizer, metadata = load_faiss_store(output_dir, mmap=False)
+    save_faiss_store(ensure_id_map(index), vectorizer, metadata, output_dir)
+    query = "什么是闭包"
+    assert top_question(output_dir, query) == ('l2', query)
+    original = read_files(output_dir)
+
+    assert migrate_store(output_dir, backup=True, check_queries=10)
+    assert top_question(output_dir, query) == ('ip', query)
+
+    restore_backup(output_dir)
+    assert read_files(output_dir) == original
+    assert top_question(output_dir, query) == ('l2', query)
@@ -0,0 +1,245 @@
+"""
+分级判定：检索置信度足够高时直接回答，明显不相关时直接回答"不知道"，
+只有中间的模糊区间才调用大模型判断相似度。
+
+阈值通过带标注的查询集离线校准：
+    python tiered_decision.py labeled.jsonl --output-dir faiss_data
+
+标注文件每行一个JSON：{"question": "用户问题", "expected_id": 12}，
+问答库中没有对应答案时 expected_id 为 null。
+使用混合检索时加上 --dense-dir faiss_data_dense，按融合后的相似度校准。
+"""
+import argparse
+import json
+import os
+import threading
+
+from faiss_vector_store import iter_search_results, load_faiss_store
+from hybrid_retriever import FUSION_METHODS, load_hybrid_retriever
+
+THRESHOLDS_FILENAME = 'decision_thresholds.json'
+# 阈值文件中记录的相似度口径，旧版文件没有该字段（按 1 / (1 + 平方L2距离) 校准）
+SIMILARITY_SCALE = 'cosine'
+
+# 未校准时的保守默认值（余弦相似度，与旧口径下的0.95/0.35等价）
+DEFAULT_ACCEPT_THRESHOLD = 0.97
+DEFAULT_REJECT_THRESHOLD = 0.07
+
+
+def legacy_similarity_to_cosine(similarity):
+    """
+    把旧口径的相似度 1 / (1 + d) 换算为余弦相似度（d为归一化向量的平方L2距离，d = 2 - 2·cos）
+    换算是单调的，旧阈值换算后判定结果不变；大于1的阈值（表示从不直接回答）保持不变
+    """
+    if similarity > 1.0:
+        return similarity
+    if similarity <= 0.0:
+        return 0.0
+    distance = 1.0 / similarity - 1.0
+    return max(0.0, 1.0 - distance / 2.0)
+
+
+def retrieval_mode(dense_dir=None, fusion='rrf'):
+    """阈值文件中记录的检索方式：单一存储为 single，混合检索为 hybrid-<融合方式>"""
+    return f"hybrid-{fusion}" if dense_dir else 'single'
+
+
+def read_thresholds(path):
+    """读取阈值文件，旧口径的阈值换算为余弦相似度"""
+    with open(path, 'r', encoding='utf-8') as f:
+        thresholds = json.load(f)
+    if thresholds.get('similarity') != SIMILARITY_SCALE:
+        print(f"⚠️ {path} 按旧的相似度口径校准，已换算为余弦相似度（可运行 migrate_store.py 保存换算结果）")
+        for name in ('accept_threshold', 'reject_threshold'):
+            thresholds[name] = legacy_similarity_to_cosine(thresholds[name])
+        thresholds['similarity'] = SIMILARITY_SCALE
+    return thresholds
+
+
+class TieredJudge:
+    """按top-1相似度分级判定，并统计避免了多少次大模型调用"""
+
+    def __init__(self, accept_threshold=DEFAULT_ACCEPT_THRESHOLD, reject_threshold=DEFAULT_REJECT_THRESHOLD):
+        """
+        :param accept_threshold: top-1相似度不低于该值时直接采用top-1答案
+        :param reject_threshold: top-1相似度低于该值时直接判定为没有相似问题
+        """
+        if reject_threshold > accept_threshold:
+            raise ValueError("reject_threshold 不能大于 accept_threshold")
+        self.accept_threshold = accept_threshold
+        self.reject_threshold = reject_threshold
+        self.direct_answers = 0
+        self.direct_rejects = 0
+        self.llm_calls = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, output_dir='faiss_data', retrieval='single'):
+        """
+        读取校准后的阈值，文件不存在时使用默认值
+        :param retrieval: 当前使用的检索方式（见 retrieval_mode），与校准时不一致时相似度分布不同，使用默认值
+        """
+        path = os.path.join(output_dir, THRESHOLDS_FILENAME)
+        if not os.path.exists(path):
+            return cls()
+        thresholds = read_thresholds(path)
+        # 旧版文件没有该字段，当时只有单一存储检索
+        calibrated = thresholds.get('retrieval', 'single')
+        if calibrated != retrieval:
+            print(f"⚠️ {path} 按 {calibrated} 检索校准，与当前的 {retrieval} 检索不一致，使用默认阈值"
+                  f"（请按当前检索方式重新运行 tiered_decision.py 校准）")
+            return cls()
+        return cls(thresholds['accept_threshold'], thresholds['reject_threshold'])
+
+    def decide(self, question, search_results, llm_judge):
+        """
+        判定用户问题是否有相似问题
+        :param llm_judge: 模糊区间使用的大模型判定函数 llm_judge(question, search_results) -> (结果, 答案)
+        :return: (结果, 答案, 判定层级)，层级为 accept / reject / llm
+        """
+        top_similarity = search_results[0]['similarity'] if search_results else 0.0
+
+        if top_similarity < self.reject_threshold:
+            with self._lock:
+                self.direct_rejects += 1
+            return "NOT_SIMILAR", None, 'reject'
+
+        if top_similarity >= self.accept_threshold:
+            with self._lock:
+                self.direct_answers += 1
+            return "SIMILAR", search_results[0]['answer'], 'accept'
+
+        with self._lock:
+            self.llm_calls += 1
+        similarity_result, answer = llm_judge(question, search_results)
+        return similarity_result, answer, 'llm'
+
+    @property
+    def llm_calls_avoided(self):
+        return self.direct_answers + self.direct_rejects
+
+    def stats(self):
+        total = self.llm_calls_avoided + self.llm_calls
+        return {
+            'total': total,
+            'direct_answers': self.direct_answers,
+            'direct_rejects': self.direct_rejects,
+            'llm_calls': self.llm_calls,
+            'llm_calls_avoided': self.llm_calls_avoided,
+            'avoided_rate': self.llm_calls_avoided / total if total else 0.0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        print("=== 分级判定统计 ===")
+        print(f"总查询: {stats['total']}  直接回答: {stats['direct_answers']}  直接拒答: {stats['direct_rejects']}")
+        print(f"调用大模型: {stats['llm_calls']}  避免调用: {stats['llm_calls_avoided']} ({stats['avoided_rate']:.1%})")
+
+
+def calibrate_thresholds(samples, target_precision=0.98):
+    """
+    根据带标注的样本校准阈值
+    :param samples: [(top-1相似度, top-1是否正确, 正确答案是否在检索结果中)]
+    :param target_precision: 直接回答/直接拒答需要达到的准确率
+    :return: (accept_threshold, reject_threshold)
+    """
+    if not samples:
+        return DEFAULT_ACCEPT_THRESHOLD, DEFAULT_REJECT_THRESHOLD
+
+    ordered = sorted(samples, key=lambda s: s[0], reverse=True)
+
+    # 直接回答：从高到低扫描，取top-1准确率仍满足要求的最低相似度
+    accept_threshold = float('inf')
+    correct = 0
+    for n, (similarity, top1_correct, _) in enumerate(ordered, 1):
+        correct += top1_correct
+        # 相同相似度的样本必须一起计入，才能作为阈值
+        tie_follows = n < len(ordered) and ordered[n][0] == similarity
+        if not tie_follows and correct / n >= target_precision:
+            accept_threshold = similarity
+
+    # 直接拒答：从低到高扫描，低于阈值的样本中"大模型也找不到答案"的比例要满足要求
+    reject_threshold = 0.0
+    safe = 0
+    ascending = ordered[::-1]
+    for n, (similarity, _, answer_retrieved) in enumerate(ascending, 1):
+        safe += not answer_retrieved
+        if safe / n < target_precision:
+            break
+        tie_follows = n < len(ascending) and ascending[n][0] == similarity
+        if not tie_follows:
+            # 阈值取在该样本之上，保证它落在拒答区间内
+            reject_threshold = similarity + 1e-6
+
+    reject_threshold = min(reject_threshold, accept_threshold)
+    if accept_threshold == float('inf'):
+        # 没有任何区间能达到目标准确率，全部交给大模型（相似度上限为1）
+        accept_threshold = 1.0 + 1e-6
+    return accept_threshold, reject_threshold
+
+
+def read_labeled_samples(path):
+    """读取标注文件"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="根据带标注的查询集离线校准分级判定阈值")
+    parser.add_argument('labeled', help="标注文件（JSONL）")
+    parser.add_argument('--output-dir', default='faiss_data', help="向量存储目录，阈值也保存在这里")
+    parser.add_argument('--target-precision', type=float, default=0.98)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--dense-dir', help="句向量存储目录，指定时按混合检索的结果校准")
+    parser.add_argument('--fusion', choices=FUSION_METHODS, default='rrf')
+    args = parser.parse_args()
+
+    labeled = list(read_labeled_samples(args.labeled))
+    questions = (item['question'] for item in labeled)
+    if args.dense_dir:
+        retriever = load_hybrid_retriever(args.output_dir, args.dense_dir, fusion=args.fusion)
+        if retriever is None:
+            print("❌ 无法加载混合检索所需的向量存储，程序退出")
+            return
+        search_results = retriever.iter_search_results(questions, top_k=args.top_k)
+    else:
+        index, vectorizer, metadata = load_faiss_store(args.output_dir)
+        if index is None:
+            print("❌ 无法加载FAISS向量存储，程序退出")
+            return
+        search_results = iter_search_results(index, vectorizer, metadata, questions, top_k=args.top_k)
+
+    samples = []
+    for item, (_, results) in zip(labeled, search_results):
+        expected_id = item.get('expected_id')
+        top_similarity = results[0]['similarity'] if results else 0.0
+        top1_correct = bool(results) and expected_id is not None and results[0]['id'] == expected_id
+        answer_retrieved = expected_id is not None and any(r['id'] == expected_id for r in results)
+        samples.append((top_similarity, top1_correct, answer_retrieved))
+
+    accept_threshold, reject_threshold = calibrate_thresholds(samples, args.target_precision)
+    accepted = sum(1 for s in samples if s[0] >= accept_threshold)
+    rejected = sum(1 for s in samples if s[0] < reject_threshold)
+
+    path = os.path.join(args.output_dir, THRESHOLDS_FILENAME)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'accept_threshold': accept_threshold,
+            'reject_threshold': reject_threshold,
+            'similarity': SIMILARITY_SCALE,
+            'retrieval': retrieval_mode(args.dense_dir, args.fusion),
+            'target_precision': args.target_precision,
+            'samples': len(samples),
+        }, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ 校准完成（{len(samples)} 个样本）")
+    print(f"直接回答阈值: {accept_threshold:.4f}  直接拒答阈值: {reject_threshold:.4f}")
+    print(f"在标注集上可避免 {accepted + rejected}/{len(samples)} 次大模型调用")
+    print(f"阈值已保存到: {path}")
+
+
+if __name__ == '__main__':
+    main()